@@ -3,6 +3,13 @@ USER=docker
 HOST=portainer.haakony.no
 DIR=/webservers/site-content-balls   # the directory where your website files should go
 
-hugo && rsync -avz --delete public/ ${USER}@${HOST}:~/${DIR} # this will delete everything on the server that's not in the local public folder
+# Precompressing needs the Python package; without it the server has to compress on the fly
+if python -c 'import balls_generation' 2>/dev/null; then
+    COMPRESS="python -m balls_generation compress"
+else
+    COMPRESS=true
+fi
+
+hugo && $COMPRESS && rsync -avz --delete public/ ${USER}@${HOST}:~/${DIR} # this will delete everything on the server that's not in the local public folder
 
 exit 0
@@ -3,7 +3,11 @@
 import os
 import random
 import logging
+import sys
+import json
+import argparse
 from datetime import datetime
+from typing import Optional
 
 # Configure logging first
 logging.basicConfig(
@@ -14,35 +18,389 @@ logging.basicConfig(
 from .generators.story import StoryGenerator
 from .generators.news import NewsGenerator
 from .image_providers import get_image_provider
+from .config.settings import LOG_FILE, TRACE_FILE
 
 logger = logging.getLogger(__name__)
 
-def main():
-    """Main function to generate content."""
+def generate(story_generator: Optional[StoryGenerator] = None, news_generator: Optional[NewsGenerator] = None,
+             publish_at: Optional[datetime] = None) -> Optional[str]:
+    """Generate a single story or news article, with the given generators if they are already built.
+    
+    With publish_at the post is written as a draft scheduled for that time.
+    """
     try:
         # Initialize generators
-        story_generator = StoryGenerator()
-        news_generator = NewsGenerator()
+        story_generator = story_generator or StoryGenerator()
+        news_generator = news_generator or NewsGenerator()
         
-        # Randomly choose between story and news
-        if random.random() < 0.5:
+        # Finish a post an earlier run left half done before starting a new one
+        pending = story_generator.journal.pending_content_type()
+        if pending:
+            logger.info(f"Resuming an unfinished {pending} post")
+        
+        # Otherwise randomly choose between story and news
+        if pending == "story" or (pending is None and random.random() < 0.5):
             logger.info("Generating story...")
-            filename = story_generator.generate_story()
+            filename = story_generator.generate_story(publish_at)
             if not filename:
                 logger.error("Failed to generate story")
-                return
+                return None
         else:
             logger.info("Generating news article...")
-            filename = news_generator.generate_article()
+            filename = news_generator.generate_article(publish_at)
             if not filename:
                 logger.error("Failed to generate article")
-                return
+                return None
         
         logger.info(f"Successfully generated content: {filename}")
+        return filename
         
     except Exception as e:
         logger.error(f"Error in main: {str(e)}")
         raise
 
+def report(args):
+    """Print a performance report and optionally write it as HTML."""
+    from .report import build_report, render_text, render_html
+    
+    stats = build_report(args.log, args.trace)
+    print(render_text(stats))
+    if args.html:
+        with open(args.html, "w", encoding="utf-8") as f:
+            f.write(render_html(stats))
+        print(f"HTML report written to: {args.html}")
+
+def bench(args):
+    """Run the end-to-end benchmark against local stub servers."""
+    from .stubs import StubConfig
+    from .benchmark import run_benchmark, render_results, compare_to_baseline, load_results
+    
+    if not args.verbose:
+        logging.getLogger("balls_generation").setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    config = StubConfig(
+        latency={"llm": args.llm_latency, "chat": args.openai_latency or args.llm_latency,
+                 "render": args.render_latency, "image": args.dalle_latency or args.render_latency},
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+        openai_concurrency=args.openai_concurrency,
+        blank_rate=args.blank_rate,
+    )
+    results = run_benchmark(args.posts, args.concurrency, config, args.llm_provider, args.image_provider, args.comfyui_nodes, args.ollama_nodes)
+    print(render_results(results))
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    
+    if args.baseline:
+        regressions = compare_to_baseline(results, load_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+def batch(args):
+    """Generate a backfill of posts through the OpenAI Batch API."""
+    from .batch import run_batch
+    
+    server = None
+    if args.stub:
+        from .stubs import StubServer
+        server = StubServer().start()
+        os.environ.update({
+            "OPENAI_BASE_URL": f"{server.url}/v1",
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "stub",
+            "OLLAMA_API_URL": server.url,
+            "COMFYUI_API_URL": server.url,
+        })
+        os.environ.pop("COMFYUI_API_URLS", None)
+        os.environ.pop("OLLAMA_API_URLS", None)
+    try:
+        written = run_batch(args.posts, args.poll_interval, args.resume)
+    finally:
+        if server:
+            server.stop()
+    if not written:
+        sys.exit(1)
+
+def sweep(args):
+    """Benchmark ComfyUI checkpoints and render settings against each other."""
+    from .sweep import run_sweep, render_text
+    
+    servers = []
+    endpoints = args.endpoints.split(",") if args.endpoints else None
+    checkpoints = args.checkpoints.split(",") if args.checkpoints else None
+    if args.stub:
+        from .stubs import StubConfig, StubServer
+        config = StubConfig(latency={"render": 2.0, "load": 3.0}, scale_render=True, checkpoints=[
+            "sd3_medium_incl_clips_t5xxlfp16.safetensors", "sdxl_base_1.0.safetensors",
+            "dreamshaper_8.safetensors", "sd15_inpainting.safetensors"])
+        servers = [StubServer(config).start() for _ in range(args.stub)]
+        endpoints = [server.url for server in servers]
+    try:
+        summary = run_sweep(
+            checkpoints=checkpoints,
+            steps=[int(count) for count in args.steps.split(",")],
+            samplers=args.samplers.split(",") if args.samplers else None,
+            resolutions=args.resolutions.split(",") if args.resolutions else None,
+            endpoints=endpoints,
+            prompt=args.prompt,
+            seed=args.seed,
+            repeat=args.repeat,
+            out_dir=args.out,
+        )
+    finally:
+        for server in servers:
+            server.stop()
+    print(render_text(summary))
+
+def buffer(args):
+    """Generate posts ahead of time as drafts for the upcoming publish slots."""
+    from .schedule import Schedule
+    
+    schedule = Schedule(args.times, args.window, args.posts)
+    story_generator = StoryGenerator()
+    news_generator = NewsGenerator()
+    written = schedule.fill_buffer(lambda slot: generate(story_generator, news_generator, slot))
+    logger.info(f"Buffered {written} posts, {len(schedule.pending())} waiting to be published")
+
+def publish(args):
+    """Put scheduled drafts live once their publish time has passed."""
+    from .schedule import Schedule
+    
+    schedule = Schedule()
+    if args.no_build:
+        schedule.command = ""
+    published = schedule.publish_due()
+    logger.info(f"Published {len(published)} posts")
+
+def enqueue(args):
+    """Add post jobs to the work queue for the generation workers."""
+    from .workqueue import enqueue_posts, get_work_queue
+    
+    queue = get_work_queue()
+    job_ids = enqueue_posts(args.posts, args.content_type, queue)
+    logger.info(f"Enqueued jobs {job_ids[0]}-{job_ids[-1]}" if job_ids else "Nothing enqueued")
+    print(json.dumps(queue.counts()))
+
+def worker(args):
+    """Generate posts for jobs leased from the work queue."""
+    from .workqueue import Worker
+    
+    completed = Worker(name=args.name).run(args.once, args.poll_interval)
+    logger.info(f"Worker finished after {completed} jobs")
+
+def collect(args):
+    """Write posts finished by the workers into this repository."""
+    from .workqueue import collect as collect_posts, get_work_queue
+    
+    queue = get_work_queue()
+    posts = collect_posts(queue)
+    logger.info(f"Collected {len(posts)} posts")
+    print(json.dumps(queue.counts()))
+
+def image_gc(args):
+    """Quarantine images that no post links to, and duplicate copies of the same image."""
+    from .image_gc import collect_garbage, restore
+    
+    if args.restore:
+        restore(args.restore)
+        return
+    report = collect_garbage(args.dry_run, grace_seconds=args.grace, workers=args.workers)
+    print(report.render(args.dry_run))
+    if args.verbose:
+        for image in report.unreferenced:
+            print(f"unreferenced  {image}")
+        for copy, kept in report.duplicates.items():
+            print(f"duplicate     {copy} (same as {kept})")
+
+def migrate_bundles(args):
+    """Move flat posts and their images into leaf page bundles."""
+    from .bundles import migrate
+    from .utils.search_index import SearchIndex
+    
+    migrations = migrate(args.dry_run)
+    if migrations and not args.dry_run:
+        # Every migrated post has a new URL
+        SearchIndex().rebuild()
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {len(migrations)} posts")
+
+def retag(args):
+    """Rewrite existing posts' tags against the vocabulary and move model tags into params."""
+    from .utils.tags import backfill
+    from .utils.search_index import SearchIndex
+    
+    changed = backfill(dry_run=args.dry_run, keep_unknown=args.keep_unknown or None)
+    if args.verbose:
+        for path in changed:
+            print(path)
+    if changed and not args.dry_run:
+        SearchIndex().rebuild()
+    print(f"{'Would retag' if args.dry_run else 'Retagged'} {len(changed)} posts")
+
+def search_index(args):
+    """Rebuild the sharded search index from the posts under content/."""
+    from .utils.search_index import SearchIndex
+    
+    index = SearchIndex(os.path.abspath(args.dir) if args.dir else None)
+    indexed = index.rebuild()
+    manifest = index.manifest()
+    print(f"Indexed {indexed} posts in {len(manifest['shards'])} shards under {index.directory}")
+
+def compress(args):
+    """Write gzip and brotli copies of the built site next to the originals."""
+    from .precompress import compress as precompress
+    
+    report = precompress(args.dir, workers=args.workers, force=args.force)
+    print(report.render())
+
+def daemon(args):
+    """Generate posts on a schedule from one long-running process."""
+    from .daemon import run_daemon, parse_interval
+    
+    run_daemon(parse_interval(args.interval) if args.interval else None, args.host, args.port, args.paused, args.buffer)
+
+def main(argv=None):
+    """Main function, dispatching to the requested command."""
+    parser = argparse.ArgumentParser(prog="balls_generation", description="Generate stories and news about balls.")
+    commands = parser.add_subparsers(dest="command")
+    
+    commands.add_parser("generate", help="Generate one post (the default)")
+    
+    report_parser = commands.add_parser("report", help="Summarise stage latencies from cron.log and traces")
+    report_parser.add_argument("--log", default=LOG_FILE, help="cron.log-style log file to read")
+    report_parser.add_argument("--trace", default=TRACE_FILE, help="JSONL trace file to read")
+    report_parser.add_argument("--html", help="Write a static HTML summary to this path")
+    
+    bench_parser = commands.add_parser("bench", help="Benchmark the pipeline against local stub servers")
+    bench_parser.add_argument("--posts", type=int, default=4, help="Number of posts to generate")
+    bench_parser.add_argument("--concurrency", type=int, default=1, help="Posts generated in parallel (1 = single-post mode)")
+    bench_parser.add_argument("--llm-provider", choices=["ollama", "openai", "router"], default="ollama",
+                              help="router sends each request to Ollama or OpenAI by observed latency")
+    bench_parser.add_argument("--image-provider", choices=["comfyui", "dalle", "hedged"], default="comfyui")
+    bench_parser.add_argument("--comfyui-nodes", type=int, default=1, help="Stub ComfyUI hosts behind the pool provider")
+    bench_parser.add_argument("--ollama-nodes", type=int, default=1, help="Stub Ollama hosts behind the pool provider")
+    bench_parser.add_argument("--llm-latency", type=float, default=0.5, help="Stub text generation latency in seconds")
+    bench_parser.add_argument("--openai-latency", type=float, help="Stub OpenAI chat latency in seconds (defaults to --llm-latency)")
+    bench_parser.add_argument("--render-latency", type=float, default=2.0, help="Stub image generation latency in seconds")
+    bench_parser.add_argument("--dalle-latency", type=float, help="Stub DALL-E latency in seconds (defaults to --render-latency)")
+    bench_parser.add_argument("--jitter", type=float, default=0.0, help="Latency jitter as a fraction, e.g. 0.2")
+    bench_parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of stub requests that fail")
+    bench_parser.add_argument("--blank-rate", type=float, default=0.0, help="Fraction of stub ComfyUI renders that come out blank")
+    bench_parser.add_argument("--openai-concurrency", type=int, help="Stub OpenAI answers 429 beyond this many requests in flight")
+    bench_parser.add_argument("--seed", type=int, help="Random seed for jitter and failures")
+    bench_parser.add_argument("--json", help="Save results to this JSON file")
+    bench_parser.add_argument("--baseline", help="Compare against results saved with --json; exits 1 on regression")
+    bench_parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed regression as a fraction")
+    bench_parser.add_argument("--verbose", action="store_true", help="Show provider logging")
+    
+    batch_parser = commands.add_parser("batch", help="Backfill posts through the OpenAI Batch API")
+    batch_parser.add_argument("--posts", type=int, default=30, help="Number of posts to generate")
+    batch_parser.add_argument("--poll-interval", type=float, default=60, help="Seconds between batch status checks")
+    batch_parser.add_argument("--resume", metavar="DIR", help="Finish an earlier batch, given its directory or its name under BATCH_DIR")
+    batch_parser.add_argument("--stub", action="store_true", help="Run against the local stub servers instead of OpenAI")
+    
+    sweep_parser = commands.add_parser("sweep", help="Compare render speed across ComfyUI checkpoints and settings")
+    sweep_parser.add_argument("--checkpoints", help="Comma-separated checkpoints (default: every text-to-image checkpoint on the host)")
+    sweep_parser.add_argument("--steps", default="15,30", help="Comma-separated step counts")
+    sweep_parser.add_argument("--samplers", help="Comma-separated samplers, e.g. \"Euler a,DPM++ 2M Karras\" (default IMAGE_SAMPLER)")
+    sweep_parser.add_argument("--resolutions", help="Comma-separated resolutions, e.g. 512x512,768x768 (default IMAGE_RESOLUTION)")
+    sweep_parser.add_argument("--endpoints", help="Comma-separated ComfyUI URLs to spread checkpoints over (default COMFYUI_API_URLS)")
+    sweep_parser.add_argument("--prompt", default="a funny cartoon of a basketball playing basketball with itself in a gym")
+    sweep_parser.add_argument("--seed", type=int, default=42, help="Base seed, so runs are comparable")
+    sweep_parser.add_argument("--repeat", type=int, default=1, help="Warm renders per combination")
+    sweep_parser.add_argument("--out", help="Results directory (default sweeps/<timestamp>)")
+    sweep_parser.add_argument("--stub", type=int, nargs="?", const=1, metavar="HOSTS",
+                              help="Run against this many local stub ComfyUI hosts")
+    
+    buffer_parser = commands.add_parser("buffer", help="Generate posts ahead of time for the upcoming publish slots")
+    buffer_parser.add_argument("--posts", type=int, help="Posts to keep waiting (default BUFFER_POSTS)")
+    buffer_parser.add_argument("--times", help="Publish times of day, e.g. 08:00,20:00 (default PUBLISH_TIMES)")
+    buffer_parser.add_argument("--window", help="Only generate within this time window, e.g. 22:00-06:00; \"\" for any time (default GENERATION_WINDOW)")
+    
+    publish_parser = commands.add_parser("publish", help="Put scheduled posts live once their time has come")
+    publish_parser.add_argument("--no-build", action="store_true", help="Don't run PUBLISH_COMMAND afterwards")
+    
+    enqueue_parser = commands.add_parser("enqueue", help="Add post jobs to the work queue for generation workers")
+    enqueue_parser.add_argument("--posts", type=int, default=1, help="Number of jobs to add")
+    enqueue_parser.add_argument("--type", dest="content_type", choices=["story", "news"],
+                                help="Content type of the posts (default a random mix)")
+    
+    worker_parser = commands.add_parser("worker", help="Generate posts for jobs from the work queue")
+    worker_parser.add_argument("--once", action="store_true", help="Exit when the queue is empty instead of waiting for jobs")
+    worker_parser.add_argument("--poll-interval", type=float, default=5, help="Seconds between checks of an empty queue")
+    worker_parser.add_argument("--name", help="Worker name in the queue (default host:pid)")
+    
+    commands.add_parser("collect", help="Write posts finished by workers into this repository")
+    
+    gc_parser = commands.add_parser("gc", help="Quarantine unreferenced and duplicate images in static/images")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only report what would be moved")
+    gc_parser.add_argument("--grace", type=float, help="Leave unreferenced images younger than this many seconds (default IMAGE_GC_GRACE_SECONDS)")
+    gc_parser.add_argument("--workers", type=int, help="Processes for parsing posts (default one per CPU)")
+    gc_parser.add_argument("--restore", metavar="DIR", help="Move the images of one quarantine run back")
+    gc_parser.add_argument("--verbose", action="store_true", help="List every image found")
+    
+    migrate_parser = commands.add_parser("migrate-bundles", help="Move flat posts into YYYY/MM/<slug>/ leaf bundles with their images")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="Only list what would be moved")
+    
+    retag_parser = commands.add_parser("retag", help="Normalize the tags of existing posts and move model tags into params")
+    retag_parser.add_argument("--dry-run", action="store_true", help="Only count the posts that would change")
+    retag_parser.add_argument("--verbose", action="store_true", help="List the posts that change")
+    retag_parser.add_argument("--keep-unknown", action="store_true",
+                              help="Keep tags outside the vocabulary instead of dropping them (default TAG_KEEP_UNKNOWN)")
+    
+    search_parser = commands.add_parser("search-index", help="Rebuild the sharded search index from every published post")
+    search_parser.add_argument("--dir", help="Directory of the index (default SEARCH_INDEX_DIR)")
+    
+    compress_parser = commands.add_parser("compress", help="Write .gz and .br copies of new and changed files in public/")
+    compress_parser.add_argument("--dir", default="public", help="Built site to compress (default public)")
+    compress_parser.add_argument("--workers", type=int, help="Processes to compress with (default one per CPU)")
+    compress_parser.add_argument("--force", action="store_true", help="Recompress every file, changed or not")
+    
+    daemon_parser = commands.add_parser("daemon", help="Keep running and generate posts on a schedule instead of from cron")
+    daemon_parser.add_argument("--interval", help="Time between posts, as seconds or e.g. 30m, 6h (default DAEMON_INTERVAL)")
+    daemon_parser.add_argument("--host", help="Address of the control endpoint (default DAEMON_HOST)")
+    daemon_parser.add_argument("--port", type=int, help="Port of the control endpoint (default DAEMON_PORT)")
+    daemon_parser.add_argument("--paused", action="store_true", help="Start with scheduled posts paused")
+    daemon_parser.add_argument("--buffer", action="store_true",
+                               help="On each run, publish due posts and fill the buffer instead of posting directly")
+    
+    args = parser.parse_args(argv)
+    if args.command == "report":
+        report(args)
+    elif args.command == "bench":
+        bench(args)
+    elif args.command == "batch":
+        batch(args)
+    elif args.command == "sweep":
+        sweep(args)
+    elif args.command == "buffer":
+        buffer(args)
+    elif args.command == "publish":
+        publish(args)
+    elif args.command == "enqueue":
+        enqueue(args)
+    elif args.command == "worker":
+        worker(args)
+    elif args.command == "collect":
+        collect(args)
+    elif args.command == "gc":
+        image_gc(args)
+    elif args.command == "migrate-bundles":
+        migrate_bundles(args)
+    elif args.command == "retag":
+        retag(args)
+    elif args.command == "search-index":
+        search_index(args)
+    elif args.command == "compress":
+        compress(args)
+    elif args.command == "daemon":
+        daemon(args)
+    else:
+        generate()
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
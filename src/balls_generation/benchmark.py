@@ -0,0 +1,198 @@
+"""End-to-end pipeline benchmark against the local stub servers.
+
+Runs the real generators against stubs.py with known latencies, so any time
+above the injected service time is overhead added by our own pipeline. Runs
+in a temporary directory, so nothing is written into the site content.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .stubs import StubConfig, StubServer
+from .report import Stats, parse_trace, percentile
+from .utils import tracing
+
+logger = logging.getLogger(__name__)
+
+def _max_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _site_paths(workdir: str) -> List[Tuple[Any, str, str]]:
+    """The repository paths the generators write under, moved into workdir."""
+    from . import image_providers
+    from .generators import image
+    from .utils import content, images, journal, search_index
+
+    images_dir = os.path.join(workdir, "static", "images")
+    return [(content, "CONTENT_ROOT", os.path.join(workdir, "content")),
+            (journal, "BASE_DIR", workdir), (search_index, "BASE_DIR", workdir)] + [
+            (module, "IMAGES_DIR", images_dir) for module in (images, content, journal, image_providers, image)]
+
+def expected_service_seconds(config: StubConfig, image_provider: str, llm_provider: str = "ollama") -> float:
+    """Time a post spends inside the stubs, without any pipeline overhead."""
+    image_kind = "image" if image_provider == "dalle" else "render"
+    llm_kind = "chat" if llm_provider == "openai" else "llm"
+    return config.latency[llm_kind] + 2 * config.latency[image_kind]
+
+def run_benchmark(posts: int = 4, concurrency: int = 1, config: Optional[StubConfig] = None,
+                  llm_provider: str = "ollama", image_provider: str = "comfyui", comfyui_nodes: int = 1, ollama_nodes: int = 1) -> Dict:
+    """Generate posts against the stubs and return throughput, latency and memory figures.
+
+    With concurrency 1 posts are generated one after another (single-post
+    mode); otherwise they run on a thread pool (batch mode). With more than
+    one ComfyUI or Ollama node, each node is a separate stub host behind the
+    matching pool provider.
+    """
+    config = config or StubConfig()
+    server = StubServer(config).start()
+    nodes = [server] + [StubServer(config).start() for _ in range(max(comfyui_nodes, ollama_nodes) - 1)]
+    workdir = tempfile.mkdtemp(prefix="balls-bench-")
+    trace_file = os.path.join(workdir, "trace.jsonl")
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+
+    os.environ.update({
+        "OLLAMA_API_URL": server.url,
+        "COMFYUI_API_URL": server.url,
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+        "OPENAI_API_KEY": "stub",
+        "USE_OPENAI": "true" if llm_provider == "openai" else "false",
+        "IMAGE_PROVIDER": image_provider,
+    })
+    if llm_provider == "router":
+        os.environ["LLM_ROUTE"] = "ollama,openai"
+    if comfyui_nodes > 1:
+        os.environ["COMFYUI_API_URLS"] = ",".join(node.url for node in nodes[:comfyui_nodes])
+    if ollama_nodes > 1:
+        os.environ["OLLAMA_API_URLS"] = ",".join(node.url for node in nodes[:ollama_nodes])
+    os.chdir(workdir)
+    # Posts, images and the journal are anchored at the repository, not the working directory
+    site_paths = _site_paths(workdir)
+    saved_paths = [(module, name, getattr(module, name)) for module, name, _ in site_paths]
+    for module, name, path in site_paths:
+        setattr(module, name, path)
+    tracing.configure(trace_file)
+
+    from .generators.story import StoryGenerator
+    from .generators.news import NewsGenerator
+
+    local = threading.local()
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def generate_one(index: int) -> None:
+        nonlocal failures
+        if not hasattr(local, "story"):
+            local.story = StoryGenerator()
+            local.news = NewsGenerator()
+        started = time.perf_counter()
+        filename = local.story.generate_story() if index % 2 == 0 else local.news.generate_article()
+        elapsed = time.perf_counter() - started
+        with lock:
+            if filename:
+                latencies.append(elapsed)
+            else:
+                failures += 1
+
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        if concurrency <= 1:
+            for index in range(posts):
+                generate_one(index)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(generate_one, range(posts)))
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        tracing.configure(None)
+        os.chdir(saved_cwd)
+        for module, name, path in saved_paths:
+            setattr(module, name, path)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        for node in nodes:
+            node.stop()
+
+    stats = Stats()
+    with open(trace_file, encoding="utf-8") as f:
+        parse_trace(f, stats)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    expected = expected_service_seconds(config, image_provider, llm_provider)
+    mean = sum(latencies) / len(latencies) if latencies else 0.0
+    return {
+        "mode": "single" if concurrency <= 1 else "batch",
+        "posts": posts,
+        "concurrency": concurrency,
+        "llm_provider": llm_provider,
+        "image_provider": image_provider,
+        "comfyui_nodes": comfyui_nodes,
+        "ollama_nodes": ollama_nodes,
+        "succeeded": len(latencies),
+        "failed": failures,
+        "wall_seconds": round(wall, 3),
+        "posts_per_hour": round(len(latencies) / wall * 3600, 1) if wall else 0.0,
+        "post_p50": round(percentile(latencies, 50), 3),
+        "post_p95": round(percentile(latencies, 95), 3),
+        "expected_service_seconds": expected,
+        "overhead_per_post": round(mean - expected, 3),
+        "peak_traced_mb": round(peak / (1 << 20), 2),
+        "max_rss_mb": _max_rss_mb(),
+        "stages": {
+            stage: {"n": count, "p50": round(p50, 4), "p90": round(p90, 4), "p99": round(p99, 4)}
+            for stage, _, _, count, _, p50, p90, p99 in stats.rows()
+        },
+    }
+
+def render_results(results: Dict) -> str:
+    """Plain text summary of a benchmark run."""
+    lines = [
+        f"{results['mode']} mode: {results['succeeded']}/{results['posts']} posts "
+        f"({results['llm_provider']} + {results['image_provider']}, concurrency {results['concurrency']})",
+        f"  wall time:         {results['wall_seconds']:.2f}s",
+        f"  posts/hour:        {results['posts_per_hour']:.1f}",
+        f"  post p50 / p95:    {results['post_p50']:.2f}s / {results['post_p95']:.2f}s",
+        f"  stub service time: {results['expected_service_seconds']:.2f}s per post",
+        f"  overhead per post: {results['overhead_per_post']:.2f}s",
+        f"  peak traced mem:   {results['peak_traced_mb']:.2f} MB",
+    ]
+    if results.get("max_rss_mb") is not None:
+        lines.append(f"  max RSS:           {results['max_rss_mb']:.1f} MB")
+    lines.append("  stages (seconds):")
+    for stage, values in results["stages"].items():
+        lines.append(f"    {stage:<16} n={values['n']:<4} p50={values['p50']:<8} p90={values['p90']:<8} p99={values['p99']}")
+    return "\n".join(lines)
+
+def compare_to_baseline(results: Dict, baseline: Dict, tolerance: float = 0.1) -> list:
+    """Return a list of regressions against a previous run's results."""
+    regressions = []
+    if results["posts_per_hour"] < baseline["posts_per_hour"] * (1 - tolerance):
+        regressions.append(f"posts/hour dropped from {baseline['posts_per_hour']} to {results['posts_per_hour']}")
+    if results["overhead_per_post"] > baseline["overhead_per_post"] + max(0.05, abs(baseline["overhead_per_post"]) * tolerance):
+        regressions.append(f"overhead per post grew from {baseline['overhead_per_post']}s to {results['overhead_per_post']}s")
+    if results["peak_traced_mb"] > baseline["peak_traced_mb"] * (1 + tolerance) + 1:
+        regressions.append(f"peak memory grew from {baseline['peak_traced_mb']} MB to {results['peak_traced_mb']} MB")
+    return regressions
+
+def load_results(path: str) -> Dict:
+    """Load results saved with --json."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
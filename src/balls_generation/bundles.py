@@ -0,0 +1,131 @@
+"""Migrate the flat post archive to leaf page bundles.
+
+With POST_LAYOUT=bundle new posts are written as
+content/en/posts/YYYY/MM/<slug>/index.md with their images beside them.
+migrate() moves the existing archive into the same shape, so the posts
+directory and static/images stop growing without bound and Hugo handles the
+images as page resources, processed and cached per page.
+
+Each flat post becomes a bundle dated from its filename, or from its front
+matter if the filename has no date. Images only that post links to are
+moved into the bundle; an image several posts use is copied into each of
+their bundles. Links to the images and to the post itself are
+rewritten, and the post gets its old URL as an alias so existing links keep
+working.
+"""
+
+import os
+import re
+import shutil
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .utils.content import CONTENT_ROOT, page_url
+from .utils.images import IMAGES_DIR
+
+logger = logging.getLogger(__name__)
+
+POSTS_DIR = os.path.join(CONTENT_ROOT, "en", "posts")
+
+IMAGE_REFERENCE = re.compile(r"/images/([^)\s\"'\]]+)")
+FILENAME_DATE = re.compile(r"^(\d{4})-(\d{2})-\d{2}-(.+)$")
+FRONT_MATTER_DATE = re.compile(r"^(?:date|datetime):\s*(\d{4})-(\d{2})", re.MULTILINE)
+
+class Migration:
+    """One flat post and where it goes."""
+
+    def __init__(self, source: str, bundle: str, images: List[str]):
+        self.source = source
+        self.bundle = bundle
+        self.images = images
+
+def _bundle_dir(source: str, text: str, posts_dir: str) -> Optional[str]:
+    stem = os.path.basename(source)[:-3]
+    match = FILENAME_DATE.match(stem)
+    if match:
+        year, month, slug = match.groups()
+    else:
+        front_matter = FRONT_MATTER_DATE.search(text.split("\n---", 1)[0])
+        if not front_matter:
+            return None
+        (year, month), slug = front_matter.groups(), stem
+    return os.path.join(posts_dir, year, month, slug.lower())
+
+def plan(posts_dir: str = POSTS_DIR) -> Tuple[List[Migration], Counter]:
+    """The migrations for every flat post, and how many posts link to each image."""
+    migrations = []
+    uses = Counter()
+    taken = set()
+    for name in sorted(os.listdir(posts_dir)):
+        source = os.path.join(posts_dir, name)
+        if not name.endswith(".md") or not os.path.isfile(source) or name in ("_index.md", "index.md"):
+            continue
+        with open(source, encoding="utf-8") as f:
+            text = f.read()
+        images = sorted(set(IMAGE_REFERENCE.findall(text)))
+        uses.update(images)
+        bundle = _bundle_dir(source, text, posts_dir)
+        if bundle is None:
+            logger.warning(f"Leaving {source} flat: no date in its name or front matter")
+            continue
+        unique, number = bundle, 2
+        while unique in taken or os.path.exists(unique):
+            unique, number = f"{bundle}-{number}", number + 1
+        taken.add(unique)
+        migrations.append(Migration(source, unique, images))
+    return migrations, uses
+
+def _add_alias(text: str, alias: str) -> str:
+    """Add the post's old URL to its front matter aliases."""
+    front_matter, separator, body = text[4:].partition("\n---")
+    if not text.startswith("---\n") or not separator:
+        return text
+    if re.search(r"^aliases:", front_matter, re.MULTILINE):
+        front_matter = re.sub(r"^aliases:\s*\[", f'aliases: ["{alias}", ', front_matter, count=1, flags=re.MULTILINE)
+    else:
+        front_matter += f'\naliases: ["{alias}"]'
+    return "---\n" + front_matter + separator + body
+
+def migrate_post(migration: Migration, uses: Counter, images_dir: str = IMAGES_DIR) -> None:
+    """Turn one flat post into a leaf bundle."""
+    with open(migration.source, encoding="utf-8") as f:
+        text = f.read()
+    os.makedirs(migration.bundle, exist_ok=True)
+    url = page_url(migration.bundle)
+
+    replacements: Dict[str, str] = {}
+    for image in migration.images:
+        source = os.path.join(images_dir, image)
+        if not os.path.exists(source):
+            logger.warning(f"{migration.source} links to missing image {image}")
+            continue
+        target = os.path.join(migration.bundle, os.path.basename(image))
+        # Posts sharing an image each get a copy; the last one takes the original
+        if uses[image] > 1:
+            shutil.copy2(source, target)
+            uses[image] -= 1
+        else:
+            os.replace(source, target)
+        replacements[image] = url + os.path.basename(image)
+
+    text = IMAGE_REFERENCE.sub(lambda match: replacements.get(match.group(1), match.group(0)), text)
+    # The image links point at the post itself by its old relative name
+    stem = os.path.basename(migration.source)[:-3]
+    text = text.replace(f"]({stem})", f"]({url})")
+    text = _add_alias(text, page_url(migration.source))
+
+    with open(os.path.join(migration.bundle, "index.md"), "w", encoding="utf-8") as f:
+        f.write(text)
+    os.remove(migration.source)
+
+def migrate(dry_run: bool = True, posts_dir: str = POSTS_DIR, images_dir: str = IMAGES_DIR) -> List[Migration]:
+    """Move every flat post into a leaf bundle; with dry_run only plan it."""
+    migrations, uses = plan(posts_dir)
+    for migration in migrations:
+        if dry_run:
+            logger.info(f"Would move {migration.source} to {migration.bundle}/index.md with {len(migration.images)} images")
+            continue
+        migrate_post(migration, uses, images_dir)
+        logger.info(f"Moved {migration.source} to {migration.bundle}/index.md")
+    return migrations
@@ -26,6 +26,8 @@ IMAGE_STEPS = int(os.getenv("IMAGE_STEPS", "30"))
 IMAGE_CFG = float(os.getenv("IMAGE_CFG", "7"))
 IMAGE_SAMPLER = os.getenv("IMAGE_SAMPLER", "DPM++ 2M")
 IMAGE_MODEL = os.getenv("IMAGE_MODEL", "sd3_medium_incl_clips_t5xxlfp16.safetensors")
+IMAGE_PROFILES = os.getenv("IMAGE_PROFILES", "")  # extra render profiles, "name=WxH/steps/cfg/sampler,..."
+IMAGE_PROFILE_MAP = os.getenv("IMAGE_PROFILE_MAP", "scene_image=fast")  # slot=profile, e.g. "news.main_image=full"
 
 # Image Provider Selection
 IMAGE_PROVIDER = os.getenv("IMAGE_PROVIDER", "dalle")  # "dalle" or "comfyui"
@@ -34,6 +36,54 @@ IMAGE_PROVIDER = os.getenv("IMAGE_PROVIDER", "dalle")  # "dalle" or "comfyui"
 MAX_STORY_LENGTH = int(os.getenv("MAX_STORY_LENGTH", "400"))
 MAX_ARTICLE_LENGTH = int(os.getenv("MAX_ARTICLE_LENGTH", "400"))
 
+# Daemon mode
+DAEMON_INTERVAL = os.getenv("DAEMON_INTERVAL", "6h")  # seconds, or a duration like "30m"
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", "8765"))
+
+# Scheduled publishing
+PUBLISH_TIMES = os.getenv("PUBLISH_TIMES", "08:00")  # times of day posts go live, "08:00,20:00"
+GENERATION_WINDOW = os.getenv("GENERATION_WINDOW", "")  # e.g. "22:00-06:00"; empty for any time
+BUFFER_POSTS = int(os.getenv("BUFFER_POSTS", "7"))
+PUBLISH_COMMAND = os.getenv("PUBLISH_COMMAND", "sh deploy.sh")
+DAEMON_BUFFER = os.getenv("DAEMON_BUFFER", "false").lower() == "true"
+
+# Work queue for distributed workers
+WORK_QUEUE = os.getenv("WORK_QUEUE", "work.db")
+WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "120"))
+WORK_HEARTBEAT_SECONDS = float(os.getenv("WORK_HEARTBEAT_SECONDS", "30"))
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+
+# Image garbage collection
+IMAGE_QUARANTINE_DIR = os.getenv("IMAGE_QUARANTINE_DIR", "quarantine")
+IMAGE_GC_GRACE_SECONDS = float(os.getenv("IMAGE_GC_GRACE_SECONDS", "3600"))
+
+# Post layout: "flat" files or "bundle" for YYYY/MM/<slug>/index.md leaf bundles
+POST_LAYOUT = os.getenv("POST_LAYOUT", "flat")
+
+# Tags
+TAG_MAX = int(os.getenv("TAG_MAX", "5"))
+TAG_KEEP_UNKNOWN = os.getenv("TAG_KEEP_UNKNOWN", "false").lower() == "true"
+TAG_VOCABULARY = os.getenv("TAG_VOCABULARY", "")  # YAML of canonical tag -> synonyms
+
+# Sharded search index, published as /search/
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "static/search")
+
+# Precompressed copies of the built site
+PRECOMPRESS_MANIFEST = os.getenv("PRECOMPRESS_MANIFEST", "precompress.json")
+PRECOMPRESS_MIN_BYTES = int(os.getenv("PRECOMPRESS_MIN_BYTES", "1024"))
+
+# Journal of posts in progress
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", "3"))
+JOURNAL_LOCK_SECONDS = float(os.getenv("JOURNAL_LOCK_SECONDS", "3600"))
+
+# Deadlines
+POST_DEADLINE_SECONDS = float(os.getenv("POST_DEADLINE_SECONDS", "900"))
+STAGE_BUDGETS = os.getenv("STAGE_BUDGETS", "llm=0.3,main_image=0.35,scene_image=0.35")
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+IMAGE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_TIMEOUT_SECONDS", "600"))
+
 # Site Configuration
 SITE_URL = os.getenv("SITE_URL", "https://balls.no")
 SITE_TITLE = os.getenv("SITE_TITLE", "A Balling Site")
@@ -58,3 +108,11 @@ os.makedirs(IMAGES_DIR, exist_ok=True)
 
 # Logging
 LOG_FILE = os.path.join(BASE_DIR, "cron.log")
+
+# Tracing (disabled unless a trace file is set)
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+# Provider transport: "record" or "replay" provider traffic to/from a cassette
+PROVIDER_TRANSPORT = os.getenv("PROVIDER_TRANSPORT", "")
+PROVIDER_CASSETTE = os.getenv("PROVIDER_CASSETTE", "cassettes/providers.jsonl.gz")
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))
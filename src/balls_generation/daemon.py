@@ -0,0 +1,282 @@
+"""Long-running generator that replaces the cron job.
+
+A cron run pays for everything from scratch each time: importing the SDKs,
+building the providers, opening connections. The daemon builds the
+generators once and keeps them, with their shared HTTP session, connection
+pools and caches, for its whole life, so each post costs only the
+generation itself.
+
+Posts are generated every DAEMON_INTERVAL (seconds, or a duration like
+"30m" or "6h"), one at a time. A small HTTP endpoint on
+DAEMON_HOST:DAEMON_PORT, localhost only by default, controls it:
+
+    GET  /status    state, counters, the last post and the next scheduled run
+    POST /generate  generate a post now, even while paused
+    POST /pause     stop scheduled posts
+    POST /resume    start them again
+
+With --buffer (or DAEMON_BUFFER) each scheduled run instead tops up the
+buffer of scheduled posts, within the generation window (see schedule.py);
+DAEMON_INTERVAL is then how often it checks, e.g. "15m". Publishing doesn't
+wait on generation: a publisher thread wakes at the next publishDate and puts
+due drafts live, also while paused or in the middle of filling the buffer.
+
+Whether Ollama keeps its model loaded between posts is still up to
+OLLAMA_KEEP_ALIVE, since ComfyUI usually needs the same GPU.
+"""
+
+import json
+import time
+import signal
+import logging
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from .config.settings import DAEMON_INTERVAL, DAEMON_HOST, DAEMON_PORT, DAEMON_BUFFER
+from .generators.story import StoryGenerator
+from .generators.news import NewsGenerator
+from .schedule import Schedule, scheduled_posts
+
+logger = logging.getLogger(__name__)
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_interval(value: str) -> float:
+    """Seconds from "90", "30m", "6h" or "1d"."""
+    value = value.strip().lower()
+    if value and value[-1] in UNITS:
+        return float(value[:-1]) * UNITS[value[-1]]
+    return float(value)
+
+class Daemon:
+    """Generates posts on a schedule with providers that stay warm between posts."""
+
+    def __init__(self, interval: Optional[float] = None, paused: bool = False, buffer: Optional[bool] = None):
+        self.interval = interval if interval is not None else parse_interval(DAEMON_INTERVAL)
+        self.paused = paused
+        if buffer is None:
+            buffer = DAEMON_BUFFER
+        self.schedule = Schedule() if buffer else None
+        self.story_generator = StoryGenerator()
+        self.news_generator = NewsGenerator()
+        self.started = time.time()
+        self.next_run = self.started if not paused else None
+        self.generating = False
+        self.posts = 0
+        self.failures = 0
+        self.last_post = None
+        self.requested = 0
+        self.stopping = threading.Event()
+        self.wake = threading.Event()
+        self.publish_wake = threading.Event()
+        self.lock = threading.Lock()
+        logger.info(f"Daemon ready, posting every {self.interval:g}s")
+
+    def warm(self) -> None:
+        """Open connections to the image backend before the first post needs them."""
+        for generator in (self.story_generator, self.news_generator):
+            queue_depth = getattr(generator.image_provider, "queue_depth", None)
+            if queue_depth:
+                queue_depth()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "state": "generating" if self.generating else "paused" if self.paused else "idle",
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "interval_seconds": self.interval,
+                "next_run": datetime.fromtimestamp(self.next_run).isoformat(timespec="seconds") if self.next_run and not self.paused else None,
+                "requested": self.requested,
+                "posts": self.posts,
+                "failures": self.failures,
+                "last_post": self.last_post,
+                "buffered": len(self.schedule.pending()) if self.schedule else None,
+            }
+
+    def request_post(self) -> None:
+        """Generate a post as soon as the current one, if any, is finished."""
+        with self.lock:
+            self.requested += 1
+        self.wake.set()
+
+    def pause(self) -> None:
+        with self.lock:
+            self.paused = True
+        logger.info("Scheduled posts paused")
+
+    def resume(self) -> None:
+        with self.lock:
+            if self.paused:
+                self.paused = False
+                # Runs missed while paused are skipped, not made up
+                now = time.time()
+                if self.next_run is None or self.next_run < now:
+                    self.next_run = now + self.interval
+        logger.info("Scheduled posts resumed")
+        self.wake.set()
+
+    def stop(self) -> None:
+        """Stop after the post in progress, if any."""
+        self.stopping.set()
+        self.wake.set()
+        self.publish_wake.set()
+
+    def _due(self) -> Optional[str]:
+        """"requested", "scheduled" or None if nothing is due."""
+        with self.lock:
+            if self.requested:
+                self.requested -= 1
+                return "requested"
+            if not self.paused and self.next_run is not None and time.time() >= self.next_run:
+                self.next_run = time.time() + self.interval
+                return "scheduled"
+            return None
+
+    def _wait_seconds(self) -> Optional[float]:
+        with self.lock:
+            if self.paused or self.next_run is None:
+                return None
+            return max(0.0, self.next_run - time.time())
+
+    def generate_one(self, publish_at: Optional[datetime] = None) -> Optional[str]:
+        """Generate one post with the warm generators."""
+        from .__main__ import generate
+
+        with self.lock:
+            self.generating = True
+        start = time.monotonic()
+        filename = None
+        try:
+            filename = generate(self.story_generator, self.news_generator, publish_at)
+        except Exception as e:
+            logger.error(f"Post failed: {e}")
+        finally:
+            seconds = time.monotonic() - start
+            with self.lock:
+                self.generating = False
+                if filename:
+                    self.posts += 1
+                    if publish_at:
+                        # The new draft may be due before the one the publisher waits for
+                        self.publish_wake.set()
+                else:
+                    self.failures += 1
+                self.last_post = {
+                    "filename": filename,
+                    "finished": datetime.now().isoformat(timespec="seconds"),
+                    "seconds": round(seconds, 1),
+                }
+        return filename
+
+    def publish(self) -> None:
+        """Put buffered drafts live as their publishDate comes, until stopped."""
+        while not self.stopping.is_set():
+            try:
+                self.schedule.publish_due()
+                upcoming = scheduled_posts(self.schedule.posts_dir)
+            except OSError as e:
+                logger.error(f"Publishing failed: {e}")
+                upcoming = []
+            # Drafts written by a separate buffer run are picked up on the next check
+            timeout = min(self.interval, 300.0)
+            if upcoming:
+                timeout = min(timeout, max(0.0, (upcoming[0].publish_at - datetime.now().astimezone()).total_seconds()))
+            self.publish_wake.wait(timeout)
+            self.publish_wake.clear()
+
+    def run(self) -> None:
+        """Generate posts until stopped."""
+        self.warm()
+        publisher = None
+        if self.schedule:
+            publisher = threading.Thread(target=self.publish, name="publisher", daemon=True)
+            publisher.start()
+        while not self.stopping.is_set():
+            due = self._due()
+            if due == "scheduled" and self.schedule:
+                self.schedule.fill_buffer(self.generate_one, self.stopping.is_set)
+                continue
+            if due:
+                self.generate_one()
+                continue
+            self.wake.wait(self._wait_seconds())
+            self.wake.clear()
+        if publisher:
+            publisher.join()
+        logger.info("Daemon stopped")
+
+class ControlHandler(BaseHTTPRequestHandler):
+    """The daemon's local control endpoint."""
+
+    server: "ControlServer"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _json(self, payload, status: int = 200) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/status"):
+            self._json(self.server.daemon.status())
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        daemon = self.server.daemon
+        actions = {"/generate": daemon.request_post, "/pause": daemon.pause, "/resume": daemon.resume}
+        action = actions.get(self.path.rstrip("/"))
+        if action is None:
+            self._json({"error": "not found"}, 404)
+            return
+        action()
+        self._json(daemon.status(), 202 if action == daemon.request_post else 200)
+
+class ControlServer(ThreadingHTTPServer):
+    """Serves the control endpoint on a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, daemon: Daemon, host: str, port: int):
+        super().__init__((host, port), ControlHandler)
+        self.daemon = daemon
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ControlServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        logger.info(f"Daemon control endpoint listening at {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+def run_daemon(interval: Optional[float] = None, host: Optional[str] = None, port: Optional[int] = None,
+               paused: bool = False, buffer: Optional[bool] = None) -> None:
+    """Run the daemon and its control endpoint until SIGINT or SIGTERM."""
+    daemon = Daemon(interval, paused, buffer or None)
+    host = host or DAEMON_HOST
+    port = port if port is not None else DAEMON_PORT
+    server = ControlServer(daemon, host, port).start()
+
+    def stop(signum, frame):
+        logger.info("Stopping after the post in progress")
+        daemon.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        daemon.run()
+    finally:
+        server.stop()
@@ -3,14 +3,17 @@
 import json
 import random
 import re
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Optional, Tuple
 import logging
 from datetime import datetime
 
-from ..llm_providers import get_llm_provider, OllamaProvider, OpenAIProvider
-from ..image_providers import get_image_provider, ComfyUIProvider, DalleProvider
+from ..llm_providers import get_llm_provider, LLMProvider
+from ..image_providers import get_image_provider
 from ..utils.content import create_blog_post
-from ..utils.images import download_and_save_image
+from ..utils.deadline import Deadline
+from ..utils.tracing import span, trace
+from ..utils.journal import Journal, Job, RecordedLLM
+from ..utils.tags import provenance
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -21,6 +24,7 @@ class StoryGenerator:
     def __init__(self):
         self.llm_provider = get_llm_provider()
         self.image_provider = get_image_provider()
+        self.journal = Journal()
         self.ball_types = [
             "football", "basketball", "baseball", "tennis ball", "golf ball",
             "volleyball", "bowling ball", "billiard ball", "ping pong ball",
@@ -28,104 +32,188 @@ class StoryGenerator:
             "beach ball", "medicine ball", "stress ball", "bouncy ball"
         ]
     
-    def generate_story(self) -> Optional[str]:
-        """Generate a story."""
+    def generate_story(self, publish_at: Optional[datetime] = None) -> Optional[str]:
+        """Generate a story, scheduled as a draft for publish_at if given."""
+        with trace("post", content_type="story") as s:
+            filename = self._generate_story(publish_at)
+            s.set(outcome="ok" if filename else "error", filename=filename)
+            return filename
+    
+    def _generate_story(self, publish_at: Optional[datetime] = None) -> Optional[str]:
+        """Run the generation steps for one post, resuming a failed one from the journal."""
+        deadline = Deadline.for_post()
+        job = self.journal.claim("story")
+        filename = None
         try:
-            # Select a random ball type
-            ball_type = random.choice(self.ball_types)
-            
-            # Generate the story content
-            prompt = f"""Write a short, funny story about a {ball_type}. 
-            The story should be around 300-400 words and be suitable for a blog post. 
-            Make it engaging and humorous.
-            Include a [SCENE] marker where you want the scene image to be inserted.
-            
-            Return a JSON object with these fields:
-            {{
-                "title": "A creative, engaging title",
-                "story": "The story content with [SCENE] marker",
-                "category": "A relevant category",
-                "tags": ["tag1", "tag2", "tag3"],
-                "image_prompt": "A family-friendly prompt for the main image",
-                "scene_prompt": "A family-friendly prompt for the scene image"
-            }}
-            
-            Important:
-            1. The story must include a [SCENE] marker where you want the scene image to appear
-            2. The story should be properly formatted with paragraphs
-            3. Keep all content family-friendly and safe
-            4. Make the content engaging and humorous"""
-            
-            # Get the response from the LLM provider
-            response = self.llm_provider.generate_content(prompt)
-            
-            # Parse the JSON response
-            try:
-                data = json.loads(response)
-            except json.JSONDecodeError:
-                logger.error("Failed to parse JSON response")
-                return None
-            
-            # Clean the title and content
-            title = self._clean_title(data.get('title', ''))
-            content = self._clean_content(data.get('story', ''))
-            
-            # Ensure content has a [SCENE] marker
-            if '[SCENE]' not in content:
-                # Split content into paragraphs and insert [SCENE] after the first paragraph
-                paragraphs = content.split('\n\n')
-                if len(paragraphs) > 1:
-                    content = paragraphs[0] + '\n\n[SCENE]\n\n' + '\n\n'.join(paragraphs[1:])
-                else:
-                    content = content + '\n\n[SCENE]\n\n'
-            
-            # Generate images
-            image_path = None
-            scene_image_path = None
-            
-            if self.image_provider:
-                # Generate main image
-                image_prompt = data.get('image_prompt', f"family-friendly, safe, story illustration of a {ball_type}")
-                image_path = self.image_provider.generate_image(image_prompt)
+            response = job.get('response')
+            if response:
+                # An earlier attempt already has the text, so its budget goes to the images
+                context = job.get('context')
+                llm_used = RecordedLLM(**job.get('llm'))
+                deadline.stage("llm")
+            else:
+                prompt, context = self.build_prompt()
                 
-                # Generate scene image
-                scene_prompt = data.get('scene_prompt', f"family-friendly, safe, story illustration of a {ball_type} in action")
-                scene_image_path = self.image_provider.generate_image(scene_prompt)
-            
-            # Get base tags from data or use defaults
-            base_tags = data.get('tags', ['story', 'humor', 'ball', 'fiction', 'funny', 'adventure', 'random', 'generated'])
-            
-            # Add model tags
-            if isinstance(self.llm_provider, OllamaProvider):
-                base_tags.extend(['ollama', self.llm_provider.model])
-            elif isinstance(self.llm_provider, OpenAIProvider):
-                base_tags.extend(['openai', 'gpt-4'])
-            
-            if isinstance(self.image_provider, ComfyUIProvider):
-                base_tags.extend(['comfyui', self.image_provider.model])
-            elif isinstance(self.image_provider, DalleProvider):
-                base_tags.extend(['dalle', self.image_provider.model])
-            
-            # Create the blog post
-            filename = create_blog_post(
-                data={
-                    'title': title,
-                    'story': content,
-                    'category': data.get('category', 'general'),
-                    'tags': base_tags,
-                    'image_prompt': image_prompt if 'image_prompt' in locals() else '',
-                    'scene_prompt': scene_prompt if 'scene_prompt' in locals() else ''
-                },
-                image_path=image_path,
-                scene_image_path=scene_image_path,
-                content_type="story"
-            )
+                # Get the response from the LLM provider
+                with span("llm.generate", provider=self.llm_provider.name,
+                          model=self.llm_provider.model, prompt_chars=len(prompt)) as s:
+                    response = self.llm_provider.generate_content(prompt, deadline.stage("llm"))
+                    llm_used = self.llm_provider.last_provider
+                    s.set(response_chars=len(response or ''), outcome="ok" if response else "error",
+                          provider=llm_used.name, model=llm_used.model)
+                
+                if response and self._valid_response(response):
+                    job.record(response=response, context=context, llm={'name': llm_used.name, 'model': llm_used.model})
             
+            filename = self.write_post(response, context, deadline, llm_used, job, publish_at)
             return filename
             
         except Exception as e:
             logger.error(f"Error generating story: {str(e)}")
             return None
+        finally:
+            self.journal.finish(job, filename)
+    
+    def _valid_response(self, response: str) -> bool:
+        try:
+            json.loads(response)
+            return True
+        except json.JSONDecodeError:
+            return False
+    
+    def build_prompt(self) -> Tuple[str, Dict[str, Any]]:
+        """Build the LLM prompt for one story, with the context write_post() needs."""
+        # Select a random ball type
+        ball_type = random.choice(self.ball_types)
+        
+        # Generate the story content
+        prompt = f"""Write a short, funny story about a {ball_type}. 
+        The story should be around 300-400 words and be suitable for a blog post. 
+        Make it engaging and humorous.
+        Include a [SCENE] marker where you want the scene image to be inserted.
+        
+        Return a JSON object with these fields:
+        {{
+            "title": "A creative, engaging title",
+            "story": "The story content with [SCENE] marker",
+            "category": "A relevant category",
+            "tags": ["tag1", "tag2", "tag3"],
+            "image_prompt": "A family-friendly prompt for the main image",
+            "scene_prompt": "A family-friendly prompt for the scene image"
+        }}
+        
+        Important:
+        1. The story must include a [SCENE] marker where you want the scene image to appear
+        2. The story should be properly formatted with paragraphs
+        3. Keep all content family-friendly and safe
+        4. Make the content engaging and humorous"""
+        
+        return prompt, {'ball_type': ball_type}
+    
+    def write_post(self, response: str, context: Dict[str, Any], deadline: Deadline,
+                   llm_used: LLMProvider, job: Optional[Job] = None,
+                   publish_at: Optional[datetime] = None) -> Optional[str]:
+        """Turn an LLM response into a post: parse it, render the images and write the file.
+        
+        With a journal job, images finished by an earlier attempt are reused,
+        new ones are recorded as they finish, and a post missing an image is
+        left for the next attempt instead of being written without it.
+        """
+        ball_type = context['ball_type']
+        
+        # Parse the JSON response
+        try:
+            data = json.loads(response)
+        except json.JSONDecodeError:
+            logger.error("Failed to parse JSON response")
+            return None
+        
+        # Clean the title and content
+        title = self._clean_title(data.get('title', ''))
+        content = self._clean_content(data.get('story', ''))
+        
+        # Ensure content has a [SCENE] marker
+        if '[SCENE]' not in content:
+            # Split content into paragraphs and insert [SCENE] after the first paragraph
+            paragraphs = content.split('\n\n')
+            if len(paragraphs) > 1:
+                content = paragraphs[0] + '\n\n[SCENE]\n\n' + '\n\n'.join(paragraphs[1:])
+            else:
+                content = content + '\n\n[SCENE]\n\n'
+        
+        # Generate images
+        main_image = None
+        scene_image = None
+        
+        if self.image_provider:
+            # Generate main image
+            image_prompt = data.get('image_prompt', f"family-friendly, safe, story illustration of a {ball_type}")
+            main_image = self._render_image('main_image', image_prompt, deadline, job)
+            
+            # Generate scene image
+            scene_prompt = data.get('scene_prompt', f"family-friendly, safe, story illustration of a {ball_type} in action")
+            scene_image = self._render_image('scene_image', scene_prompt, deadline, job,
+                                             source_image=main_image['filename'] if main_image else None)
+            
+            if job and not job.last_attempt and not (main_image and scene_image):
+                logger.warning(f"Post {job.id} is missing an image, leaving it in the journal for the next run")
+                return None
+        
+        image_path = main_image['filename'] if main_image else None
+        scene_image_path = scene_image['filename'] if scene_image else None
+        
+        # Get base tags from data or use defaults
+        base_tags = data.get('tags', ['story', 'humor', 'ball', 'fiction', 'funny', 'adventure', 'random', 'generated'])
+        
+        # Record the models that made the post as params rather than tags
+        post_provenance = provenance(llm_used.name, llm_used.model, (main_image, scene_image))
+        
+        # Describe the backend that actually produced each image
+        image_settings = {}
+        for role, image in (('Main image', main_image), ('Scene image', scene_image)):
+            if not image:
+                continue
+            image_settings[role] = image['settings']
+        
+        # Create the blog post
+        filename = create_blog_post(
+            data={
+                'title': title,
+                'story': content,
+                'category': data.get('category', 'general'),
+                'tags': base_tags,
+                'image_prompt': image_prompt if 'image_prompt' in locals() else '',
+                'scene_prompt': scene_prompt if 'scene_prompt' in locals() else '',
+                'image_settings': image_settings,
+                'provenance': post_provenance
+            },
+            image_path=image_path,
+            scene_image_path=scene_image_path,
+            content_type="story",
+            publish_at=publish_at
+        )
+        
+        return filename
+    
+    def _render_image(self, role: str, prompt: str, deadline: Deadline, job: Optional[Job],
+                      source_image: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Render one of the post's images, or take it from the journal if an earlier attempt finished it."""
+        image = job.image(role) if job else None
+        if image:
+            logger.info(f"Reusing {role} from the journal: {image['filename']}")
+            return image
+        
+        slot = f"story.{role}"
+        filename = self.image_provider.generate_image(prompt, deadline.stage(role), slot, source_image=source_image)
+        if not filename:
+            return None
+        
+        # Describe the backend that actually produced the image now, while the provider still knows it
+        source = self.image_provider.source_for(filename)
+        image = {'filename': filename, 'settings': source.settings(slot), 'backend': source.name, 'model': source.model}
+        if job:
+            job.record(**{role: image})
+        return image
     
     def _clean_title(self, title: str) -> str:
         """Clean the title for use in filenames."""
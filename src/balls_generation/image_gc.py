@@ -0,0 +1,188 @@
+"""Garbage collection for static/images.
+
+Failed runs leave images behind that no post links to: a main image whose
+post never got its scene image, or an image saved before the post fell back
+to having none. Hugo copies every file under static/ on every build and the
+deploy rsyncs them all, so dead images cost time on every publish.
+
+collect_garbage() reads every post under content/ in a process pool and
+gathers the /images/ paths they link to, plus the images the journal still
+needs for posts in progress. Images nobody references, and younger than
+IMAGE_GC_GRACE_SECONDS so a post being written right now keeps its images,
+are garbage. Images with the same content as another are duplicates: posts
+linking to a duplicate are pointed at the one kept, and the copy goes.
+
+Nothing is deleted. Garbage is moved into a timestamped directory under
+IMAGE_QUARANTINE_DIR, outside static/, with a manifest of what was moved
+and why, so restore() can put it all back.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from .config.settings import IMAGE_QUARANTINE_DIR, IMAGE_GC_GRACE_SECONDS
+from .utils.images import IMAGES_DIR
+from .utils.journal import Journal
+from .utils.content import CONTENT_ROOT
+
+logger = logging.getLogger(__name__)
+
+# How posts link to images: /images/name.png in markdown links and front matter
+IMAGE_REFERENCE = re.compile(r"/images/([^)\s\"'\]]+)")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+MANIFEST = "manifest.json"
+
+def _references(path: str) -> Set[str]:
+    """Image paths, relative to static/images, that one post links to."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return set(IMAGE_REFERENCE.findall(f.read()))
+
+def post_paths(content_root: str = CONTENT_ROOT) -> List[str]:
+    return [os.path.join(directory, name)
+            for directory, _, names in os.walk(content_root) for name in names if name.endswith(".md")]
+
+def image_paths(images_dir: str = IMAGES_DIR) -> List[str]:
+    """Images under static/images, relative to it with forward slashes, as posts link to them."""
+    return [os.path.relpath(os.path.join(directory, name), images_dir).replace(os.sep, "/")
+            for directory, _, names in os.walk(images_dir)
+            for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+def references(posts: List[str], workers: Optional[int] = None) -> Dict[str, Set[str]]:
+    """For each post, the images it links to, parsing posts in parallel."""
+    if len(posts) < 200:
+        # Not worth starting processes for
+        return {post: _references(post) for post in posts}
+    with ProcessPoolExecutor(workers) as pool:
+        return dict(zip(posts, pool.map(_references, posts, chunksize=64)))
+
+def _digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def duplicates(images: Iterable[str], images_dir: str = IMAGES_DIR, workers: Optional[int] = None) -> Dict[str, str]:
+    """Map each duplicate image to the copy that is kept, hashing only files that share a size."""
+    by_size = {}
+    for image in images:
+        by_size.setdefault(os.path.getsize(os.path.join(images_dir, image)), []).append(image)
+    candidates = [image for group in by_size.values() if len(group) > 1 for image in group]
+    # hashlib releases the GIL, so threads are enough here
+    with ThreadPoolExecutor(workers) as pool:
+        digests = dict(zip(candidates, pool.map(lambda image: _digest(os.path.join(images_dir, image)), candidates)))
+    by_digest = {}
+    for image in sorted(candidates):
+        by_digest.setdefault(digests[image], []).append(image)
+    return {copy: group[0] for group in by_digest.values() for copy in group[1:]}
+
+class GarbageReport:
+    """What collect_garbage() found, and did unless it was a dry run."""
+
+    def __init__(self):
+        self.posts = 0
+        self.images = 0
+        self.unreferenced: List[str] = []
+        self.duplicates: Dict[str, str] = {}
+        self.rewritten: List[str] = []
+        self.bytes = 0
+        self.quarantine: Optional[str] = None
+
+    def render(self, dry_run: bool) -> str:
+        lines = [
+            f"Posts scanned:       {self.posts}",
+            f"Images:              {self.images}",
+            f"Unreferenced:        {len(self.unreferenced)}",
+            f"Duplicates:          {len(self.duplicates)}",
+            f"Posts relinked:      {len(self.rewritten)}",
+            f"Reclaimable:         {self.bytes / 1e6:.1f} MB",
+        ]
+        if dry_run:
+            lines.append("Dry run, nothing was moved")
+        elif self.quarantine:
+            lines.append(f"Quarantined in:      {self.quarantine}")
+        return "\n".join(lines)
+
+def _relink(post: str, replacements: Dict[str, str]) -> None:
+    """Point a post's links to duplicate images at the copies that are kept."""
+    with open(post, encoding="utf-8") as f:
+        text = f.read()
+    text = IMAGE_REFERENCE.sub(lambda match: f"/images/{replacements.get(match.group(1), match.group(1))}", text)
+    with open(post + ".part", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(post + ".part", post)
+
+def collect_garbage(dry_run: bool = True, content_root: str = CONTENT_ROOT, images_dir: str = IMAGES_DIR,
+                    quarantine_dir: Optional[str] = None, grace_seconds: Optional[float] = None,
+                    workers: Optional[int] = None) -> GarbageReport:
+    """Find unreferenced and duplicate images and, unless dry_run, relink posts and quarantine them."""
+    quarantine_dir = quarantine_dir or IMAGE_QUARANTINE_DIR
+    grace_seconds = grace_seconds if grace_seconds is not None else IMAGE_GC_GRACE_SECONDS
+    report = GarbageReport()
+
+    posts = references(post_paths(content_root), workers)
+    journaled = set(Journal().referenced_images())
+    referenced = set().union(journaled, *posts.values())
+    images = image_paths(images_dir)
+    report.posts = len(posts)
+    report.images = len(images)
+
+    cutoff = time.time() - grace_seconds
+    report.unreferenced = sorted(image for image in images if image not in referenced
+                                 and os.path.getmtime(os.path.join(images_dir, image)) < cutoff)
+    # Unreferenced images inside the grace period may belong to a post being written, so leave them be
+    # Journaled images are found by name when their post resumes, so they stay where they are
+    report.duplicates = {copy: kept for copy, kept in duplicates(
+        [image for image in images if image in referenced], images_dir, workers).items() if copy not in journaled}
+    report.bytes = sum(os.path.getsize(os.path.join(images_dir, image))
+                       for image in report.unreferenced + list(report.duplicates))
+    report.rewritten = sorted(post for post, linked in posts.items() if linked & report.duplicates.keys())
+
+    if dry_run or not (report.unreferenced or report.duplicates):
+        return report
+
+    for post in report.rewritten:
+        _relink(post, report.duplicates)
+
+    destination = os.path.join(quarantine_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    moved = [{"image": image, "reason": "unreferenced"} for image in report.unreferenced]
+    moved += [{"image": copy, "reason": "duplicate", "kept": kept} for copy, kept in report.duplicates.items()]
+    for entry in moved:
+        target = os.path.join(destination, entry["image"])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(os.path.join(images_dir, entry["image"]), target)
+    with open(os.path.join(destination, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"images_dir": images_dir, "relinked_posts": report.rewritten, "moved": moved}, f, indent=2)
+    report.quarantine = destination
+    logger.info(f"Quarantined {len(moved)} images in {destination}")
+    return report
+
+def restore(quarantine: str) -> int:
+    """Move the images of one quarantine run back into static/images; returns how many were restored.
+
+    Posts relinked to a kept copy keep pointing at it, which shows the same image.
+    """
+    with open(os.path.join(quarantine, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    restored = 0
+    for entry in manifest["moved"]:
+        source = os.path.join(quarantine, entry["image"])
+        target = os.path.join(manifest["images_dir"], entry["image"])
+        if not os.path.exists(source) or os.path.exists(target):
+            logger.warning(f"Not restoring {entry['image']}")
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(source, target)
+        restored += 1
+    logger.info(f"Restored {restored} images from {quarantine}")
+    return restored
@@ -3,80 +3,143 @@
 import os
 import logging
 import time
+import threading
+import contextvars
+import copy
 from abc import ABC, abstractmethod
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional
+from urllib.parse import urlencode
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
 
 from openai import OpenAI
 
+from .config.settings import IMAGE_TIMEOUT_SECONDS
+from .utils.deadline import Deadline, request_timeout
+from .utils.tracing import span
+from .utils.ratelimit import get_limiter
+from .utils.images import IMAGES_DIR, new_image_path, stream_to_file, save_base64, link_or_copy
+from .utils.render_profiles import ProfileMap, RenderProfile
+from .utils.image_check import image_problem
+from .transport import get_session, get_openai_http_client
+
 # Get logger without configuring it
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+# Cancelling runs after the deadline has passed, so it gets its own short timeout
+REQUEST_CANCEL_TIMEOUT = 10
+
+# Probes run before every dispatch and should never hold up a render for long
+PROBE_TIMEOUT = 3
+
+def execution_ms(entry: dict) -> Optional[int]:
+    """Time ComfyUI spent executing a prompt, from its history status messages.
+    
+    Both timestamps come from the ComfyUI host, so the difference is free of
+    clock skew. The rest of the wait is time spent queued behind other prompts.
+    """
+    timestamps = {}
+    for message in entry.get('status', {}).get('messages', []):
+        if len(message) == 2 and isinstance(message[1], dict):
+            timestamps[message[0]] = message[1].get('timestamp')
+    start = timestamps.get('execution_start')
+    end = timestamps.get('execution_success')
+    if start is None or end is None:
+        return None
+    return end - start
+
 class ImageProvider(ABC):
     """Abstract base class for image providers."""
     
     @abstractmethod
-    def generate_image(self, prompt: str) -> Optional[str]:
-        """Generate an image from a prompt.
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None, slot: Optional[str] = None,
+                       source_image: Optional[str] = None) -> Optional[str]:
+        """Generate an image from a prompt, giving up once the deadline expires.
+        
+        slot is "<content type>.<role>", e.g. "story.scene_image", for
+        providers that render different slots differently. source_image is
+        an earlier image of the post, in static/images, that providers with
+        img2img support may start from.
         
         Returns:
             Optional[str]: Path to the generated image, or None if generation failed
         """
         pass
+    
+    def settings(self, slot: Optional[str] = None) -> dict:
+        """Generation settings to show alongside an image from this provider."""
+        return {"Model": self.model}
+    
+    def source_for(self, filename: str) -> "ImageProvider":
+        """The provider that actually produced an image, for provenance and generation details."""
+        return self
 
 class DalleProvider(ImageProvider):
     """DALL-E image generation provider."""
     
+    name = "dalle"
+    
     def __init__(self):
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
         
-        self.client = OpenAI(api_key=api_key)
+        # Retries are left to the shared rate limiter, which knows about the other threads
+        self.client = OpenAI(api_key=api_key, http_client=get_openai_http_client(), max_retries=0)
+        self.session = get_session()
         self.model = os.getenv('OPENAI_IMAGE_MODEL', 'dall-e-3')
         self.quality = os.getenv('OPENAI_IMAGE_QUALITY', 'standard')
         self.size = os.getenv('OPENAI_IMAGE_SIZE', '1024x1024')
+        # b64_json returns the image in the response and saves a second round trip to fetch it
+        self.response_format = os.getenv('DALLE_RESPONSE_FORMAT', 'b64_json')
         logger.info(f"Initialized DalleProvider with model: {self.model}")
     
-    def generate_image(self, prompt: str) -> Optional[str]:
+    def settings(self, slot: Optional[str] = None) -> dict:
+        return {"Model": self.model, "Size": self.size, "Quality": self.quality.capitalize()}
+    
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None, slot: Optional[str] = None,
+                       source_image: Optional[str] = None) -> Optional[str]:
         """Generate an image using DALL-E."""
+        deadline = deadline or Deadline(IMAGE_TIMEOUT_SECONDS, "image")
         logger.info(f"Generating image with {self.model}")
         try:
-            response = self.client.images.generate(
-                model=self.model,
-                prompt=prompt,
-                size=self.size,
-                quality=self.quality,
-                n=1
-            )
-            
-            # Create images directory if it doesn't exist
-            images_dir = "static/images"
-            os.makedirs(images_dir, exist_ok=True)
-            
-            # Generate a unique filename
-            timestamp = datetime.now().strftime("%H%M%S")
-            filename = f"dalle-{timestamp}.png"
-            filepath = os.path.join(images_dir, filename)
-            
-            # Download and save the image
-            image_url = response.data[0].url
-            image_response = requests.get(image_url)
+            with span("image.submit", provider=self.name, model=self.model, size=self.size):
+                response = get_limiter(self.model).call(
+                    lambda: self.client.with_options(timeout=deadline.timeout()).images.with_raw_response.generate(
+                        model=self.model,
+                        prompt=prompt,
+                        size=self.size,
+                        quality=self.quality,
+                        response_format=self.response_format,
+                        n=1
+                    ),
+                    deadline
+                )
             
-            if image_response.status_code == 200:
-                with open(filepath, "wb") as f:
-                    f.write(image_response.content)
+            filename, filepath = new_image_path("dalle")
+            image = response.data[0]
+            with span("image.download", provider=self.name, model=self.model) as s:
+                if image.b64_json:
+                    size = save_base64(image.b64_json, filepath)
+                    s.set(bytes=size, method="b64")
+                else:
+                    size = stream_to_file(self.session, image.url, filepath, request_timeout(deadline))
+                    if size is None:
+                        s.set(outcome="error")
+                        return None
+                    s.set(bytes=size, method="stream")
                 logger.info(f"Image saved to: {filepath}")
                 return filename
-            else:
-                logger.error(f"Failed to download image: {image_response.status_code}")
-                return None
                 
+        except requests.exceptions.Timeout:
+            logger.error(f"Image generation timed out after {deadline.seconds:.0f}s")
+            return None
         except Exception as e:
             logger.error(f"Error generating image: {e}")
             return None
@@ -84,29 +147,198 @@ class DalleProvider(ImageProvider):
 class ComfyUIProvider(ImageProvider):
     """ComfyUI image generation provider."""
     
+    name = "comfyui"
+    
     def __init__(self):
         self.api_url = os.getenv('COMFYUI_API_URL', 'http://192.168.1.9:7860')
-        self.resolution = os.getenv('IMAGE_RESOLUTION', '768x768')
-        self.steps = int(os.getenv('IMAGE_STEPS', '30'))
-        self.cfg = float(os.getenv('IMAGE_CFG', '7'))
-        self.sampler = os.getenv('IMAGE_SAMPLER', 'DPM++ 2M')
+        self.profiles = ProfileMap()
         self.model = os.getenv('IMAGE_MODEL', 'sd3_medium_incl_clips_t5xxlfp16.safetensors')
+        # Two-pass mode: a low-resolution draft, checked, then upscaled in latent space and refined
+        self.two_pass = os.getenv('COMFYUI_TWO_PASS', 'false').lower() == 'true'
+        self.draft_scale = float(os.getenv('IMAGE_DRAFT_SCALE', '0.5'))
+        self.draft_attempts = int(os.getenv('IMAGE_DRAFT_ATTEMPTS', '2'))
+        self.refine_steps = int(os.getenv('IMAGE_REFINE_STEPS', '0'))
+        self.refine_denoise = float(os.getenv('IMAGE_REFINE_DENOISE', '0.5'))
+        self.session = get_session()
+        # Locally mounted ComfyUI output directories, so finished images can be linked instead of downloaded
+        self.output_dirs = {}
+        if os.getenv('COMFYUI_OUTPUT_DIR'):
+            self.output_dirs[self.api_url.rstrip('/')] = os.getenv('COMFYUI_OUTPUT_DIR')
+        for entry in os.getenv('COMFYUI_OUTPUT_DIRS', '').split(','):
+            if '=' in entry:
+                url, directory = entry.split('=', 1)
+                self.output_dirs[url.strip().rstrip('/')] = directory.strip()
+        # Whether the endpoint itself failed the current render, per thread
+        self._local = threading.local()
         logger.info(f"Initialized ComfyUIProvider with model: {self.model}")
     
-    def generate_image(self, prompt: str) -> Optional[str]:
-        """Generate an image using ComfyUI."""
-        logger.info(f"Generating image with ComfyUI at {self.api_url}")
+    def settings(self, slot: Optional[str] = None) -> dict:
+        profile = self.profiles.profile_for(slot)
+        settings = profile.settings()
+        if self.two_pass and not profile.img2img:
+            settings["Draft"] = f"{profile.scaled(self.draft_scale).resolution}, refined in {self.refine_steps_for(profile)} steps"
+        return {**settings, "Model": self.model}
+    
+    def queue_depth(self) -> Optional[int]:
+        """Prompts running or queued on the host, or None if it doesn't answer."""
+        try:
+            queue = self.session.get(f"{self.api_url}/queue", timeout=PROBE_TIMEOUT).json()
+        except Exception as e:
+            logger.warning(f"ComfyUI at {self.api_url} failed queue check: {e}")
+            return None
+        return len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
+    
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None, slot: Optional[str] = None,
+                       source_image: Optional[str] = None) -> Optional[str]:
+        """Generate an image using ComfyUI, with the render profile for the slot."""
+        deadline = deadline or Deadline(IMAGE_TIMEOUT_SECONDS, "image")
+        return self.render_slot(prompt, slot, source_image, deadline, self.api_url)
+    
+    def endpoint_failed(self) -> None:
+        """Note a transport or HTTP error, as opposed to a timeout or a rejected image."""
+        self._local.endpoint_failed = True
+    
+    def render_slot(self, prompt: str, slot: Optional[str], source_image: Optional[str],
+                    deadline: Deadline, api_url: str) -> Optional[str]:
+        """Render an image for a slot on one endpoint, as img2img, in two passes or in one."""
+        profile = self.profiles.profile_for(slot)
+        init_image = None
+        if profile.img2img and source_image:
+            init_image = self.upload(os.path.join(IMAGES_DIR, source_image), deadline, api_url)
+        if self.two_pass and not init_image:
+            return self.render_two_pass(prompt, profile, deadline, api_url)
+        return self.render(self.build_workflow(prompt, profile, init_image), deadline, api_url)
+    
+    def render_two_pass(self, prompt: str, profile: RenderProfile, deadline: Deadline, api_url: str) -> Optional[str]:
+        """Render a low-resolution draft, and only upscale and refine it if it looks like an image.
+        
+        The refine workflow repeats the draft's nodes with the same inputs and
+        seed, so ComfyUI serves them from its cache and only runs the latent
+        upscale and the refine pass. If another prompt ran in between and
+        evicted the cache, the draft is sampled again, with the same result.
+        """
+        draft_profile = profile.scaled(self.draft_scale)
+        seed = int(datetime.now().timestamp())
+        for attempt in range(self.draft_attempts):
+            draft = self.build_workflow(prompt, draft_profile, seed=seed + attempt)
+            with span("image.draft", provider=self.name, model=self.model, resolution=draft_profile.resolution,
+                      attempt=attempt + 1) as s:
+                filename = self.render(draft, deadline, api_url)
+                if not filename:
+                    s.set(outcome="error")
+                    return None
+                path = os.path.join(IMAGES_DIR, filename)
+                problem = image_problem(path)
+                os.remove(path)
+                if problem is None:
+                    break
+                logger.warning(f"Discarding {problem} draft (attempt {attempt + 1} of {self.draft_attempts})")
+                s.set(outcome="rejected", problem=problem)
+        else:
+            logger.error(f"No usable draft after {self.draft_attempts} attempts")
+            return None
+        
+        return self.render(self.refine_workflow(draft, profile), deadline, api_url)
+    
+    def refine_steps_for(self, profile: RenderProfile) -> int:
+        return self.refine_steps or max(1, profile.steps // 3)
+    
+    def refine_workflow(self, draft: dict, profile: RenderProfile) -> dict:
+        """Extend a draft workflow with a latent upscale to the profile's size and a short refine pass."""
+        workflow = copy.deepcopy(draft)
+        workflow["13"] = {
+            "class_type": "LatentUpscale",
+            "inputs": {
+                "upscale_method": "nearest-exact",
+                "width": profile.width,
+                "height": profile.height,
+                "crop": "disabled",
+                "samples": ["3", 0]
+            }
+        }
+        workflow["14"] = {"class_type": "KSampler", "inputs": {
+            **workflow["3"]["inputs"],
+            "steps": self.refine_steps_for(profile),
+            "denoise": self.refine_denoise,
+            "latent_image": ["13", 0]
+        }}
+        workflow["8"]["inputs"]["samples"] = ["14", 0]
+        return workflow
+    
+    def upload(self, filepath: str, deadline: Deadline, api_url: str) -> Optional[str]:
+        """Upload an image to ComfyUI's input directory and return the name LoadImage knows it by."""
+        with span("image.upload", provider=self.name, endpoint=api_url) as s:
+            try:
+                with open(filepath, "rb") as f:
+                    response = self.session.post(f"{api_url}/upload/image",
+                                                 files={"image": (os.path.basename(filepath), f, "image/png")},
+                                                 data={"type": "input", "overwrite": "true"},
+                                                 timeout=request_timeout(deadline))
+                response.raise_for_status()
+                uploaded = response.json()
+            except Exception as e:
+                logger.warning(f"Could not upload {filepath} for img2img, rendering from scratch: {e}")
+                s.set(outcome="error")
+                self.endpoint_failed()
+                return None
+            s.set(bytes=os.path.getsize(filepath))
+            if uploaded.get('subfolder'):
+                return f"{uploaded['subfolder']}/{uploaded['name']}"
+            return uploaded['name']
+    
+    def render(self, workflow: dict, deadline: Deadline, api_url: str) -> Optional[str]:
+        """Run a workflow on a ComfyUI endpoint and download the result."""
+        logger.info(f"Generating image with ComfyUI at {api_url}")
+        
+        prompt_id = None
+        try:
+            prompt_id = self.submit(workflow, deadline, api_url)
+            if not prompt_id:
+                return None
+            
+            image_data = self.wait(prompt_id, deadline, api_url)
+            if not image_data:
+                if deadline.cancelled:
+                    logger.info(f"Image generation cancelled (prompt ID: {prompt_id})")
+                else:
+                    logger.error(f"Image generation timed out after {deadline.seconds:.0f}s (prompt ID: {prompt_id})")
+                self.cancel(prompt_id, api_url)
+                return None
+            
+            return self.download(image_data, deadline, api_url)
+                
+        except requests.exceptions.Timeout:
+            logger.error(f"Image generation timed out after {deadline.seconds:.0f}s")
+            # Requests are cut short when the deadline runs out; otherwise the endpoint stopped answering
+            if not deadline.expired():
+                self.endpoint_failed()
+            if prompt_id:
+                self.cancel(prompt_id, api_url)
+            return None
+        except Exception as e:
+            logger.error(f"Error generating image: {e}")
+            self.endpoint_failed()
+            return None
+    
+    def build_workflow(self, prompt: str, profile: Optional[RenderProfile] = None,
+                       init_image: Optional[str] = None, seed: Optional[int] = None) -> dict:
+        """Build the ComfyUI workflow for a prompt and render profile.
         
-        # ComfyUI workflow for text-to-image
+        With init_image, an image in ComfyUI's input directory, the workflow
+        is img2img: the image is scaled to the profile's size, encoded and
+        sampled at the profile's denoise, instead of starting from noise.
+        """
+        profile = profile or self.profiles.profile_for()
+        sampler_name, scheduler = profile.comfyui_sampler()
         workflow = {
             "3": {
                 "class_type": "KSampler",
                 "inputs": {
-                    "seed": int(datetime.now().timestamp()),
-                    "steps": self.steps,
-                    "cfg": self.cfg,
-                    "sampler_name": "dpmpp_2m",
-                    "scheduler": "normal",
+                    "seed": seed if seed is not None else int(datetime.now().timestamp()),
+                    "steps": profile.steps,
+                    "cfg": profile.cfg,
+                    "sampler_name": sampler_name,
+                    "scheduler": scheduler,
                     "denoise": 1,
                     "model": ["4", 0],
                     "positive": ["6", 0],
@@ -124,8 +356,8 @@ class ComfyUIProvider(ImageProvider):
                 "class_type": "EmptyLatentImage",
                 "inputs": {
                     "batch_size": 1,
-                    "height": 768,
-                    "width": 768
+                    "height": profile.height,
+                    "width": profile.width
                 }
             },
             "6": {
@@ -157,54 +389,338 @@ class ComfyUIProvider(ImageProvider):
                 }
             }
         }
-        
-        try:
-            # Start the image generation
-            response = requests.post(f"{self.api_url}/prompt", json={"prompt": workflow})
+        if init_image:
+            del workflow["5"]
+            workflow["10"] = {"class_type": "LoadImage", "inputs": {"image": init_image}}
+            workflow["11"] = {
+                "class_type": "ImageScale",
+                "inputs": {
+                    "upscale_method": "lanczos",
+                    "width": profile.width,
+                    "height": profile.height,
+                    "crop": "center",
+                    "image": ["10", 0]
+                }
+            }
+            workflow["12"] = {"class_type": "VAEEncode", "inputs": {"pixels": ["11", 0], "vae": ["4", 2]}}
+            workflow["3"]["inputs"]["latent_image"] = ["12", 0]
+            workflow["3"]["inputs"]["denoise"] = profile.denoise
+        return workflow
+    
+    def submit(self, workflow: dict, deadline: Deadline, api_url: str) -> Optional[str]:
+        """Queue a workflow and return its prompt ID."""
+        with span("image.submit", provider=self.name, model=self.model, endpoint=api_url) as s:
+            response = self.session.post(f"{api_url}/prompt", json={"prompt": workflow}, timeout=request_timeout(deadline))
             if response.status_code != 200:
                 logger.error(f"Error starting image generation: {response.text}")
+                s.set(outcome="error", status=response.status_code)
+                self.endpoint_failed()
                 return None
             
             prompt_id = response.json()['prompt_id']
+            s.set(prompt_id=prompt_id)
             logger.info(f"Image generation started with prompt ID: {prompt_id}")
-            
-            # Wait for the image to be generated
-            while True:
-                history = requests.get(f"{self.api_url}/history/{prompt_id}").json()
+            return prompt_id
+    
+    def wait(self, prompt_id: str, deadline: Deadline, api_url: str) -> Optional[dict]:
+        """Poll the history until the SaveImage output shows up or the deadline expires."""
+        with span("image.wait", provider=self.name, model=self.model, prompt_id=prompt_id) as s:
+            polls = 0
+            while not deadline.expired():
+                polls += 1
+                history = self.session.get(f"{api_url}/history/{prompt_id}", timeout=request_timeout(deadline)).json()
                 if prompt_id in history:
                     if 'outputs' in history[prompt_id]:
                         outputs = history[prompt_id]['outputs']
                         if '9' in outputs:  # Our SaveImage node
-                            image_data = outputs['9']['images'][0]
-                            
-                            # Create images directory if it doesn't exist
-                            images_dir = "static/images"
-                            os.makedirs(images_dir, exist_ok=True)
-                            
-                            # Generate a unique filename
-                            timestamp = datetime.now().strftime("%H%M%S")
-                            filename = f"comfyui-{timestamp}.png"
-                            filepath = os.path.join(images_dir, filename)
-                            
-                            # Download the image
-                            image_url = f"{self.api_url}/view?filename={image_data['filename']}&subfolder={image_data['subfolder']}&type={image_data['type']}"
-                            image_response = requests.get(image_url)
-                            
-                            if image_response.status_code == 200:
-                                with open(filepath, "wb") as f:
-                                    f.write(image_response.content)
-                                logger.info(f"Image saved to: {filepath}")
-                                return filename
-                            else:
-                                logger.error(f"Failed to download image: {image_response.status_code}")
-                                return None
+                            s.set(polls=polls, sampling_ms=execution_ms(history[prompt_id]))
+                            return outputs['9']['images'][0]
                 
                 logger.info("Waiting for image generation...")
-                time.sleep(1)
-                
+                time.sleep(min(1, deadline.remaining()))
+            
+            s.set(outcome="timeout", polls=polls)
+            return None
+    
+    def download(self, image_data: dict, deadline: Deadline, api_url: str) -> Optional[str]:
+        """Download a finished image into static/images and return its filename."""
+        with span("image.download", provider=self.name, model=self.model) as s:
+            filename, filepath = new_image_path("comfyui")
+            
+            # Take the file straight from a mounted output directory when we can
+            output_dir = self.output_dirs.get(api_url.rstrip('/'))
+            if output_dir and image_data.get('type') == 'output':
+                source = os.path.join(output_dir, image_data.get('subfolder', ''), image_data['filename'])
+                if os.path.isfile(source):
+                    size, method = link_or_copy(source, filepath)
+                    s.set(bytes=size, method=method)
+                    logger.info(f"Image saved to: {filepath}")
+                    return filename
+                logger.warning(f"{source} not found in the mounted output directory, downloading instead")
+            
+            # Otherwise stream it from /view
+            query = urlencode({'filename': image_data['filename'], 'subfolder': image_data['subfolder'], 'type': image_data['type']})
+            size = stream_to_file(self.session, f"{api_url}/view?{query}", filepath, request_timeout(deadline))
+            if size is None:
+                s.set(outcome="error")
+                self.endpoint_failed()
+                return None
+            s.set(bytes=size, method="stream")
+            logger.info(f"Image saved to: {filepath}")
+            return filename
+    
+    def cancel(self, prompt_id: str, api_url: str) -> None:
+        """Stop a prompt so it doesn't keep the GPU busy after we gave up on it.
+        
+        A running prompt is interrupted, a pending one is removed from the queue.
+        /interrupt stops whatever is currently executing, so it is only sent when
+        the running prompt is ours.
+        """
+        try:
+            queue = self.session.get(f"{api_url}/queue", timeout=REQUEST_CANCEL_TIMEOUT).json()
+            running = [item[1] for item in queue.get('queue_running', [])]
+            if prompt_id in running:
+                logger.info(f"Interrupting running prompt: {prompt_id}")
+                self.session.post(f"{api_url}/interrupt", timeout=REQUEST_CANCEL_TIMEOUT)
+            self.session.post(f"{api_url}/queue", json={"delete": [prompt_id]}, timeout=REQUEST_CANCEL_TIMEOUT)
+            logger.info(f"Removed prompt from queue: {prompt_id}")
         except Exception as e:
-            logger.error(f"Error generating image: {e}")
+            logger.error(f"Error cancelling prompt {prompt_id}: {e}")
+
+class ComfyUIEndpoint:
+    """Load and health state of one ComfyUI host in a pool."""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.queue_depth = 0
+        self.dispatched_since_probe = 0
+        self.vram_free = 0
+        self.checkpoints = None
+        self.loaded_checkpoint = None
+        self.render_seconds = None
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.last_probe = 0.0
+    
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+    
+    def has_checkpoint(self, checkpoint: str) -> bool:
+        # Unknown checkpoint lists are treated as "probably has it"
+        return self.checkpoints is None or checkpoint in self.checkpoints
+
+class ComfyUIPoolProvider(ComfyUIProvider):
+    """ComfyUI provider that spreads renders over several ComfyUI hosts.
+    
+    Each endpoint's /queue and /system_stats are probed before dispatch. A
+    render goes to the endpoint with the lowest estimated wait: queued work
+    times its average render time, plus a model-load penalty unless the
+    endpoint last ran the checkpoint we need. Endpoints that fail probes or
+    renders are drained for a while and then probed again.
+    """
+    
+    def __init__(self, urls: Optional[List[str]] = None):
+        super().__init__()
+        urls = urls or [url.strip() for url in os.getenv('COMFYUI_API_URLS', self.api_url).split(',') if url.strip()]
+        self.endpoints = [ComfyUIEndpoint(url.rstrip('/')) for url in urls]
+        self.probe_interval = float(os.getenv('COMFYUI_PROBE_INTERVAL', '2'))
+        self.drain_seconds = float(os.getenv('COMFYUI_DRAIN_SECONDS', '120'))
+        self.max_failures = int(os.getenv('COMFYUI_MAX_FAILURES', '2'))
+        self.load_penalty = float(os.getenv('COMFYUI_LOAD_PENALTY', '20'))
+        self.lock = threading.Lock()
+        logger.info(f"Initialized ComfyUIPoolProvider with {len(self.endpoints)} endpoints")
+    
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None, slot: Optional[str] = None,
+                       source_image: Optional[str] = None) -> Optional[str]:
+        """Generate an image on the least-loaded endpoint."""
+        deadline = deadline or Deadline(IMAGE_TIMEOUT_SECONDS, "image")
+        endpoint = self.acquire(self.model)
+        if endpoint is None:
+            logger.error("No healthy ComfyUI endpoints available")
             return None
+        
+        started = time.monotonic()
+        self._local.endpoint_failed = False
+        filename = self.render_slot(prompt, slot, source_image, deadline, endpoint.url)
+        # Only transport and HTTP errors count against the endpoint. A timeout, a cancelled
+        # render or a draft rejected as blank says nothing about the endpoint's health
+        succeeded = filename is not None or not self._local.endpoint_failed
+        self.release(endpoint, succeeded, time.monotonic() - started if filename is not None else None)
+        return filename
+    
+    def queue_depth(self) -> Optional[int]:
+        """Work queued on the least busy healthy endpoint, or None if none is healthy."""
+        self.refresh()
+        with self.lock:
+            depths = [e.queue_depth + e.dispatched_since_probe for e in self.endpoints if e.healthy()]
+        return min(depths) if depths else None
+    
+    def probe(self, endpoint: ComfyUIEndpoint) -> None:
+        """Refresh an endpoint's queue depth, free VRAM and available checkpoints."""
+        try:
+            queue = self.session.get(f"{endpoint.url}/queue", timeout=PROBE_TIMEOUT).json()
+            stats = self.session.get(f"{endpoint.url}/system_stats", timeout=PROBE_TIMEOUT).json()
+            if endpoint.checkpoints is None:
+                info = self.session.get(f"{endpoint.url}/object_info/CheckpointLoaderSimple", timeout=PROBE_TIMEOUT).json()
+                names = info.get('CheckpointLoaderSimple', {}).get('input', {}).get('required', {}).get('ckpt_name', [[]])[0]
+                endpoint.checkpoints = set(names) if names else None
+        except Exception as e:
+            logger.warning(f"ComfyUI endpoint {endpoint.url} failed probe: {e}")
+            with self.lock:
+                self._mark_failed(endpoint)
+            return
+        
+        with self.lock:
+            endpoint.queue_depth = len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
+            endpoint.dispatched_since_probe = 0
+            endpoint.vram_free = sum(device.get('vram_free', 0) for device in stats.get('devices', []))
+            endpoint.last_probe = time.monotonic()
+            if not endpoint.healthy():
+                logger.info(f"ComfyUI endpoint {endpoint.url} is healthy again")
+            endpoint.unhealthy_until = 0.0
+            endpoint.failures = 0
+    
+    def refresh(self) -> None:
+        """Probe every endpoint whose last probe is out of date, in parallel."""
+        now = time.monotonic()
+        stale = [e for e in self.endpoints if now - e.last_probe >= self.probe_interval and now >= e.unhealthy_until]
+        if stale:
+            with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                list(pool.map(self.probe, stale))
+    
+    def acquire(self, checkpoint: str) -> Optional[ComfyUIEndpoint]:
+        """Pick the endpoint with the lowest estimated wait for a checkpoint."""
+        self.refresh()
+        with self.lock:
+            candidates = [e for e in self.endpoints if e.healthy() and e.has_checkpoint(checkpoint)]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: (self.estimated_wait(e, checkpoint), -e.vram_free))
+            endpoint.dispatched_since_probe += 1
+            endpoint.loaded_checkpoint = checkpoint
+        logger.info(f"Dispatching render to {endpoint.url}")
+        return endpoint
+    
+    def estimated_wait(self, endpoint: ComfyUIEndpoint, checkpoint: str) -> float:
+        """Seconds a new render would wait on an endpoint before it finishes loading."""
+        render_seconds = endpoint.render_seconds or 30.0
+        wait = (endpoint.queue_depth + endpoint.dispatched_since_probe) * render_seconds
+        if endpoint.loaded_checkpoint != checkpoint:
+            wait += self.load_penalty
+        return wait
+    
+    def release(self, endpoint: ComfyUIEndpoint, succeeded: bool, seconds: Optional[float]) -> None:
+        """Record the outcome of a render; seconds is None when it produced no image to time."""
+        with self.lock:
+            if succeeded:
+                endpoint.failures = 0
+                if seconds is None:
+                    return
+                # Moving average, so a slow checkpoint load doesn't stick
+                endpoint.render_seconds = seconds if endpoint.render_seconds is None else 0.7 * endpoint.render_seconds + 0.3 * seconds
+            else:
+                self._mark_failed(endpoint)
+    
+    def _mark_failed(self, endpoint: ComfyUIEndpoint) -> None:
+        endpoint.failures += 1
+        if endpoint.failures >= self.max_failures and endpoint.healthy():
+            logger.warning(f"Draining ComfyUI endpoint {endpoint.url} for {self.drain_seconds:.0f}s")
+            endpoint.unhealthy_until = time.monotonic() + self.drain_seconds
+
+class HedgedImageProvider(ImageProvider):
+    """ComfyUI first, with DALL-E as a hedge when ComfyUI is slow or down.
+    
+    A render goes straight to DALL-E when ComfyUI doesn't answer or has more
+    than COMFYUI_MAX_QUEUE prompts queued. Otherwise DALL-E is only started
+    when ComfyUI fails, or hasn't finished after IMAGE_HEDGE_AFTER seconds;
+    from then on the first image wins. A losing ComfyUI render is interrupted
+    or dequeued, and a losing DALL-E image is deleted when it arrives.
+    """
+    
+    name = "hedged"
+    
+    def __init__(self, primary: Optional[ComfyUIProvider] = None, fallback: Optional[ImageProvider] = None):
+        self.primary = primary or (ComfyUIPoolProvider() if os.getenv('COMFYUI_API_URLS') else ComfyUIProvider())
+        self.fallback = fallback or DalleProvider()
+        self.model = self.primary.model
+        self.hedge_after = float(os.getenv('IMAGE_HEDGE_AFTER', '120'))
+        self.max_queue = int(os.getenv('COMFYUI_MAX_QUEUE', '2'))
+        self.sources = OrderedDict()
+        self.lock = threading.Lock()
+        logger.info(f"Initialized HedgedImageProvider: {self.primary.name} with {self.fallback.name} after {self.hedge_after:.0f}s")
+    
+    def settings(self, slot: Optional[str] = None) -> dict:
+        return self.primary.settings(slot)
+    
+    def source_for(self, filename: str) -> ImageProvider:
+        with self.lock:
+            return self.sources.get(filename, self.primary)
+    
+    def _record(self, filename: Optional[str], provider: ImageProvider) -> Optional[str]:
+        if filename:
+            with self.lock:
+                self.sources[filename] = provider
+                # Generators look images up right after generating them, so a short memory is enough
+                while len(self.sources) > 256:
+                    self.sources.popitem(last=False)
+        return filename
+    
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None, slot: Optional[str] = None,
+                       source_image: Optional[str] = None) -> Optional[str]:
+        """Generate an image on ComfyUI, hedging with DALL-E when needed."""
+        deadline = deadline or Deadline(IMAGE_TIMEOUT_SECONDS, "image")
+        with span("image.hedge", provider=self.primary.name, model=self.model) as s:
+            depth = self.primary.queue_depth()
+            if depth is None or depth > self.max_queue:
+                reason = "down" if depth is None else f"queue depth {depth}"
+                logger.info(f"ComfyUI {reason}, sending image straight to {self.fallback.name}")
+                s.set(winner=self.fallback.name, reason="down" if depth is None else "queue", queue_depth=depth)
+                return self._record(self.fallback.generate_image(prompt, deadline, slot, source_image), self.fallback)
+            
+            # The primary gets its own deadline so it can be cancelled without touching the caller's
+            primary_deadline = Deadline(deadline.remaining(), deadline.name)
+            pool = ThreadPoolExecutor(max_workers=2)
+            running = {pool.submit(contextvars.copy_context().run, self.primary.generate_image, prompt, primary_deadline, slot, source_image): self.primary}
+            hedged = False
+            try:
+                while running and not deadline.expired():
+                    timeout = deadline.remaining() if hedged else min(self.hedge_after, deadline.remaining())
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        provider = running.pop(future)
+                        filename = future.result()
+                        if filename:
+                            self._cancel_losers(running, primary_deadline)
+                            s.set(winner=provider.name, hedged=hedged)
+                            return self._record(filename, provider)
+                    if not hedged and not deadline.expired():
+                        reason = "failed" if done else f"still running after {self.hedge_after:.0f}s"
+                        logger.info(f"ComfyUI {reason}, hedging with {self.fallback.name}")
+                        running[pool.submit(contextvars.copy_context().run, self.fallback.generate_image, prompt, deadline, slot, source_image)] = self.fallback
+                        hedged = True
+                
+                self._cancel_losers(running, primary_deadline)
+                s.set(outcome="error", hedged=hedged)
+                return None
+            finally:
+                pool.shutdown(wait=False)
+    
+    def _cancel_losers(self, running: dict, primary_deadline: Deadline) -> None:
+        for future, provider in running.items():
+            if provider is self.primary:
+                primary_deadline.cancel()
+            # Either loser may still finish; its image is not used
+            future.add_done_callback(_discard_image)
+
+def _discard_image(future) -> None:
+    """Delete an image that lost a hedge, so it doesn't linger in static/images."""
+    try:
+        filename = future.result()
+        if filename:
+            os.remove(os.path.join(IMAGES_DIR, filename))
+            logger.info(f"Discarded hedged image: {filename}")
+    except Exception as e:
+        logger.warning(f"Could not discard hedged image: {e}")
 
 def get_image_provider() -> ImageProvider:
     """Factory function to get the configured image provider."""
@@ -214,7 +730,13 @@ def get_image_provider() -> ImageProvider:
         logger.info("Creating DALL-E provider")
         return DalleProvider()
     elif provider == 'comfyui':
+        if os.getenv('COMFYUI_API_URLS'):
+            logger.info("Creating ComfyUI pool provider")
+            return ComfyUIPoolProvider()
         logger.info("Creating ComfyUI provider")
         return ComfyUIProvider()
+    elif provider == 'hedged':
+        logger.info("Creating hedged ComfyUI/DALL-E provider")
+        return HedgedImageProvider()
     else:
         raise ValueError(f"Unknown image provider: {provider}") 
\ No newline at end of file
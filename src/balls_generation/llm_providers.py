@@ -1,16 +1,28 @@
 """LLM provider implementations for content generation."""
 
 import os
+import math
+import statistics
+import contextvars
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, List, Optional
 import logging
 import re
 import json
+import time
+import threading
 
 from openai import OpenAI
 from dotenv import load_dotenv
 import requests
 
+from .utils.deadline import Deadline
+from .utils.tracing import span
+from .utils.ratelimit import get_limiter
+from .transport import get_session, get_openai_http_client
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,26 +30,43 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# /api/ps is cheap; a slow answer means the host is in trouble
+PROBE_TIMEOUT = 3
+
+def parse_keep_alive(value: str):
+    """Ollama takes keep_alive as seconds or as a duration string like "5m"."""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
 class LLMProvider(ABC):
     """Abstract base class for LLM providers."""
     
     @abstractmethod
-    def generate_content(self, prompt: str) -> str:
-        """Generate content from a prompt."""
+    def generate_content(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        """Generate content from a prompt, giving up once the deadline expires."""
         pass
     
     @abstractmethod
-    def generate_image(self, prompt: str) -> Optional[str]:
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """Generate an image from a prompt.
         
         Returns:
             Optional[str]: URL of the generated image, or None if image generation is not supported
         """
         pass
+    
+    @property
+    def last_provider(self) -> "LLMProvider":
+        """The provider that produced the last result on this thread, for tagging."""
+        return self
 
 class OllamaProvider(LLMProvider):
     """Provider for Ollama API."""
     
+    name = "ollama"
+    
     def __init__(self, model: str = None):
         self.model = model or os.getenv('OLLAMA_MODEL', 'llama2')
         self.api_url = os.getenv('OLLAMA_API_URL', 'http://192.168.1.9:11434')
@@ -46,10 +75,24 @@ class OllamaProvider(LLMProvider):
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        self.session = get_session()
+        # 0 unloads the model after each request so ComfyUI gets the VRAM back
+        self.keep_alive = parse_keep_alive(os.getenv('OLLAMA_KEEP_ALIVE', '0'))
+        # Whether the host itself failed the current request, per thread
+        self._local = threading.local()
         logger.info(f"Initialized OllamaProvider with model: {self.model} at {self.api_url}")
     
-    def generate_content(self, prompt: str) -> str:
+    def generate_content(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
         """Generate text using Ollama API."""
+        deadline = deadline or Deadline.for_post().stage("llm")
+        return self.complete(prompt, deadline, self.api_url)
+    
+    def host_failed(self) -> None:
+        """Note a transport or HTTP error, as opposed to the caller's deadline running out."""
+        self._local.host_failed = True
+    
+    def complete(self, prompt: str, deadline: Deadline, api_url: str) -> str:
+        """Run a generate request against one Ollama host."""
         try:
             # Add system prompt to ensure JSON output
             system_prompt = """You are a helpful assistant that generates content in JSON format.
@@ -73,16 +116,17 @@ class OllamaProvider(LLMProvider):
             
             full_prompt = f"{system_prompt}\n\nUser: {prompt}\n\nAssistant:"
             
-            response = requests.post(
-                f"{self.api_url}/api/generate",
+            response = self.session.post(
+                f"{api_url}/api/generate",
                 headers=self.headers,
                 json={
                     "model": self.model,
                     "prompt": full_prompt,
                     "stream": False,
-                    "keep_alive": 0,  # Prevent keeping VRAM full
+                    "keep_alive": self.keep_alive,
                     "format": "json"  # Request JSON format
-                }
+                },
+                timeout=deadline.timeout()
             )
             
             if response.status_code == 200:
@@ -112,61 +156,357 @@ class OllamaProvider(LLMProvider):
                     })
             else:
                 logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+                self.host_failed()
                 return ""
                 
+        except requests.exceptions.Timeout:
+            logger.error(f"Ollama request timed out after {deadline.seconds:.0f}s")
+            # Requests are cut short when the deadline runs out; otherwise the host stopped answering
+            if not deadline.expired():
+                self.host_failed()
+            return ""
         except Exception as e:
             logger.error(f"Error generating content with Ollama: {str(e)}")
+            self.host_failed()
             return ""
     
-    def generate_image(self, prompt: str) -> Optional[str]:
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """Ollama doesn't support image generation."""
         logger.warning("Image generation not supported by Ollama")
         return None
 
+class OllamaHost:
+    """Capacity and residency state of one Ollama host in a pool."""
+    
+    def __init__(self, url: str, parallel: int):
+        self.url = url
+        self.parallel = parallel
+        self.in_flight = 0
+        self.resident = set()
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.last_probe = 0.0
+    
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+class OllamaPoolProvider(OllamaProvider):
+    """Ollama provider that spreads requests over several Ollama hosts.
+    
+    Requests go to a host that already has the model resident (from /api/ps),
+    falling back to the least busy host. Each host takes at most its
+    configured number of parallel requests; when every host is full, requests
+    wait for a free slot until their deadline.
+    
+    Hosts come from OLLAMA_API_URLS as a comma-separated list. An entry can
+    end with "|N" to set that host's parallelism, e.g. "http://gpu1:11434|4".
+    """
+    
+    def __init__(self, model: str = None, urls: Optional[List[str]] = None):
+        super().__init__(model)
+        # Residency is what the pool routes on, so keep models loaded unless told otherwise
+        self.keep_alive = parse_keep_alive(os.getenv('OLLAMA_KEEP_ALIVE', '5m'))
+        default_parallel = int(os.getenv('OLLAMA_HOST_PARALLEL', '1'))
+        self.hosts = []
+        for entry in urls or os.getenv('OLLAMA_API_URLS', self.api_url).split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            url, _, parallel = entry.partition('|')
+            self.hosts.append(OllamaHost(url.rstrip('/'), int(parallel) if parallel else default_parallel))
+        self.probe_interval = float(os.getenv('OLLAMA_PROBE_INTERVAL', '10'))
+        self.drain_seconds = float(os.getenv('OLLAMA_DRAIN_SECONDS', '120'))
+        self.available = threading.Condition()
+        logger.info(f"Initialized OllamaPoolProvider with {len(self.hosts)} hosts")
+    
+    def generate_content(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        """Generate text on the best available host."""
+        deadline = deadline or Deadline.for_post().stage("llm")
+        host = self.acquire(deadline)
+        if host is None:
+            logger.error("No Ollama host available before the deadline")
+            return ""
+        
+        result = ""
+        self._local.host_failed = False
+        try:
+            result = self.complete(prompt, deadline, host.url)
+        finally:
+            # Only transport and HTTP errors count against the host, not a deadline that ran out
+            self.release(host, bool(result) or not self._local.host_failed)
+        return result
+    
+    def probe(self, host: OllamaHost) -> None:
+        """Refresh which models a host has resident."""
+        try:
+            models = self.session.get(f"{host.url}/api/ps", timeout=PROBE_TIMEOUT).json().get('models', [])
+        except Exception as e:
+            logger.warning(f"Ollama host {host.url} failed probe: {e}")
+            with self.available:
+                self._mark_failed(host)
+            return
+        with self.available:
+            host.resident = {m.get('name') or m.get('model') for m in models}
+            host.last_probe = time.monotonic()
+            host.failures = 0
+            host.unhealthy_until = 0.0
+    
+    def acquire(self, deadline: Deadline) -> Optional[OllamaHost]:
+        """Reserve a slot on a host, waiting for one to free up if needed."""
+        now = time.monotonic()
+        stale = [h for h in self.hosts if now - h.last_probe >= self.probe_interval and now >= h.unhealthy_until]
+        if stale:
+            with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                list(pool.map(self.probe, stale))
+        
+        with self.available:
+            while True:
+                healthy = [h for h in self.hosts if h.healthy()]
+                if not healthy:
+                    return None
+                free = [h for h in healthy if h.in_flight < h.parallel]
+                if free:
+                    host = min(free, key=lambda h: (self.model not in h.resident, h.in_flight / h.parallel))
+                    host.in_flight += 1
+                    logger.info(f"Routing request for {self.model} to {host.url}")
+                    return host
+                if deadline.expired():
+                    return None
+                self.available.wait(min(1.0, deadline.remaining()))
+    
+    def release(self, host: OllamaHost, succeeded: bool) -> None:
+        """Free a host's slot and record the outcome."""
+        with self.available:
+            host.in_flight -= 1
+            if succeeded:
+                host.failures = 0
+                if self.keep_alive != 0:
+                    host.resident.add(self.model)
+            else:
+                self._mark_failed(host)
+            self.available.notify()
+    
+    def _mark_failed(self, host: OllamaHost) -> None:
+        host.failures += 1
+        if host.failures >= 2 and host.healthy():
+            logger.warning(f"Draining Ollama host {host.url} for {self.drain_seconds:.0f}s")
+            host.unhealthy_until = time.monotonic() + self.drain_seconds
+
 class OpenAIProvider(LLMProvider):
     """OpenAI API provider implementation."""
     
+    name = "openai"
+    
     def __init__(self):
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
         
-        self.client = OpenAI(api_key=api_key)
+        # Retries are left to the shared rate limiter, which knows about the other threads
+        self.client = OpenAI(api_key=api_key, http_client=get_openai_http_client(), max_retries=0)
         self.model = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
         self.image_model = os.getenv('OPENAI_IMAGE_MODEL', 'dall-e-3')
         self.image_quality = os.getenv('OPENAI_IMAGE_QUALITY', 'standard')
         self.image_size = os.getenv('OPENAI_IMAGE_SIZE', '1024x1024')
         logger.info(f"Initialized OpenAIProvider with model: {self.model} and image model: {self.image_model}")
     
-    def generate_content(self, prompt: str) -> str:
+    def generate_content(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
         """Generate content using OpenAI API."""
+        deadline = deadline or Deadline.for_post().stage("llm")
         logger.info("Generating content with OpenAI")
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
+        request = self.chat_request(prompt)
+        # Roughly four characters per token, plus the completion we allow
+        tokens = len(prompt) / 4 + request["max_tokens"]
+        response = get_limiter(self.model).call(
+            lambda: self.client.with_options(timeout=deadline.timeout()).chat.completions.with_raw_response.create(**request),
+            deadline, tokens, usage=lambda r: r.usage.total_tokens if r.usage else None
+        )
+        return response.choices[0].message.content
+    
+    def chat_request(self, prompt: str) -> Dict[str, Any]:
+        """The chat completion request body for a prompt, shared with batch mode."""
+        return {
+            "model": self.model,
+            "messages": [
                 {"role": "system", "content": "You are a creative writer who specializes in humorous stories and satirical news articles about balls."},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=int(os.getenv('MAX_STORY_LENGTH', 400))
-        )
-        return response.choices[0].message.content
+            "max_tokens": int(os.getenv('MAX_STORY_LENGTH', 400))
+        }
     
-    def generate_image(self, prompt: str) -> Optional[str]:
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """Generate an image using DALL-E."""
+        deadline = deadline or Deadline.for_post()
         logger.info(f"Generating image with {self.image_model}")
         try:
-            response = self.client.images.generate(
-                model=self.image_model,
-                prompt=prompt,
-                size=self.image_size,
-                quality=self.image_quality,
-                n=1
+            response = get_limiter(self.image_model).call(
+                lambda: self.client.with_options(timeout=deadline.timeout()).images.with_raw_response.generate(
+                    model=self.image_model,
+                    prompt=prompt,
+                    size=self.image_size,
+                    quality=self.image_quality,
+                    n=1
+                ),
+                deadline
             )
             return response.data[0].url
         except Exception as e:
             logger.error(f"Error generating image: {e}")
             return None
 
+class BackendStats:
+    """Rolling latency and error figures for one routed backend."""
+    
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.in_flight = 0
+    
+    def record(self, seconds: float, ok: bool) -> None:
+        # Failed calls still tell us the backend took at least this long
+        self.latencies.append(seconds)
+        self.outcomes.append(ok)
+    
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+    
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+class LLMRouterProvider(LLMProvider):
+    """Routes each request to the backend most likely to answer in time.
+    
+    Backends come from LLM_ROUTE in order of preference, e.g. "ollama,openai".
+    Each request goes to the first backend whose recent latencies and errors
+    give it at least LLM_ROUTE_CONFIDENCE odds of finishing within the target
+    (the stage deadline, or LLM_TARGET_SECONDS if that is shorter), else to the
+    backend with the best odds. With LLM_HEDGE enabled, a second backend is
+    started when the first runs past its p95, and the first answer wins. A
+    backend that fails outright is followed by the next one while time remains.
+    """
+    
+    name = "router"
+    
+    _stats = {}
+    _stats_lock = threading.Lock()
+    
+    def __init__(self, route: Optional[List[str]] = None):
+        route = route or [b.strip() for b in os.getenv('LLM_ROUTE', 'ollama,openai').split(',') if b.strip()]
+        self.backends = [self._create(name) for name in route]
+        self.model = "+".join(backend.model for backend in self.backends)
+        self.confidence = float(os.getenv('LLM_ROUTE_CONFIDENCE', '0.9'))
+        self.target = float(os.getenv('LLM_TARGET_SECONDS', '0')) or None
+        self.hedge = os.getenv('LLM_HEDGE', 'false').strip().lower() == 'true'
+        # Below this many samples a backend is assumed fast so it gets tried
+        self.min_samples = int(os.getenv('LLM_ROUTE_MIN_SAMPLES', '3'))
+        window = int(os.getenv('LLM_ROUTE_WINDOW', '50'))
+        with self._stats_lock:
+            for backend in self.backends:
+                self._stats.setdefault(backend.name, BackendStats(window))
+        self._local = threading.local()
+        logger.info(f"Initialized LLMRouterProvider with route: {', '.join(route)} (hedging {'on' if self.hedge else 'off'})")
+    
+    @staticmethod
+    def _create(name: str) -> LLMProvider:
+        if name == 'openai':
+            return OpenAIProvider()
+        if name == 'ollama':
+            return OllamaPoolProvider() if os.getenv('OLLAMA_API_URLS') else OllamaProvider()
+        raise ValueError(f"Unknown LLM backend in LLM_ROUTE: {name}")
+    
+    @property
+    def last_provider(self) -> LLMProvider:
+        return getattr(self._local, 'provider', self.backends[0])
+    
+    def odds(self, backend: LLMProvider, target: float) -> float:
+        """Estimated chance that a backend answers successfully within target seconds."""
+        stats = self._stats[backend.name]
+        with self._stats_lock:
+            latencies = list(stats.latencies)
+            error_rate = stats.error_rate()
+            in_flight = stats.in_flight
+        if len(latencies) < self.min_samples:
+            return 1.0 - error_rate
+        # Ollama runs one request at a time per slot, so requests in flight are queue time
+        parallel = sum(h.parallel for h in backend.hosts) if isinstance(backend, OllamaPoolProvider) else 1
+        queued = (in_flight // parallel) * statistics.median(latencies) if isinstance(backend, OllamaProvider) else 0.0
+        on_time = sum(1 for latency in latencies if latency + queued <= target)
+        return on_time / len(latencies) * (1.0 - error_rate)
+    
+    def rank(self, deadline: Deadline) -> List[LLMProvider]:
+        """Backends in the order they should be tried for this request."""
+        target = min(deadline.remaining(), self.target) if self.target else deadline.remaining()
+        odds = {backend.name: self.odds(backend, target) for backend in self.backends}
+        confident = [b for b in self.backends if odds[b.name] >= self.confidence]
+        rest = sorted((b for b in self.backends if b not in confident), key=lambda b: -odds[b.name])
+        logger.info("Routing odds: " + ", ".join(f"{name}={value:.2f}" for name, value in odds.items()))
+        return confident + rest
+    
+    def _call(self, backend: LLMProvider, prompt: str, deadline: Deadline, hedged: bool) -> str:
+        stats = self._stats[backend.name]
+        with self._stats_lock:
+            stats.in_flight += 1
+        started = time.perf_counter()
+        result = ""
+        try:
+            with span("llm.attempt", provider=backend.name, model=backend.model, hedged=hedged) as s:
+                result = backend.generate_content(prompt, deadline)
+                s.set(outcome="ok" if result else "error")
+        except Exception as e:
+            logger.error(f"Error generating content with {backend.name}: {e}")
+        finally:
+            with self._stats_lock:
+                stats.in_flight -= 1
+                stats.record(time.perf_counter() - started, bool(result))
+        return result
+    
+    def generate_content(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        """Generate text on the backend most likely to finish in time."""
+        deadline = deadline or Deadline.for_post().stage("llm")
+        ranked = self.rank(deadline)
+        pool = ThreadPoolExecutor(max_workers=len(ranked))
+        try:
+            while ranked and not deadline.expired():
+                primary = ranked.pop(0)
+                running = {pool.submit(contextvars.copy_context().run, self._call, primary, prompt, deadline, False): primary}
+                p95 = self._stats[primary.name].percentile(95)
+                hedge_after = p95 if self.hedge and ranked and len(self._stats[primary.name].latencies) >= self.min_samples else None
+                
+                while running:
+                    timeout = min(hedge_after, deadline.remaining()) if hedge_after is not None else deadline.remaining()
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    if not done:
+                        if hedge_after is None or deadline.expired():
+                            break
+                        secondary = ranked.pop(0)
+                        logger.info(f"{primary.name} passed its p95 of {hedge_after:.1f}s, hedging with {secondary.name}")
+                        running[pool.submit(contextvars.copy_context().run, self._call, secondary, prompt, deadline, True)] = secondary
+                        hedge_after = None
+                        continue
+                    for future in done:
+                        backend = running.pop(future)
+                        result = future.result()
+                        if result:
+                            self._local.provider = backend
+                            return result
+                if running:
+                    break
+            logger.error("No LLM backend produced content before the deadline")
+            return ""
+        finally:
+            # Losing hedges finish in the background; their timings still feed the stats
+            pool.shutdown(wait=False)
+    
+    def generate_image(self, prompt: str, deadline: Optional[Deadline] = None) -> Optional[str]:
+        """Generate an image on the first backend that supports it."""
+        for backend in self.backends:
+            if isinstance(backend, OpenAIProvider):
+                return backend.generate_image(prompt, deadline)
+        return None
+
 def get_llm_provider() -> LLMProvider:
     """Factory function to get the configured LLM provider."""
     use_openai_str = os.getenv('USE_OPENAI', 'false')
@@ -176,8 +516,14 @@ def get_llm_provider() -> LLMProvider:
     logger.info(f"USE_OPENAI environment variable: {use_openai_str}")
     logger.info(f"use_openai parsed value: {use_openai}")
     
+    if os.getenv('LLM_ROUTE'):
+        logger.info("Creating routing LLM provider")
+        return LLMRouterProvider()
     if use_openai:
         logger.info("Creating OpenAI provider")
         return OpenAIProvider()
+    if os.getenv('OLLAMA_API_URLS'):
+        logger.info("Creating Ollama pool provider")
+        return OllamaPoolProvider()
     logger.info("Creating Ollama provider")
     return OllamaProvider() 
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""Precompressed gzip and brotli copies of the built site.
+
+deploy.sh uploaded public/ uncompressed and left compression to the web
+server, which then compressed the same pages on every request, if it did at
+all. compress() writes a .gz, and a .br when the brotli module is installed,
+next to every compressible file in public/, so a server with gzip_static and
+brotli_static serves them as they are.
+
+Hugo rewrites every file on each build, so what changed is decided by
+content: PRECOMPRESS_MANIFEST records the sha256 of each file when it was
+compressed, and only new or changed files are compressed again. The rest of
+the archive keeps its siblings untouched, which also lets rsync skip them.
+Files are hashed and compressed in a process pool.
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .config.settings import PRECOMPRESS_MANIFEST, PRECOMPRESS_MIN_BYTES
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_DIR = "public"
+
+COMPRESSIBLE = (".html", ".css", ".js", ".json", ".xml", ".svg", ".txt", ".map", ".webmanifest")
+
+def formats() -> List[str]:
+    """The sibling formats this installation can write."""
+    return ["gz", "br"] if brotli is not None else ["gz"]
+
+def _encode(data: bytes, fmt: str) -> bytes:
+    if fmt == "br":
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def _compress(job: Tuple[str, Optional[Dict], List[str], bool]) -> Tuple[str, Dict, int]:
+    """Compress one file unless the manifest shows it unchanged; returns its manifest entry and bytes saved."""
+    path, previous, wanted, force = job
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if (not force and previous and previous["sha256"] == digest and previous["formats"] == wanted
+            and all(os.path.exists(f"{path}.{fmt}") for fmt in previous["written"])):
+        return path, previous, -1
+
+    written, saved = [], 0
+    for fmt in wanted:
+        compressed = _encode(data, fmt)
+        sibling = f"{path}.{fmt}"
+        if len(compressed) >= len(data):
+            # Serving it would cost more than the original
+            if os.path.exists(sibling):
+                os.remove(sibling)
+            continue
+        with open(sibling + ".part", "wb") as f:
+            f.write(compressed)
+        os.replace(sibling + ".part", sibling)
+        written.append(fmt)
+        saved = max(saved, len(data) - len(compressed))
+    return path, {"sha256": digest, "formats": wanted, "written": written}, saved
+
+class CompressReport:
+    """What compress() did."""
+
+    def __init__(self):
+        self.files = 0
+        self.compressed = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.saved = 0
+
+    def render(self) -> str:
+        return "\n".join([
+            f"Compressible files:  {self.files}",
+            f"Compressed:          {self.compressed}",
+            f"Unchanged:           {self.unchanged}",
+            f"Stale removed:       {self.removed}",
+            f"Formats:             {', '.join(formats())}",
+            f"Saved this run:      {self.saved / 1e6:.1f} MB",
+        ])
+
+def compressible(public_dir: str = PUBLIC_DIR, min_bytes: int = 0) -> List[str]:
+    return [os.path.join(directory, name)
+            for directory, _, names in os.walk(public_dir) for name in names
+            if name.lower().endswith(COMPRESSIBLE) and os.path.getsize(os.path.join(directory, name)) >= min_bytes]
+
+def _remove_stale(public_dir: str, min_bytes: int) -> int:
+    """Delete siblings that would no longer be refreshed: their original is gone or now too small."""
+    removed = 0
+    for directory, _, names in os.walk(public_dir):
+        for name in names:
+            base, ext = os.path.splitext(name)
+            if ext not in (".gz", ".br") or not base.lower().endswith(COMPRESSIBLE):
+                continue
+            if base not in names or os.path.getsize(os.path.join(directory, base)) < min_bytes:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+    return removed
+
+def _run(jobs: List[Tuple[str, Optional[Dict], List[str], bool]], workers: Optional[int]) -> List[Tuple[str, Dict, int]]:
+    if len(jobs) < 200:
+        # Not worth starting processes for
+        return [_compress(job) for job in jobs]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_compress, jobs, chunksize=32))
+
+def compress(public_dir: str = PUBLIC_DIR, manifest_path: Optional[str] = None, workers: Optional[int] = None,
+             force: bool = False) -> CompressReport:
+    """Write .gz and .br siblings for new and changed compressible files under public_dir."""
+    manifest_path = manifest_path or PRECOMPRESS_MANIFEST
+    min_bytes = PRECOMPRESS_MIN_BYTES
+    if brotli is None:
+        logger.info("brotli is not installed, writing gzip only")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    report = CompressReport()
+    report.removed = _remove_stale(public_dir, min_bytes)
+    paths = compressible(public_dir, min_bytes)
+    report.files = len(paths)
+    wanted = formats()
+    jobs = [(path, manifest.get(os.path.relpath(path, public_dir)), wanted, force) for path in paths]
+
+    entries = {}
+    for path, entry, saved in _run(jobs, workers):
+        entries[os.path.relpath(path, public_dir)] = entry
+        if saved < 0:
+            report.unchanged += 1
+        else:
+            report.compressed += 1
+            report.saved += saved
+
+    # Files that are gone, or now under PRECOMPRESS_MIN_BYTES, leave the manifest
+    with open(manifest_path + ".part", "w", encoding="utf-8") as f:
+        json.dump(entries, f, separators=(",", ":"))
+    os.replace(manifest_path + ".part", manifest_path)
+    logger.info(f"Compressed {report.compressed} of {report.files} files, {report.unchanged} unchanged")
+    return report
@@ -0,0 +1,253 @@
+"""Performance report over cron.log output and trace history.
+
+Both sources are read line by line, so months of logs can be summarised
+without loading them into memory. Log lines only carry one timestamp per
+event, so stage durations from the log are the time between consecutive
+events; trace files (see utils/tracing.py) give exact per-span timings.
+"""
+
+import os
+import re
+import math
+import json
+import html
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOG_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) - (\S+) - (\w+) - (.*)$')
+HUGO_TOTAL = re.compile(r'^Total in (\d+) ms')
+
+PERCENTILES = (50, 90, 99)
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class Stats:
+    """Accumulates stage samples keyed by stage, provider and model."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.outcomes = defaultdict(lambda: [0, 0])
+        self.daily = defaultdict(lambda: defaultdict(list))
+        self.posts_per_day = defaultdict(int)
+        self.trace_days = set()
+
+    def add(self, stage: str, seconds: Optional[float], ok: bool = True, provider: str = "",
+            model: str = "", day: str = "") -> None:
+        """Record one sample of a stage."""
+        key = (stage, provider or "-", model or "-")
+        self.outcomes[key][0 if ok else 1] += 1
+        if ok and seconds is not None:
+            self.durations[key].append(seconds)
+            if day:
+                self.daily[stage][day].append(seconds)
+
+    def post_published(self, day: str) -> None:
+        """Count a successfully generated post towards daily throughput."""
+        self.posts_per_day[day] += 1
+
+    def rows(self) -> List[Tuple]:
+        """Summary rows of (stage, provider, model, count, failure rate, p50, p90, p99)."""
+        rows = []
+        for key in sorted(self.outcomes):
+            ok, failed = self.outcomes[key]
+            values = self.durations.get(key, [])
+            rows.append(key + (ok + failed, failed / (ok + failed)) + tuple(percentile(values, p) for p in PERCENTILES))
+        return rows
+
+    def trends(self) -> Dict[str, List[Tuple[str, float]]]:
+        """Daily p50 per stage, for spotting stages that are slowly getting worse."""
+        return {
+            stage: [(day, percentile(values, 50)) for day, values in sorted(days.items())]
+            for stage, days in sorted(self.daily.items())
+        }
+
+def _timestamp(stamp: str, millis: str) -> datetime:
+    return datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S").replace(microsecond=int(millis) * 1000)
+
+def parse_log(lines: Iterable[str], stats: Stats) -> None:
+    """Feed cron.log lines into the stats.
+
+    Works on the logging output of the package. The print output of the
+    legacy generate.py has no timestamps, so only Hugo build times are taken
+    from it. Days already covered by a trace file are skipped so posts aren't
+    counted twice.
+    """
+    llm = ("", "")
+    image = ("", "")
+    post_start = None
+    stage_start = None
+    image_start = None
+    submitted = None
+
+    for line in lines:
+        line = line.rstrip("\n")
+        hugo = HUGO_TOTAL.match(line)
+        if hugo:
+            stats.add("hugo", int(hugo.group(1)) / 1000, provider="hugo")
+            continue
+
+        match = LOG_LINE.match(line)
+        if not match:
+            continue
+        day = match.group(1)[:10]
+        if day in stats.trace_days:
+            continue
+        now = _timestamp(match.group(1), match.group(2))
+        message = match.group(5)
+
+        if message.startswith("Initialized OllamaProvider with model: "):
+            llm = ("ollama", message.split("model: ", 1)[1].split(" at ", 1)[0])
+        elif message.startswith("Initialized OpenAIProvider with model: "):
+            llm = ("openai", message.split("model: ", 1)[1].split(" and ", 1)[0])
+        elif message.startswith("Initialized ComfyUIProvider with model: "):
+            image = ("comfyui", message.split("model: ", 1)[1])
+        elif message.startswith("Initialized DalleProvider with model: "):
+            image = ("dalle", message.split("model: ", 1)[1])
+        elif message in ("Generating story...", "Generating news article..."):
+            post_start = stage_start = now
+        elif message.startswith("Generating image with"):
+            if stage_start is not None and stage_start == post_start:
+                stats.add("llm.generate", (now - stage_start).total_seconds(), True, *llm, day)
+            image_start = now
+        elif message.startswith("Image generation started with prompt ID"):
+            if image_start is not None:
+                stats.add("image.submit", (now - image_start).total_seconds(), True, *image, day)
+            submitted = now
+        elif message.startswith("Image saved to:"):
+            if submitted is not None:
+                stats.add("image.wait", (now - submitted).total_seconds(), True, *image, day)
+            if image_start is not None:
+                stats.add("image", (now - image_start).total_seconds(), True, *image, day)
+            image_start = submitted = None
+            stage_start = now
+        elif message.startswith(("Image generation timed out", "Error generating image", "Failed to download image")):
+            stats.add("image", None, False, *image, day)
+            image_start = submitted = None
+            stage_start = now
+        elif message.startswith("Successfully generated content"):
+            if post_start is not None:
+                stats.add("post", (now - post_start).total_seconds(), True, *llm, day)
+            stats.post_published(day)
+            post_start = stage_start = None
+        elif message.startswith(("Failed to generate", "Error in main")):
+            if stage_start is not None and stage_start == post_start:
+                stats.add("llm.generate", None, False, *llm, day)
+            stats.add("post", None, False, *llm, day)
+            post_start = stage_start = None
+
+def parse_trace(lines: Iterable[str], stats: Stats) -> None:
+    """Feed JSONL trace records into the stats."""
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        name = record.get("span")
+        if not name:
+            continue
+        ok = record.get("outcome", "ok") == "ok"
+        seconds = record.get("duration_ms", 0) / 1000
+        day = str(record.get("ts", ""))[:10]
+        stats.trace_days.add(day)
+        provider = record.get("provider", "")
+        model = record.get("model", "")
+        stats.add(name, seconds, ok, provider, model, day)
+
+        # Split ComfyUI waits into queue time and GPU time
+        if name == "image.wait" and ok and record.get("sampling_ms") is not None:
+            sampling = record["sampling_ms"] / 1000
+            stats.add("image.sampling", sampling, True, provider, model, day)
+            stats.add("image.queue", max(0.0, seconds - sampling), True, provider, model, day)
+        if name == "post" and ok:
+            stats.post_published(day)
+
+def render_text(stats: Stats) -> str:
+    """Plain text summary for the terminal."""
+    lines = [f"{'stage':<16} {'provider':<16} {'model':<44} {'n':>5} {'fail':>6} {'p50':>8} {'p90':>8} {'p99':>8}"]
+    for stage, provider, model, count, failure_rate, p50, p90, p99 in stats.rows():
+        lines.append(f"{stage:<16} {provider:<16} {model[:44]:<44} {count:>5} {failure_rate:>6.1%} {p50:>8.1f} {p90:>8.1f} {p99:>8.1f}")
+    lines.append("")
+    lines.append("Posts per day:")
+    for day, count in sorted(stats.posts_per_day.items()):
+        lines.append(f"  {day or 'unknown'}: {count}")
+    return "\n".join(lines)
+
+def _sparkline(points: List[Tuple[str, float]], width: int = 240, height: int = 40) -> str:
+    """Inline SVG line of daily values."""
+    if len(points) < 2:
+        return ""
+    top = max(value for _, value in points) or 1
+    step = width / (len(points) - 1)
+    coords = " ".join(f"{i * step:.1f},{height - value / top * height:.1f}" for i, (_, value) in enumerate(points))
+    return (f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<polyline fill="none" stroke="#c0392b" stroke-width="1.5" points="{coords}"/></svg>')
+
+def render_html(stats: Stats) -> str:
+    """Static HTML summary with stage tables, daily throughput and trend lines."""
+    esc = html.escape
+    rows = "".join(
+        f"<tr><td>{esc(stage)}</td><td>{esc(provider)}</td><td>{esc(model)}</td><td>{count}</td>"
+        f"<td>{failure_rate:.1%}</td><td>{p50:.1f}</td><td>{p90:.1f}</td><td>{p99:.1f}</td></tr>"
+        for stage, provider, model, count, failure_rate, p50, p90, p99 in stats.rows()
+    )
+    trends = "".join(
+        f"<tr><td>{esc(stage)}</td><td>{esc(points[0][0])} &ndash; {esc(points[-1][0])}</td>"
+        f"<td>{points[0][1]:.1f}s &rarr; {points[-1][1]:.1f}s</td><td>{_sparkline(points)}</td></tr>"
+        for stage, points in stats.trends().items() if points
+    )
+    days = "".join(f"<tr><td>{esc(day or 'unknown')}</td><td>{count}</td></tr>"
+                   for day, count in sorted(stats.posts_per_day.items()))
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Generation performance report</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border: 1px solid #ddd; padding: 4px 8px; text-align: left; }}
+th {{ background: #f4f4f4; }}
+</style>
+</head>
+<body>
+<h1>Generation performance report</h1>
+<p>Generated {datetime.now().strftime("%Y-%m-%d %H:%M")}. Durations in seconds.</p>
+<h2>Stage latency</h2>
+<table>
+<tr><th>Stage</th><th>Provider</th><th>Model</th><th>Samples</th><th>Failure rate</th><th>p50</th><th>p90</th><th>p99</th></tr>
+{rows}
+</table>
+<h2>Daily p50 trend</h2>
+<table>
+<tr><th>Stage</th><th>Days</th><th>First &rarr; last</th><th>Trend</th></tr>
+{trends}
+</table>
+<h2>Posts per day</h2>
+<table>
+<tr><th>Day</th><th>Posts</th></tr>
+{days}
+</table>
+</body>
+</html>
+"""
+
+def build_report(log_file: Optional[str] = None, trace_file: Optional[str] = None) -> Stats:
+    """Collect stats from a log file and a trace file, skipping any that are missing."""
+    stats = Stats()
+    if trace_file and os.path.exists(trace_file):
+        with open(trace_file, encoding="utf-8") as f:
+            parse_trace(f, stats)
+    if log_file and os.path.exists(log_file):
+        with open(log_file, encoding="utf-8", errors="replace") as f:
+            parse_log(f, stats)
+    return stats
@@ -0,0 +1,167 @@
+"""Posts generated ahead of time and published on a fixed schedule.
+
+The GPU is mostly free overnight, but posts should appear at fixed times.
+So generation and publishing are split: fill_buffer() generates posts during
+the GENERATION_WINDOW (e.g. "22:00-06:00") and writes each as a draft with a
+publishDate on the next free PUBLISH_TIMES slot (e.g. "08:00,20:00"), until
+BUFFER_POSTS posts are waiting. publish_due() is the cheap other half: it
+flips drafts whose publishDate has passed to live and runs PUBLISH_COMMAND
+to rebuild and deploy the site.
+"""
+
+import os
+import re
+import shlex
+import logging
+import subprocess
+from datetime import datetime, timedelta, time as clock
+from typing import Callable, List, Optional, Tuple
+
+from .config.settings import BASE_DIR, PUBLISH_TIMES, GENERATION_WINDOW, BUFFER_POSTS, PUBLISH_COMMAND
+from .utils.tracing import span
+from .utils.search_index import index_post
+from .utils.content import CONTENT_ROOT
+
+logger = logging.getLogger(__name__)
+
+# Where create_blog_post writes posts
+POSTS_DIR = os.path.join(CONTENT_ROOT, "en", "posts")
+
+PUBLISH_DATE = re.compile(r"^publishDate:\s*(\S+)\s*$", re.MULTILINE)
+DRAFT = re.compile(r"^draft:\s*true\s*$", re.MULTILINE)
+
+def parse_times(spec: str) -> List[clock]:
+    """Times of day from "08:00,20:00"."""
+    times = []
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        try:
+            times.append(datetime.strptime(part.strip(), "%H:%M").time())
+        except ValueError:
+            logger.warning(f"Ignoring invalid publish time: {part}")
+    return sorted(times)
+
+def parse_window(spec: str) -> Optional[Tuple[clock, clock]]:
+    """A "HH:MM-HH:MM" window, which may wrap past midnight, or None for always."""
+    if not spec.strip():
+        return None
+    start, _, end = spec.partition('-')
+    return datetime.strptime(start.strip(), "%H:%M").time(), datetime.strptime(end.strip(), "%H:%M").time()
+
+def in_window(window: Optional[Tuple[clock, clock]], now: Optional[datetime] = None) -> bool:
+    if window is None:
+        return True
+    now = (now or datetime.now()).time()
+    start, end = window
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+class ScheduledPost:
+    """A draft waiting for its publishDate."""
+
+    def __init__(self, path: str, publish_at: datetime):
+        self.path = path
+        self.publish_at = publish_at
+
+def scheduled_posts(posts_dir: str = POSTS_DIR) -> List[ScheduledPost]:
+    """Drafts with a publishDate, soonest first."""
+    posts = []
+    # Leaf bundles keep their index.md in YYYY/MM/<slug>/ directories below posts_dir
+    paths = [os.path.join(directory, name) for directory, _, names in os.walk(posts_dir)
+             for name in names if name.endswith(".md")]
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            front_matter = f.read().split("\n---", 1)[0]
+        match = PUBLISH_DATE.search(front_matter)
+        if not match or not DRAFT.search(front_matter):
+            continue
+        try:
+            publish_at = datetime.fromisoformat(match.group(1)).astimezone()
+        except ValueError:
+            logger.warning(f"Ignoring {path}: invalid publishDate {match.group(1)}")
+            continue
+        posts.append(ScheduledPost(path, publish_at))
+    return sorted(posts, key=lambda post: post.publish_at)
+
+class Schedule:
+    """Publish slots, the generation window and the size of the buffer."""
+
+    def __init__(self, times: Optional[str] = None, window: Optional[str] = None, target: Optional[int] = None,
+                 posts_dir: str = POSTS_DIR):
+        self.times = parse_times(times if times is not None else PUBLISH_TIMES)
+        self.window = parse_window(window if window is not None else GENERATION_WINDOW)
+        self.target = target if target is not None else BUFFER_POSTS
+        self.command = PUBLISH_COMMAND
+        self.posts_dir = posts_dir
+
+    def pending(self) -> List[ScheduledPost]:
+        """Buffered posts that are not due yet."""
+        now = datetime.now().astimezone()
+        return [post for post in scheduled_posts(self.posts_dir) if post.publish_at > now]
+
+    def next_slot(self, taken: List[datetime]) -> Optional[datetime]:
+        """The first publish slot from now on that no buffered post has."""
+        if not self.times:
+            return None
+        now = datetime.now().astimezone()
+        taken = {slot.replace(second=0, microsecond=0) for slot in taken}
+        day = now.date()
+        while True:
+            for time_of_day in self.times:
+                slot = datetime.combine(day, time_of_day).astimezone()
+                if slot > now and slot not in taken:
+                    return slot
+            day += timedelta(days=1)
+
+    def fill_buffer(self, generate: Callable[[datetime], Optional[str]], stopping: Callable[[], bool] = lambda: False) -> int:
+        """Generate scheduled posts while in the window and short of the target; returns how many were written."""
+        written = 0
+        failures = 0
+        while not stopping() and in_window(self.window):
+            pending = self.pending()
+            if len(pending) >= self.target:
+                break
+            slot = self.next_slot([post.publish_at for post in pending])
+            if slot is None:
+                logger.error("No PUBLISH_TIMES configured, nothing to schedule")
+                break
+            logger.info(f"Buffer has {len(pending)} of {self.target} posts, generating one for {slot:%Y-%m-%d %H:%M}")
+            if generate(slot):
+                written += 1
+                failures = 0
+            else:
+                # Stop for now rather than hammer a backend that is down
+                failures += 1
+                if failures >= 3:
+                    logger.error("Three posts in a row failed, stopping until the next run")
+                    break
+        return written
+
+    def publish_due(self) -> List[str]:
+        """Put drafts whose publishDate has passed live and rebuild the site if any were."""
+        now = datetime.now().astimezone()
+        published = []
+        for post in scheduled_posts(self.posts_dir):
+            if post.publish_at > now:
+                break
+            with open(post.path, encoding="utf-8") as f:
+                text = f.read()
+            front_matter, separator, body = text.partition("\n---")
+            with open(post.path, "w", encoding="utf-8") as f:
+                f.write(DRAFT.sub("draft: false", front_matter, count=1) + separator + body)
+            index_post(post.path)
+            logger.info(f"Published {post.path} (scheduled for {post.publish_at:%Y-%m-%d %H:%M})")
+            published.append(post.path)
+        if published and self.command:
+            self.build()
+        return published
+
+    def build(self) -> None:
+        """Run PUBLISH_COMMAND from the site directory."""
+        try:
+            with span("publish.build"):
+                subprocess.run(shlex.split(self.command), cwd=BASE_DIR, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.error(f"Publish command failed: {e}")
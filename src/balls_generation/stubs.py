@@ -0,0 +1,537 @@
+"""Local stub servers for the Ollama, ComfyUI and OpenAI APIs.
+
+The stubs implement the subset of each API that the providers use, with
+configurable latency, jitter and failure injection, so the whole pipeline can
+run without the GPU box or an OpenAI key. All three APIs are served from a
+single port; the paths don't overlap.
+"""
+
+import os
+import json
+import uuid
+import time
+import queue
+import base64
+import random
+import struct
+import hashlib
+import logging
+import threading
+import zlib
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+def _png(width: int, height: int, pixel) -> bytes:
+    """An 8-bit RGB PNG with pixel(x, y) -> (r, g, b)."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    raw = b"".join(b"\x00" + bytes(c for x in range(width) for c in pixel(x, y)) for y in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+# A smooth gradient that passes the image checks, returned for every image
+STUB_PNG = _png(64, 64, lambda x, y: (x * 4, y * 4, 128))
+
+# What a render that tripped a safety filter looks like
+BLANK_PNG = _png(64, 64, lambda x, y: (0, 0, 0))
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class StubConfig:
+    """Latency, jitter and failure settings for the stub servers.
+
+    Latencies are in seconds and keyed by kind: "llm" for Ollama text
+    generation, "chat" for OpenAI chat completions (defaults to "llm"),
+    "render" for ComfyUI sampling, "load" for ComfyUI switching checkpoints,
+    "image" for DALL-E generation, "batch" for the time a whole Batch API job
+    takes and "http" for every other request.
+
+    With scale_render set, "render" is the time of a 768x768, 30-step render
+    and each workflow takes time in proportion to its steps and pixels.
+
+    With openai_concurrency set, OpenAI requests beyond that many in flight
+    are answered with 429 and a Retry-After, like an account at its limit.
+    blank_rate is the share of ComfyUI renders that come out as a black frame.
+    With output_dir set, finished ComfyUI images are also written there, like
+    ComfyUI's own output directory.
+    """
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None, jitter: float = 0.0,
+                 failure_rate: float = 0.0, checkpoints: Optional[List[str]] = None, seed: Optional[int] = None,
+                 openai_concurrency: Optional[int] = None, output_dir: Optional[str] = None, blank_rate: float = 0.0,
+                 scale_render: bool = False):
+        self.latency = {"llm": 0.5, "render": 2.0, "load": 0.0, "image": 2.0, "batch": 1.0, "http": 0.0}
+        self.latency.update(latency or {})
+        self.latency.setdefault("chat", self.latency["llm"])
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.blank_rate = blank_rate
+        self.scale_render = scale_render
+        self.openai_concurrency = openai_concurrency
+        self.output_dir = output_dir
+        self.checkpoints = checkpoints or ["sd3_medium_incl_clips_t5xxlfp16.safetensors"]
+        self.random = random.Random(seed)
+
+    def delay(self, kind: str) -> float:
+        """Latency for one request of a kind, with jitter applied."""
+        base = self.latency.get(kind, 0.0)
+        if self.jitter:
+            base *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base)
+
+    def should_fail(self) -> bool:
+        """Whether to inject a failure into this request."""
+        return self.failure_rate > 0 and self.random.random() < self.failure_rate
+
+def _render_work(workflow: dict) -> float:
+    """Sampling work in a workflow, relative to one 768x768, 30-step render."""
+    def pixels(ref) -> int:
+        node = workflow.get(ref[0], {}) if isinstance(ref, list) else {}
+        inputs = node.get("inputs", {})
+        if node.get("class_type") in ("EmptyLatentImage", "LatentUpscale", "ImageScale"):
+            return inputs.get("width", 768) * inputs.get("height", 768)
+        for key in ("samples", "pixels", "image"):
+            if isinstance(inputs.get(key), list):
+                return pixels(inputs[key])
+        return 768 * 768
+
+    work = 0.0
+    for node in workflow.values():
+        if isinstance(node, dict) and node.get("class_type") == "KSampler":
+            inputs = node.get("inputs", {})
+            work += inputs.get("steps", 30) / 30 * pixels(inputs.get("latent_image")) / (768 * 768)
+    return work or 1.0
+
+class ComfyUIQueue:
+    """A single simulated GPU that runs prompts one at a time."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.pending = []
+        self.running = None
+        self.history = {}
+        self.inputs = {}
+        self.blank = set()
+        self.deleted = set()
+        self.interrupt = threading.Event()
+        self.jobs = queue.Queue()
+        self.loaded_checkpoint = None
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, workflow: dict) -> str:
+        """Queue a workflow and return its prompt ID."""
+        prompt_id = str(uuid.uuid4())
+        with self.lock:
+            self.pending.append(prompt_id)
+        self.jobs.put((prompt_id, workflow))
+        return prompt_id
+
+    def upload(self, data: bytes) -> str:
+        """Store an image in the input directory and return its name."""
+        name = f"{hashlib.sha1(data).hexdigest()[:16]}.png"
+        with self.lock:
+            self.inputs[name] = data
+        return name
+
+    def missing_inputs(self, workflow: dict) -> List[str]:
+        """LoadImage nodes that refer to images nobody uploaded, which ComfyUI rejects."""
+        with self.lock:
+            return [key for key, node in workflow.items()
+                    if isinstance(node, dict) and node.get("class_type") == "LoadImage"
+                    and node.get("inputs", {}).get("image") not in self.inputs]
+
+    def delete(self, prompt_ids: List[str]) -> None:
+        """Remove pending prompts from the queue."""
+        with self.lock:
+            for prompt_id in prompt_ids:
+                if prompt_id in self.pending:
+                    self.pending.remove(prompt_id)
+                    self.deleted.add(prompt_id)
+
+    def status(self) -> dict:
+        """The /queue payload."""
+        with self.lock:
+            running = [[0, self.running, {}, {}, ["9"]]] if self.running else []
+            pending = [[i + 1, prompt_id, {}, {}, ["9"]] for i, prompt_id in enumerate(self.pending)]
+        return {"queue_running": running, "queue_pending": pending}
+
+    def _worker(self) -> None:
+        while True:
+            prompt_id, workflow = self.jobs.get()
+            with self.lock:
+                if prompt_id in self.deleted:
+                    continue
+                self.pending.remove(prompt_id)
+                self.running = prompt_id
+            self.interrupt.clear()
+            checkpoint = next((node["inputs"].get("ckpt_name") for node in workflow.values()
+                               if isinstance(node, dict) and node.get("class_type") == "CheckpointLoaderSimple"), None)
+            seconds = self.config.delay("render") * (_render_work(workflow) if self.config.scale_render else 1)
+            if checkpoint and checkpoint != self.loaded_checkpoint:
+                seconds += self.config.delay("load")
+            started = int(time.time() * 1000)
+            interrupted = self.interrupt.wait(seconds)
+            finished = int(time.time() * 1000)
+            with self.lock:
+                self.running = None
+                self.loaded_checkpoint = checkpoint or self.loaded_checkpoint
+                entry = {"status": {"messages": [["execution_start", {"prompt_id": prompt_id, "timestamp": started}]]}}
+                if interrupted:
+                    entry["status"]["status_str"] = "error"
+                    entry["status"]["messages"].append(["execution_interrupted", {"prompt_id": prompt_id, "timestamp": finished}])
+                    entry["outputs"] = {}
+                else:
+                    entry["status"]["status_str"] = "success"
+                    entry["status"]["messages"].append(["execution_success", {"prompt_id": prompt_id, "timestamp": finished}])
+                    save_node = next((key for key, node in workflow.items()
+                                      if isinstance(node, dict) and node.get("class_type") == "SaveImage"), "9")
+                    entry["outputs"] = {save_node: {"images": [{"filename": f"{prompt_id}.png", "subfolder": "", "type": "output"}]}}
+                    blank = self.config.blank_rate > 0 and self.config.random.random() < self.config.blank_rate
+                    if blank:
+                        self.blank.add(f"{prompt_id}.png")
+                    if self.config.output_dir:
+                        with open(os.path.join(self.config.output_dir, f"{prompt_id}.png"), "wb") as f:
+                            f.write(BLANK_PNG if blank else STUB_PNG)
+                self.history[prompt_id] = entry
+
+class BatchStore:
+    """Uploaded files and Batch API jobs, processed on a background thread."""
+
+    def __init__(self, server: "StubServer"):
+        self.server = server
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+
+    def add_file(self, data: bytes, purpose: str) -> dict:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()), "purpose": purpose}
+
+    def create(self, payload: dict) -> dict:
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": payload.get("endpoint"),
+            "input_file_id": payload.get("input_file_id"),
+            "completion_window": payload.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "metadata": payload.get("metadata") or {},
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._process, args=(batch["id"],), daemon=True).start()
+        return dict(batch)
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            return json.loads(json.dumps(batch)) if batch else None
+
+    def _process(self, batch_id: str) -> None:
+        with self.lock:
+            batch = self.batches[batch_id]
+            lines = self.files.get(batch["input_file_id"], b"").decode("utf-8").splitlines()
+            batch["status"] = "in_progress"
+            batch["request_counts"]["total"] = len(lines)
+        time.sleep(self.server.config.delay("batch"))
+
+        output, errors = [], []
+        for line in lines:
+            request = json.loads(line)
+            if self.server.config.should_fail():
+                errors.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                               "response": None, "error": {"code": "server_error", "message": "injected failure"}})
+                continue
+            content = self.server.fake_post()
+            output.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"], "error": None,
+                           "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": {
+                               "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                               "object": "chat.completion",
+                               "model": request["body"].get("model", "stub"),
+                               "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                           }}})
+
+        encode = lambda entries: "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+        output_file = self.add_file(encode(output), "batch_output") if output else None
+        error_file = self.add_file(encode(errors), "batch_output") if errors else None
+        with self.lock:
+            batch["output_file_id"] = output_file and output_file["id"]
+            batch["error_file_id"] = error_file and error_file["id"]
+            batch["request_counts"].update(completed=len(output), failed=len(errors))
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+def _multipart_fields(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Decode a multipart/form-data body into field name -> bytes."""
+    message = BytesParser(policy=email_policy).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in message.iter_parts()}
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Routes requests to the Ollama, ComfyUI and OpenAI stubs."""
+
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json(self, payload, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(json.dumps(payload).encode("utf-8"), "application/json", status, headers)
+
+    def _send(self, data: bytes, content_type: str, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fail(self) -> bool:
+        """Send an injected failure, returning True if one was sent."""
+        if self.server.config.should_fail():
+            self._json({"error": {"message": "injected failure", "type": "server_error"}}, 500)
+            return True
+        return False
+
+    def _sleep(self, kind: str) -> None:
+        time.sleep(self.server.config.delay(kind))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self._sleep("http")
+        comfy = self.server.comfy
+        if path.startswith("/history/"):
+            prompt_id = path.rsplit("/", 1)[1]
+            with comfy.lock:
+                entry = comfy.history.get(prompt_id)
+            self._json({prompt_id: entry} if entry else {})
+        elif path == "/queue":
+            self._json(comfy.status())
+        elif path in ("/view", ) or path.startswith("/files/"):
+            if self._fail():
+                return
+            filename = parse_qs(urlparse(self.path).query).get("filename", [""])[0]
+            with comfy.lock:
+                blank = filename in comfy.blank
+            self._send(BLANK_PNG if blank else STUB_PNG, "image/png")
+        elif path == "/system_stats":
+            self._json({"system": {"os": "stub"}, "devices": [{"name": "stub", "type": "cuda", "vram_total": 8 << 30, "vram_free": 4 << 30}]})
+        elif path.startswith("/object_info"):
+            self._json({"CheckpointLoaderSimple": {"input": {"required": {"ckpt_name": [self.server.config.checkpoints]}}}})
+        elif path == "/ws":
+            self._websocket()
+        elif path == "/api/tags":
+            self._json({"models": [{"name": name} for name in self.server.ollama_models]})
+        elif path.startswith("/v1/files/") and path.endswith("/content"):
+            with self.server.batches.lock:
+                data = self.server.batches.files.get(path.split("/")[3])
+            if data is None:
+                self._json({"error": {"message": "No such file"}}, 404)
+            else:
+                self._send(data, "application/jsonl")
+        elif path.startswith("/v1/batches/"):
+            batch = self.server.batches.get(path.rsplit("/", 1)[1])
+            self._json(batch if batch else {"error": {"message": "No such batch"}}, 200 if batch else 404)
+        elif path == "/api/ps":
+            self._json({"models": [{"name": name, "model": name} for name in sorted(self.server.ollama_resident)]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        payload = json.loads(body) if body and self.headers.get("Content-Type", "").startswith("application/json") else {}
+        comfy = self.server.comfy
+        if path == "/api/generate":
+            self._ollama_generate(payload)
+        elif path == "/prompt":
+            self._sleep("http")
+            if self._fail():
+                return
+            missing = comfy.missing_inputs(payload.get("prompt", {}))
+            if missing:
+                self._json({"error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"},
+                            "node_errors": {key: {"errors": [{"type": "custom_validation_failed"}]} for key in missing}}, 400)
+                return
+            self._json({"prompt_id": comfy.submit(payload.get("prompt", {})), "number": 0, "node_errors": {}})
+        elif path == "/upload/image":
+            self._sleep("http")
+            fields = _multipart_fields(self.headers.get("Content-Type", ""), body)
+            self._json({"name": comfy.upload(fields.get("image") or b""), "subfolder": "", "type": "input"})
+        elif path == "/interrupt":
+            comfy.interrupt.set()
+            self._json({})
+        elif path == "/queue":
+            comfy.delete(payload.get("delete", []))
+            self._json({})
+        elif path == "/v1/chat/completions":
+            self._openai_limited(self._openai_chat, payload)
+        elif path == "/v1/images/generations":
+            self._openai_limited(self._openai_image, payload)
+        elif path == "/v1/files":
+            self._sleep("http")
+            fields = _multipart_fields(self.headers.get("Content-Type", ""), body)
+            self._json(self.server.batches.add_file(fields.get("file", b""), (fields.get("purpose") or b"").decode()))
+        elif path == "/v1/batches":
+            self._sleep("http")
+            self._json(self.server.batches.create(payload))
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def _openai_limited(self, handler, payload: dict) -> None:
+        """Run an OpenAI handler, or answer 429 when too many are already in flight."""
+        limit = self.server.config.openai_concurrency
+        with self.server._counter_lock:
+            throttled = limit is not None and self.server.openai_in_flight >= limit
+            if not throttled:
+                self.server.openai_in_flight += 1
+            else:
+                self.server.openai_throttled += 1
+        if throttled:
+            self._json({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                       429, {"retry-after": "1", "retry-after-ms": "1000"})
+            return
+        try:
+            handler(payload)
+        finally:
+            with self.server._counter_lock:
+                self.server.openai_in_flight -= 1
+
+    def _ollama_generate(self, payload: dict) -> None:
+        self._sleep("llm")
+        if self._fail():
+            return
+        model = payload.get("model", "stub")
+        self.server.ollama_models.add(model)
+        if payload.get("keep_alive", "5m") in (0, "0", "0s"):
+            self.server.ollama_resident.discard(model)
+        else:
+            self.server.ollama_resident.add(model)
+        self._json({"model": model, "response": self.server.fake_post(), "done": True})
+
+    def _openai_chat(self, payload: dict) -> None:
+        self._sleep("chat")
+        if self._fail():
+            return
+        content = self.server.fake_post()
+        self._json({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 200, "completion_tokens": len(content) // 4, "total_tokens": 200 + len(content) // 4},
+        })
+
+    def _openai_image(self, payload: dict) -> None:
+        self._sleep("image")
+        if self._fail():
+            return
+        if payload.get("response_format") == "b64_json":
+            item = {"b64_json": base64.b64encode(STUB_PNG).decode("ascii")}
+        else:
+            host, port = self.server.server_address[:2]
+            item = {"url": f"http://{host}:{port}/files/{uuid.uuid4().hex}.png"}
+        self._json({"created": int(time.time()), "data": [item]})
+
+    def _websocket(self) -> None:
+        """Minimal ComfyUI /ws: sends queue status frames until the client goes away."""
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while not self.server.stopping.is_set():
+                status = self.server.comfy.status()
+                remaining = len(status["queue_running"]) + len(status["queue_pending"])
+                message = {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": remaining}}}}
+                self.wfile.write(_ws_frame(json.dumps(message).encode("utf-8")))
+                self.wfile.flush()
+                time.sleep(0.5)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def _ws_frame(data: bytes) -> bytes:
+    """Encode an unmasked websocket text frame."""
+    header = bytes([0x81])
+    if len(data) < 126:
+        header += bytes([len(data)])
+    elif len(data) < 1 << 16:
+        header += bytes([126]) + struct.pack(">H", len(data))
+    else:
+        header += bytes([127]) + struct.pack(">Q", len(data))
+    return header + data
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server hosting all provider stubs on one port."""
+
+    daemon_threads = True
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), StubHandler)
+        self.config = config or StubConfig()
+        self.comfy = ComfyUIQueue(self.config)
+        self.ollama_models = set()
+        self.ollama_resident = set()
+        self.batches = BatchStore(self)
+        self.stopping = threading.Event()
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+        self.openai_in_flight = 0
+        self.openai_throttled = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fake_post(self) -> str:
+        """A post in the JSON shape the generators ask for, with a unique title."""
+        with self._counter_lock:
+            self._counter += 1
+            number = self._counter
+        text = ("The ball bounced across the gym floor. Everyone stopped to watch. "
+                "[SCENE] It rolled out the door and was never seen again.")
+        return json.dumps({
+            "title": f"Stub Ball Adventure {number}",
+            "story": text,
+            "article": text,
+            "category": "stub",
+            "tags": ["stub", "ball"],
+            "image_prompt": "a ball in a gym",
+            "scene_prompt": "a ball rolling out a door",
+        })
+
+    def start(self) -> "StubServer":
+        """Serve requests on a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        logger.info(f"Stub servers listening at {self.url}")
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
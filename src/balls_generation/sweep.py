@@ -0,0 +1,246 @@
+"""Checkpoint throughput sweep for ComfyUI.
+
+Renders one prompt with every combination of checkpoint, step count, sampler
+and resolution, and separates the cost of loading a checkpoint from the cost
+of sampling with it:
+
+- Each checkpoint's first render runs cold and is then repeated warm with
+  the same settings; the difference is the load time.
+- Warm render times for the same checkpoint, resolution and sampler are
+  fitted against the step count. The slope is seconds per iteration, the
+  intercept the fixed cost of text encoding and VAE decoding.
+
+Render times come from ComfyUI's own execution timestamps, so time spent in
+the queue is not counted. With several endpoints, whole checkpoints are
+spread over them, as a checkpoint's runs must share a host for the load
+time to mean anything. Results go to a directory with the images, a CSV of
+every run, a CSV summary and an HTML page with thumbnails.
+"""
+
+import os
+import csv
+import html
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+from .image_providers import ComfyUIProvider, execution_ms
+from .utils.deadline import Deadline, request_timeout
+from .utils.image_check import image_problem
+from .utils.images import IMAGES_DIR
+from .utils.render_profiles import RenderProfile, parse_resolution
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = "a funny cartoon of a basketball playing basketball with itself in a gym"
+
+RUN_FIELDS = ["endpoint", "checkpoint", "resolution", "sampler", "steps", "cold", "seconds", "wall_seconds", "image", "problem", "error"]
+SUMMARY_FIELDS = ["endpoint", "checkpoint", "resolution", "sampler", "load_seconds", "seconds_per_it", "overhead_seconds", "runs", "problems"]
+
+def available_checkpoints(provider: ComfyUIProvider, api_url: str) -> List[str]:
+    """Checkpoints a ComfyUI host offers, without inpainting models, which can't render from text."""
+    response = provider.session.get(f"{api_url}/object_info/CheckpointLoaderSimple", timeout=request_timeout())
+    response.raise_for_status()
+    names = response.json()["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"][0]
+    return [name for name in names if "inpainting" not in name.lower()]
+
+def _slug(text: str) -> str:
+    return "".join(c if c.isalnum() or c in "-." else "_" for c in text)
+
+def render_one(provider: ComfyUIProvider, api_url: str, checkpoint: str, profile: RenderProfile, prompt: str,
+               seed: int, cold: bool, out_dir: str, timeout: float) -> dict:
+    """Render one combination and return its row of results."""
+    row = {"endpoint": api_url, "checkpoint": checkpoint, "resolution": profile.resolution, "sampler": profile.sampler,
+           "steps": profile.steps, "cold": cold, "seconds": None, "wall_seconds": None, "image": "", "problem": "", "error": ""}
+    deadline = Deadline(timeout, "sweep")
+    started = time.monotonic()
+    try:
+        prompt_id = provider.submit(provider.build_workflow(prompt, profile, seed=seed), deadline, api_url)
+        if not prompt_id:
+            row["error"] = "submit failed"
+            return row
+        entry = None
+        while not deadline.expired():
+            entry = provider.session.get(f"{api_url}/history/{prompt_id}", timeout=request_timeout(deadline)).json().get(prompt_id)
+            if entry and ('9' in entry.get('outputs', {}) or entry.get('status', {}).get('status_str') == 'error'):
+                break
+            time.sleep(min(0.5, deadline.remaining()))
+        if not entry or '9' not in entry.get('outputs', {}):
+            row["error"] = "error" if entry else "timeout"
+            if not entry:
+                provider.cancel(prompt_id, api_url)
+            return row
+        row["wall_seconds"] = round(time.monotonic() - started, 3)
+        milliseconds = execution_ms(entry)
+        row["seconds"] = round(milliseconds / 1000, 3) if milliseconds is not None else row["wall_seconds"]
+
+        filename = provider.download(entry['outputs']['9']['images'][0], deadline, api_url)
+        if filename:
+            name = f"{_slug(checkpoint)}-{profile.resolution}-{_slug(profile.sampler)}-{profile.steps}{'-cold' if cold else ''}.png"
+            os.replace(os.path.join(IMAGES_DIR, filename), os.path.join(out_dir, "images", name))
+            row["image"] = f"images/{name}"
+            row["problem"] = image_problem(os.path.join(out_dir, row["image"])) or ""
+    except Exception as e:
+        logger.error(f"Sweep render of {checkpoint} at {profile.resolution} failed: {e}")
+        row["error"] = str(e)
+    return row
+
+def sweep_checkpoint(api_url: str, checkpoint: str, profiles: List[RenderProfile], prompt: str, seed: int,
+                     repeat: int, out_dir: str, timeout: float) -> List[dict]:
+    """Every combination for one checkpoint on one endpoint, starting with a cold render."""
+    provider = ComfyUIProvider()
+    provider.model = checkpoint
+    logger.info(f"Sweeping {checkpoint} on {api_url}: {len(profiles) * repeat + 1} renders")
+    # ComfyUI caches outputs of identical prompts, so every render needs its own seed
+    rows = [render_one(provider, api_url, checkpoint, profiles[0], prompt, seed, True, out_dir, timeout)]
+    for index, profile in enumerate(profiles * repeat):
+        rows.append(render_one(provider, api_url, checkpoint, profile, prompt, seed + index + 1, False, out_dir, timeout))
+    return rows
+
+def _fit(points: List[tuple]) -> tuple:
+    """Least-squares (intercept, slope) of seconds over steps, or (None, seconds/steps) with one step count."""
+    if len({steps for steps, _ in points}) < 2:
+        return None, sum(seconds / steps for steps, seconds in points) / len(points)
+    n = len(points)
+    mean_steps = sum(steps for steps, _ in points) / n
+    mean_seconds = sum(seconds for _, seconds in points) / n
+    slope = (sum((steps - mean_steps) * (seconds - mean_seconds) for steps, seconds in points)
+             / sum((steps - mean_steps) ** 2 for steps, _ in points))
+    return mean_seconds - slope * mean_steps, slope
+
+def summarise(rows: List[dict]) -> List[dict]:
+    """Load time, seconds per iteration and fixed overhead per checkpoint, resolution and sampler."""
+    groups = {}
+    for row in rows:
+        key = (row["endpoint"], row["checkpoint"], row["resolution"], row["sampler"])
+        groups.setdefault(key, []).append(row)
+
+    # Loading is paid once per checkpoint, by the cold render
+    loads = {}
+    for group in groups.values():
+        cold = [row for row in group if row["cold"] and row["seconds"] is not None]
+        same = [row["seconds"] for row in group if cold and not row["cold"] and row["seconds"] is not None
+                and row["steps"] == cold[0]["steps"]]
+        if same:
+            loads[(cold[0]["endpoint"], cold[0]["checkpoint"])] = max(0.0, cold[0]["seconds"] - sum(same) / len(same))
+
+    summary = []
+    for (endpoint, checkpoint, resolution, sampler), group in groups.items():
+        warm = [row for row in group if not row["cold"] and row["seconds"] is not None]
+        load = loads.get((endpoint, checkpoint))
+        overhead, per_it = _fit([(row["steps"], row["seconds"]) for row in warm]) if warm else (None, None)
+        summary.append({
+            "endpoint": endpoint, "checkpoint": checkpoint, "resolution": resolution, "sampler": sampler,
+            "load_seconds": round(load, 3) if load is not None else None,
+            "seconds_per_it": round(per_it, 4) if per_it is not None else None,
+            "overhead_seconds": round(max(0.0, overhead), 3) if overhead is not None else None,
+            "runs": len(group),
+            "problems": sum(1 for row in group if row["problem"] or row["error"]),
+        })
+    summary.sort(key=lambda s: (s["seconds_per_it"] is None, s["seconds_per_it"] or 0))
+    return summary
+
+def write_csv(path: str, rows: List[dict], fields: List[str]) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def render_text(summary: List[dict]) -> str:
+    """Plain text summary, fastest sampling first."""
+    def number(value, digits):
+        return "-" if value is None else f"{value:.{digits}f}"
+    lines = [f"{'checkpoint':<40} {'resolution':<10} {'sampler':<18} {'load s':>7} {'s/it':>7} {'fixed s':>7}  problems"]
+    for s in summary:
+        lines.append(f"{s['checkpoint'][:40]:<40} {s['resolution']:<10} {s['sampler'][:18]:<18} "
+                     f"{number(s['load_seconds'], 1):>7} {number(s['seconds_per_it'], 3):>7} "
+                     f"{number(s['overhead_seconds'], 1):>7}  {s['problems']}")
+    return "\n".join(lines)
+
+def render_html(summary: List[dict], rows: List[dict], prompt: str) -> str:
+    """HTML comparison page with the summary and a thumbnail for every render."""
+    esc = html.escape
+    def cell(value) -> str:
+        return "&ndash;" if value is None or value == "" else esc(str(value))
+    summary_rows = "".join(
+        "<tr>" + "".join(f"<td>{cell(s[field])}</td>" for field in SUMMARY_FIELDS) + "</tr>" for s in summary
+    )
+    def thumbnail(image: str) -> str:
+        return f'<a href="{esc(image)}"><img src="{esc(image)}" width="128"></a>' if image else ""
+    run_rows = "".join(
+        f"<tr><td>{thumbnail(row['image'])}</td>"
+        + "".join(f"<td>{cell(row[field])}</td>" for field in RUN_FIELDS if field != "image") + "</tr>"
+        for row in rows
+    )
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Checkpoint sweep</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border: 1px solid #ddd; padding: 4px 8px; text-align: left; vertical-align: middle; }}
+th {{ background: #f4f4f4; }}
+</style>
+</head>
+<body>
+<h1>Checkpoint sweep</h1>
+<p>Generated {datetime.now().strftime("%Y-%m-%d %H:%M")}. Prompt: {esc(prompt)}. Durations in seconds, from ComfyUI's execution timestamps.</p>
+<h2>Summary</h2>
+<table>
+<tr>{"".join(f"<th>{esc(field)}</th>" for field in SUMMARY_FIELDS)}</tr>
+{summary_rows}
+</table>
+<h2>Renders</h2>
+<table>
+<tr><th>image</th>{"".join(f"<th>{esc(field)}</th>" for field in RUN_FIELDS if field != "image")}</tr>
+{run_rows}
+</table>
+</body>
+</html>
+"""
+
+def run_sweep(checkpoints: Optional[List[str]] = None, steps: Optional[List[int]] = None,
+              samplers: Optional[List[str]] = None, resolutions: Optional[List[str]] = None,
+              endpoints: Optional[List[str]] = None, prompt: str = DEFAULT_PROMPT, seed: int = 42,
+              repeat: int = 1, out_dir: Optional[str] = None, timeout: float = 600) -> List[dict]:
+    """Sweep checkpoints and settings, write the results to out_dir and return the summary."""
+    endpoints = endpoints or [url.strip() for url in os.getenv('COMFYUI_API_URLS', os.getenv('COMFYUI_API_URL', 'http://192.168.1.9:7860')).split(',') if url.strip()]
+    checkpoints = checkpoints or available_checkpoints(ComfyUIProvider(), endpoints[0])
+    steps = steps or [15, 30]
+    samplers = samplers or [os.getenv('IMAGE_SAMPLER', 'DPM++ 2M')]
+    resolutions = resolutions or [os.getenv('IMAGE_RESOLUTION', '768x768')]
+    cfg = float(os.getenv('IMAGE_CFG', '7'))
+    profiles = [RenderProfile("sweep", *parse_resolution(resolution), count, cfg, sampler)
+                for resolution in resolutions for sampler in samplers for count in steps]
+
+    out_dir = out_dir or os.path.join("sweeps", datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.join(out_dir, "images"), exist_ok=True)
+    logger.info(f"Sweeping {len(checkpoints)} checkpoints x {len(profiles)} settings on {len(endpoints)} endpoints")
+
+    # Each endpoint works through its share of the checkpoints one at a time
+    shares = {endpoint: checkpoints[i::len(endpoints)] for i, endpoint in enumerate(endpoints)}
+    rows = []
+    lock = threading.Lock()
+
+    def sweep_endpoint(endpoint: str) -> None:
+        for checkpoint in shares[endpoint]:
+            result = sweep_checkpoint(endpoint, checkpoint, profiles, prompt, seed, repeat, out_dir, timeout)
+            with lock:
+                rows.extend(result)
+
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as pool:
+        list(pool.map(sweep_endpoint, endpoints))
+
+    rows.sort(key=lambda row: (row["checkpoint"], row["resolution"], row["sampler"], not row["cold"], row["steps"]))
+    summary = summarise(rows)
+    write_csv(os.path.join(out_dir, "runs.csv"), rows, RUN_FIELDS)
+    write_csv(os.path.join(out_dir, "summary.csv"), summary, SUMMARY_FIELDS)
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(render_html(summary, rows, prompt))
+    logger.info(f"Sweep results written to {out_dir}")
+    return summary
@@ -0,0 +1,280 @@
+"""HTTP transport shared by the providers, with record and replay modes.
+
+Providers get their requests session from get_session() and the OpenAI SDK
+gets its httpx client from get_openai_http_client(). With PROVIDER_TRANSPORT
+set to "record", every request/response pair (including ComfyUI history
+payloads and image bytes) is appended to a cassette file. With "replay", the
+cassette is served back with the originally observed timings, optionally sped
+up by REPLAY_SPEED, without touching the GPU host or OpenAI.
+
+Cassettes are gzipped JSONL. Response bodies are stored once per content hash,
+so the same image or history payload recorded twice costs nothing extra.
+"""
+
+import os
+import json
+import gzip
+import time
+import base64
+import atexit
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .config.settings import PROVIDER_TRANSPORT, PROVIDER_CASSETTE, REPLAY_SPEED
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe the wire encoding, which no longer applies to a decoded body
+WIRE_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection")
+
+_session = None
+_cassette = None
+_lock = threading.Lock()
+
+def _request_key(method: str, url: str) -> str:
+    """Match requests on method, path and query so recordings work against any host."""
+    parts = urlsplit(url)
+    return f"{method.upper()} {parts.path}{'?' + parts.query if parts.query else ''}"
+
+def _clean_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in WIRE_HEADERS}
+
+class Cassette:
+    """A file of recorded request/response pairs."""
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self.blobs = {}
+        self.queues = defaultdict(deque)
+        self.first_replayed = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self._file = None
+
+    def load(self) -> "Cassette":
+        """Read a cassette for replay."""
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if "blob" in entry:
+                    self.blobs[entry["blob"]] = base64.b64decode(entry["data"])
+                else:
+                    self.queues[entry["key"]].append(entry)
+        logger.info(f"Loaded {sum(len(q) for q in self.queues.values())} interactions from {self.path}")
+        return self
+
+    def _store(self, data: bytes) -> str:
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self.blobs:
+            self.blobs[digest] = data
+            self._write({"blob": digest, "data": base64.b64encode(data).decode("ascii")})
+        return digest
+
+    def _write(self, entry: dict) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+            atexit.register(self.close)
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def record(self, method: str, url: str, request_body: Optional[bytes], status: int,
+               headers: Dict[str, str], body: bytes, elapsed: float) -> None:
+        """Append one interaction."""
+        with self.lock:
+            entry = {
+                "key": _request_key(method, url),
+                "t": round(time.monotonic() - self.started - elapsed, 4),
+                "elapsed": round(elapsed, 4),
+                "request": self._store(request_body) if request_body else None,
+                "status": status,
+                "headers": headers,
+                "body": self._store(body),
+            }
+            self._write(entry)
+
+    def next(self, method: str, url: str) -> Optional[dict]:
+        """Find the recorded response for a request, or None if there isn't one.
+
+        Responses are served in recorded order. For GETs, which are polls in
+        practice, replay follows the recorded timeline: polls that would have
+        happened while we slept are skipped, and the last response repeats.
+        """
+        key = _request_key(method, url)
+        with self.lock:
+            queue = self.queues.get(key)
+            if not queue:
+                return None
+            if method.upper() == "GET" and len(queue) > 1:
+                now = time.monotonic()
+                first_now, first_t = self.first_replayed.setdefault(key, (now, queue[0]["t"]))
+                target = first_t + (now - first_now) * self.speed if self.speed > 0 else float("inf")
+                while len(queue) > 1 and queue[1]["t"] <= target:
+                    queue.popleft()
+            entry = queue[0]
+            if len(queue) > 1:
+                queue.popleft()
+        if self.speed > 0:
+            time.sleep(entry["elapsed"] / self.speed)
+        return entry
+
+    def body(self, entry: dict) -> bytes:
+        """The response body of a recorded interaction."""
+        return self.blobs.get(entry["body"], b"")
+
+    def close(self) -> None:
+        """Close the cassette file if it was opened for recording."""
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class _TeeBody:
+    """A streamed response body that keeps the chunks the caller reads, and hands them over once it is done."""
+
+    def __init__(self, raw, done: Callable[[bytes], None]):
+        self._raw = raw
+        self._done = done
+        self._chunks = []
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._chunks.append(chunk)
+            yield chunk
+        # A body the caller stopped reading early is not worth replaying
+        self._done(b"".join(self._chunks))
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+class RecordingAdapter(HTTPAdapter):
+    """requests adapter that records every exchange into a cassette.
+
+    A streamed response is still streamed: its body is recorded once the
+    caller has read all of it.
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        body = request.body.encode("utf-8") if isinstance(request.body, str) else request.body
+
+        def record(content: bytes) -> None:
+            self.cassette.record(request.method, request.url, body, response.status_code,
+                                 _clean_headers(response.headers), content, time.perf_counter() - started)
+
+        if kwargs.get("stream"):
+            response.raw = _TeeBody(response.raw, record)
+        else:
+            record(response.content)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """requests adapter that answers from a cassette instead of the network."""
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        entry = self.cassette.next(request.method, request.url)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(f"No recorded interaction for {request.method} {request.url}")
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = self.cassette.body(entry)
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        return response
+
+    def close(self):
+        pass
+
+def get_cassette() -> Optional[Cassette]:
+    """The cassette for the configured transport mode, if any."""
+    global _cassette
+    mode = PROVIDER_TRANSPORT.lower()
+    if mode not in ("record", "replay"):
+        return None
+    with _lock:
+        if _cassette is None:
+            path = PROVIDER_CASSETTE
+            _cassette = Cassette(path, REPLAY_SPEED)
+            if mode == "replay":
+                _cassette.load()
+            logger.info(f"Provider transport in {mode} mode using {path}")
+        return _cassette
+
+def get_session() -> requests.Session:
+    """The requests session shared by all providers."""
+    global _session
+    with _lock:
+        if _session is not None:
+            return _session
+    cassette = get_cassette()
+    session = requests.Session()
+    mode = PROVIDER_TRANSPORT.lower()
+    if mode == "record":
+        adapter = RecordingAdapter(cassette)
+    elif mode == "replay":
+        adapter = ReplayAdapter(cassette)
+    else:
+        adapter = None
+    if adapter is not None:
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    with _lock:
+        if _session is None:
+            _session = session
+        return _session
+
+def get_openai_http_client():
+    """An httpx client for the OpenAI SDK in record/replay mode, or None for the SDK default."""
+    cassette = get_cassette()
+    if cassette is None:
+        return None
+
+    import httpx
+
+    mode = PROVIDER_TRANSPORT.lower()
+
+    class RecordingTransport(httpx.BaseTransport):
+        def __init__(self):
+            self.inner = httpx.HTTPTransport()
+
+        def handle_request(self, request):
+            started = time.perf_counter()
+            response = self.inner.handle_request(request)
+            content = response.read()
+            response.close()
+            headers = _clean_headers(response.headers)
+            cassette.record(request.method, str(request.url), request.read(), response.status_code,
+                            headers, content, time.perf_counter() - started)
+            return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    class ReplayTransport(httpx.BaseTransport):
+        def handle_request(self, request):
+            entry = cassette.next(request.method, str(request.url))
+            if entry is None:
+                raise httpx.ConnectError(f"No recorded interaction for {request.method} {request.url}", request=request)
+            return httpx.Response(entry["status"], headers=entry["headers"], content=cassette.body(entry), request=request)
+
+    return httpx.Client(transport=RecordingTransport() if mode == "record" else ReplayTransport())
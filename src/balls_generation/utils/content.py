@@ -2,11 +2,36 @@
 
 import os
 import re
+import json
 from datetime import datetime
 from typing import Dict, Any, Optional
 import yaml
 
-from ..config.settings import CONTENT_DIR
+from ..config.settings import BASE_DIR, CONTENT_DIR, POST_LAYOUT
+from .images import IMAGES_DIR
+from .tracing import span
+from .tags import normalize_tags, format_params
+from .search_index import index_post
+
+# Hugo's content root; a page's URL is its path below it. Anchored at the site,
+# so posts land in the same place whichever directory cron starts us in
+CONTENT_ROOT = os.path.join(BASE_DIR, "content")
+
+def page_url(path: str) -> str:
+    """The URL Hugo gives a post file or leaf bundle directory, e.g. /en/posts/2025/03/slug/."""
+    if os.path.basename(path) == "index.md":
+        path = os.path.dirname(path)
+    elif path.endswith(".md"):
+        path = path[:-3]
+    return "/" + os.path.relpath(path, CONTENT_ROOT).replace(os.sep, "/").lower() + "/"
+
+def bundle_image(image: str, bundle: str) -> str:
+    """Move a rendered image from static/images into a post's bundle and return its URL."""
+    name = os.path.basename(image)
+    source = os.path.join(IMAGES_DIR, image)
+    if os.path.exists(source):
+        os.replace(source, os.path.join(bundle, name))
+    return page_url(bundle) + name
 
 def clean_title(title: str) -> str:
     """Clean up a title for use in filenames and front matter."""
@@ -84,14 +109,48 @@ def clean_content(content: str, content_type: str = 'story') -> str:
     
     return content
 
-def create_blog_post(data: Dict[str, Any], image_path: Optional[str] = None, scene_image_path: Optional[str] = None, content_type: str = "story") -> str:
-    """Create a new blog post with the generated content."""
+def format_image_settings(image_settings: Optional[Dict[str, Dict[str, Any]]]) -> str:
+    """Render the image settings section of the generation details.
+    
+    image_settings maps an image role ("Main image", "Scene image") to the
+    settings of the provider that produced it. When both images share the same
+    settings they are listed once.
+    """
+    if image_settings is None:
+        # Posts generated without provider details keep the historical defaults
+        image_settings = {'': {'Resolution': '768x768', 'Steps': 30, 'CFG': 7, 'Sampler': 'DPM++ 2M',
+                               'Model': 'sd3_medium_incl_clips_t5xxlfp16.safetensors'}}
+    if not image_settings:
+        return ""
+    
+    distinct = list({tuple(settings.items()): settings for settings in image_settings.values()}.values())
+    if len(distinct) == 1:
+        sections = [("Image Generation Settings", distinct[0])]
+    else:
+        sections = [(f"{role} Generation Settings".title(), settings) for role, settings in image_settings.items()]
+    
+    return "\n".join(
+        f"#### {heading}\n" + "".join(f"- {key}: {value}\n" for key, value in settings.items())
+        for heading, settings in sections
+    )
+
+def create_blog_post(data: Dict[str, Any], image_path: Optional[str] = None, scene_image_path: Optional[str] = None, content_type: str = "story",
+                     publish_at: Optional[datetime] = None) -> str:
+    """Create a new blog post with the generated content.
+    
+    With publish_at the post is written ahead of time: dated for that
+    moment, with a publishDate, and as a draft until the publisher puts it live.
+    
+    POST_LAYOUT=bundle writes the post as a leaf bundle,
+    posts/YYYY/MM/<slug>-<time>/index.md, with its images moved in next to
+    it as page resources instead of left in static/images.
+    """
     # Create the content directory if it doesn't exist
-    content_dir = "content/en/posts"
+    content_dir = os.path.join(CONTENT_ROOT, "en", "posts")
     os.makedirs(content_dir, exist_ok=True)
     
-    # Generate filename with current date
-    current_date = datetime.now()
+    # Generate filename with current date, or the scheduled one
+    current_date = publish_at or datetime.now()
     date = current_date.strftime("%Y-%m-%d")
     datetime_str = current_date.strftime("%Y-%m-%dT%H:%M:%S-00:00")
     timestamp = current_date.strftime("%H%M%S")
@@ -101,35 +160,46 @@ def create_blog_post(data: Dict[str, Any], image_path: Optional[str] = None, sce
     
     # Create URL-friendly slug with timestamp to ensure uniqueness
     slug = title.lower().replace(' ', '-')
-    filename = f"{content_dir}/{date}-{slug}-{timestamp}.md"
+    if POST_LAYOUT.lower() == 'bundle':
+        bundle = f"{content_dir}/{current_date:%Y}/{current_date:%m}/{slug}-{timestamp}"
+        os.makedirs(bundle, exist_ok=True)
+        filename = f"{bundle}/index.md"
+        link = page_url(bundle)
+    else:
+        bundle = None
+        filename = f"{content_dir}/{date}-{slug}-{timestamp}.md"
+        link = f"{date}-{slug}-{timestamp}"
     
     # Format the image paths correctly for Hugo
     if image_path:
         if image_path.startswith('images/'):
             image_path = image_path[7:]
-        image_path = f"/images/{image_path}"
+        image_path = bundle_image(image_path, bundle) if bundle else f"/images/{image_path}"
     
     if scene_image_path:
         if scene_image_path.startswith('images/'):
             scene_image_path = scene_image_path[7:]
-        scene_image_path = f"/images/{scene_image_path}"
+        scene_image_path = bundle_image(scene_image_path, bundle) if bundle else f"/images/{scene_image_path}"
     
     # Determine the date field and value based on content type
     date_field = "datetime" if content_type in ["news", "article"] else "date"
     date_value = datetime_str if content_type in ["news", "article"] else date
     
+    # Scheduled posts stay drafts until their publishDate has passed
+    schedule = f"publishDate: {publish_at.astimezone().isoformat(timespec='seconds')}\n" if publish_at else ""
+    
     # Create the front matter with datetime for news/articles and date for stories
     front_matter = f"""---
 title: "{title}"
 {date_field}: {date_value}
-draft: false
+{schedule}draft: {'true' if publish_at else 'false'}
 categories: ["{content_type}"]
-tags: {data.get('tags', [])}
----
+tags: {json.dumps(normalize_tags(data.get('tags', []), content_type))}
+{format_params(data.get('provenance', {}))}---
 """
     
     # Add the main image using markdown syntax if we have one
-    image_section = f"\n[![image]({image_path})]({date}-{slug}-{timestamp})\n" if image_path else ""
+    image_section = f"\n[![image]({image_path})]({link})\n" if image_path else ""
     
     # Get the content based on type
     content = data.get('story' if content_type == 'story' else 'article', '')
@@ -148,7 +218,7 @@ tags: {data.get('tags', [])}
     content_parts = content.split('[SCENE]')
     content_with_image = content_parts[0]
     if len(content_parts) > 1 and scene_image_path:
-        content_with_image += f"\n\n[![scene]({scene_image_path})]({date}-{slug}-{timestamp})\n\n" + content_parts[1]
+        content_with_image += f"\n\n[![scene]({scene_image_path})]({link})\n\n" + content_parts[1]
     else:
         content_with_image = content
     
@@ -176,17 +246,16 @@ Make it engaging and humorous.
 {data.get('scene_prompt', '')}
 ```
 
-#### Image Generation Settings
-- Resolution: 768x768
-- Steps: 30
-- CFG: 7
-- Sampler: DPM++ 2M
-- Model: sd3_medium_incl_clips_t5xxlfp16.safetensors
-"""
+{format_image_settings(data.get('image_settings'))}"""
     
     # Write the content to the file
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(front_matter + image_section + intro_section + "\n<!--more-->\n\n" + content_with_image + prompts_section)
+    post = front_matter + image_section + intro_section + "\n<!--more-->\n\n" + content_with_image + prompts_section
+    with span("post.write", content_type=content_type, bytes=len(post.encode("utf-8"))):
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(post)
+    
+    # Drafts are left out until they are published
+    index_post(filename)
     
     return filename
 
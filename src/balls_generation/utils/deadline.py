@@ -0,0 +1,84 @@
+"""Deadline utilities for bounding how long a post may take to generate."""
+
+import time
+import logging
+from typing import Dict, Optional
+
+from ..config.settings import POST_DEADLINE_SECONDS, STAGE_BUDGETS, REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+def parse_budgets(spec: str) -> Dict[str, float]:
+    """Parse a stage budget spec like "llm=0.3,main_image=0.35" into a dict."""
+    budgets = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        name, share = part.split('=', 1)
+        try:
+            budgets[name.strip()] = float(share)
+        except ValueError:
+            logger.warning(f"Ignoring invalid stage budget: {part}")
+    return budgets
+
+class Deadline:
+    """A monotonic point in time that a unit of work has to finish by.
+
+    A post-level deadline is split into stage deadlines with stage(). Each
+    stage gets its share of whatever time is left, so time saved by an early
+    stage rolls forward to the stages after it.
+    """
+
+    def __init__(self, seconds: float, name: str = "post", budgets: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.budgets = budgets or {}
+        self.cancelled = False
+        self._started = set()
+
+    @classmethod
+    def for_post(cls) -> "Deadline":
+        """Create a deadline for one post using the configured budgets."""
+        return cls(POST_DEADLINE_SECONDS, "post", parse_budgets(STAGE_BUDGETS))
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline expires."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Whether the deadline has passed."""
+        return time.monotonic() >= self.expires_at
+
+    def cancel(self) -> None:
+        """Expire the deadline now, e.g. because another attempt already won."""
+        self.cancelled = True
+        self.expires_at = time.monotonic()
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Seconds to use as a request timeout so a call can't outlive the deadline."""
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(remaining, cap)
+        # requests treats 0 as "no timeout" on some platforms, keep a small floor
+        return max(remaining, 0.1)
+
+    def stage(self, name: str) -> "Deadline":
+        """Create the deadline for a named stage of this unit of work.
+
+        Stages without a configured budget get all of the remaining time.
+        """
+        self._started.add(name)
+        share = self.budgets.get(name)
+        if share is None:
+            return Deadline(self.remaining(), name)
+
+        pending = share + sum(s for n, s in self.budgets.items() if n not in self._started)
+        seconds = self.remaining() * (share / pending) if pending > 0 else self.remaining()
+        return Deadline(seconds, name)
+
+def request_timeout(deadline: Optional[Deadline] = None) -> float:
+    """Timeout for a single HTTP request, bounded by the deadline if there is one."""
+    if deadline is None:
+        return REQUEST_TIMEOUT
+    return deadline.timeout(REQUEST_TIMEOUT)
@@ -5,6 +5,7 @@ import subprocess
 from datetime import datetime
 
 from ..config.settings import BASE_DIR
+from .tracing import span
 
 def deploy():
     """Deploy the blog using Hugo."""
@@ -14,15 +15,17 @@ def deploy():
         
         # Build the site
         print("Building site with Hugo...")
-        subprocess.run(["hugo", "--minify"], check=True)
+        with span("deploy.hugo"):
+            subprocess.run(["hugo", "--minify"], check=True)
         
         # Deploy to GitHub Pages
         print("Deploying to GitHub Pages...")
-        # First, commit any changes
-        subprocess.run(["git", "add", "."], check=True)
-        subprocess.run(["git", "commit", "-m", f"Update content {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"], check=True)
-        # Push to GitHub
-        subprocess.run(["git", "push"], check=True)
+        with span("deploy.push"):
+            # First, commit any changes
+            subprocess.run(["git", "add", "."], check=True)
+            subprocess.run(["git", "commit", "-m", f"Update content {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"], check=True)
+            # Push to GitHub
+            subprocess.run(["git", "push"], check=True)
         
         print("Deployment completed successfully!")
         
@@ -0,0 +1,141 @@
+"""Cheap checks for renders that came out blank or as noise.
+
+Diffusion models occasionally return a flat black frame (a tripped safety
+filter, a NaN in the VAE) or pure noise (a broken sampler or checkpoint).
+Both are easy to spot from simple pixel statistics, so this decodes the PNG
+with zlib alone, without an imaging library, and looks at the spread of
+brightness and at how much neighbouring pixels differ.
+"""
+
+import math
+import zlib
+import struct
+import logging
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Bytes per pixel for 8-bit grey, RGB, grey+alpha and RGBA
+CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+# A natural image spans far more than this in brightness
+BLANK_STDDEV = 4.0
+
+# For independent noise neighbours differ by about 1.13 standard deviations; in real images by far less
+NOISE_RATIO = 0.9
+
+# Rows and columns sampled for the statistics; decoding still covers every row
+SAMPLES = 64
+
+def _paeth(a: int, b: int, c: int) -> int:
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+def _unfilter(data: bytes, width: int, height: int, bpp: int) -> List[bytearray]:
+    """Undo the per-row PNG filters and return the raw scanlines."""
+    stride = width * bpp
+    rows = []
+    previous = bytearray(stride)
+    offset = 0
+    for _ in range(height):
+        kind = data[offset]
+        row = bytearray(data[offset + 1:offset + 1 + stride])
+        offset += stride + 1
+        if kind == 1:
+            for i in range(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        elif kind == 2:
+            for i in range(stride):
+                row[i] = (row[i] + previous[i]) & 0xFF
+        elif kind == 3:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif kind == 4:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                upper_left = previous[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + _paeth(left, previous[i], upper_left)) & 0xFF
+        rows.append(row)
+        previous = row
+    return rows
+
+def read_png(filepath: str) -> Optional[Tuple[int, int, int, List[bytearray]]]:
+    """Decode an 8-bit, non-interlaced PNG into (width, height, bytes per pixel, scanlines).
+
+    Returns None for PNG variants this doesn't decode (palettes, 16-bit,
+    interlacing). Raises ValueError for files that aren't valid PNGs.
+    """
+    with open(filepath, "rb") as f:
+        data = f.read()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG")
+    offset = len(PNG_SIGNATURE)
+    header = None
+    compressed = []
+    while offset + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        chunk = data[offset + 8:offset + 8 + length]
+        if len(chunk) < length:
+            raise ValueError("truncated PNG")
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif kind == b"IDAT":
+            compressed.append(chunk)
+        elif kind == b"IEND":
+            break
+        offset += length + 12
+    if header is None or not compressed:
+        raise ValueError("PNG has no image data")
+    width, height, depth, color_type, _, _, interlace = header
+    if depth != 8 or color_type not in CHANNELS or interlace:
+        return None
+    try:
+        raw = zlib.decompress(b"".join(compressed))
+    except zlib.error as e:
+        raise ValueError(f"corrupt image data: {e}")
+    bpp = CHANNELS[color_type]
+    if len(raw) < height * (width * bpp + 1):
+        raise ValueError("truncated image data")
+    return width, height, bpp, _unfilter(raw, width, height, bpp)
+
+def image_problem(filepath: str) -> Optional[str]:
+    """What is wrong with a rendered image ("corrupt", "blank" or "noise"), or None if it looks fine."""
+    try:
+        decoded = read_png(filepath)
+    except (OSError, ValueError) as e:
+        logger.warning(f"{filepath} failed to decode: {e}")
+        return "corrupt"
+    if decoded is None:
+        return None
+    width, height, bpp, rows = decoded
+
+    def brightness(row: bytearray, x: int) -> float:
+        i = x * bpp
+        if bpp >= 3:
+            return 0.299 * row[i] + 0.587 * row[i + 1] + 0.114 * row[i + 2]
+        return row[i]
+
+    values = []
+    differences = []
+    for y in range(0, height, max(1, height // SAMPLES)):
+        row = rows[y]
+        for x in range(0, width - 1, max(1, width // SAMPLES)):
+            value = brightness(row, x)
+            values.append(value)
+            differences.append(abs(brightness(row, x + 1) - value))
+    if not values:
+        return "blank"
+
+    mean = sum(values) / len(values)
+    stddev = math.sqrt(sum((value - mean) ** 2 for value in values) / len(values))
+    if stddev < BLANK_STDDEV:
+        return "blank"
+    if sum(differences) / len(differences) > NOISE_RATIO * stddev:
+        return "noise"
+    return None
@@ -1,13 +1,85 @@
-"""Image handling utilities."""
+"""Image handling utilities.
+
+Images reach static/images by the cheapest route available: a hard link (or
+copy) from a locally mounted ComfyUI output directory, base64 data that came
+back with the API response, or an HTTP download streamed to disk in chunks.
+Every route writes to a temporary file and renames it into place, so a
+failed transfer never leaves a truncated image behind.
+"""
 
 import os
+import uuid
+import base64
+import shutil
 import requests
 from datetime import datetime
 import logging
-from typing import Optional
+from typing import Optional, Tuple
+
+from ..config.settings import IMAGES_DIR
 
 logger = logging.getLogger(__name__)
 
+# Large enough to keep syscalls down, small enough that memory stays flat
+CHUNK_SIZE = 1 << 16
+
+def new_image_path(prefix: str) -> Tuple[str, str]:
+    """A unique filename for a new image and its path under static/images.
+    
+    The random suffix keeps images generated in the same second, e.g. by
+    parallel posts, from overwriting each other.
+    """
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    filename = f"{prefix}-{datetime.now().strftime('%H%M%S')}-{uuid.uuid4().hex[:6]}.png"
+    return filename, os.path.join(IMAGES_DIR, filename)
+
+def _partial(filepath: str) -> str:
+    return f"{filepath}.{uuid.uuid4().hex[:8]}.part"
+
+def stream_to_file(session: requests.Session, url: str, filepath: str, timeout: float) -> Optional[int]:
+    """Stream a download to disk in chunks. Returns the bytes written, or None if the server refused."""
+    partial = _partial(filepath)
+    try:
+        with session.get(url, timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Failed to download image: {response.status_code}")
+                return None
+            written = 0
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+        os.replace(partial, filepath)
+        return written
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def save_base64(data: str, filepath: str) -> int:
+    """Write base64 image data from an API response. Returns the bytes written."""
+    image = base64.b64decode(data)
+    partial = _partial(filepath)
+    with open(partial, "wb") as f:
+        f.write(image)
+    os.replace(partial, filepath)
+    return len(image)
+
+def link_or_copy(source: str, filepath: str) -> Tuple[int, str]:
+    """Hard-link a local file into place, copying when a link isn't possible.
+    
+    Returns the size and the method used ("link" or "copy").
+    """
+    partial = _partial(filepath)
+    try:
+        os.link(source, partial)
+        method = "link"
+    except OSError:
+        # Different filesystem, or one without hard links
+        shutil.copyfile(source, partial)
+        method = "copy"
+    os.replace(partial, filepath)
+    return os.path.getsize(filepath), method
+
 def download_and_save_image(url: str, prefix: str = "image") -> Optional[str]:
     """Download an image from a URL and save it to the images directory.
     
@@ -30,12 +102,8 @@ def download_and_save_image(url: str, prefix: str = "image") -> Optional[str]:
         
         # Download the image
         logger.info(f"Downloading image from {url}")
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Save the image
-        with open(filepath, "wb") as f:
-            f.write(response.content)
+        if stream_to_file(requests.Session(), url, filepath, timeout=60) is None:
+            return None
         
         logger.info(f"Image saved to: {filepath}")
         return f"images/{filename}"  # Return path relative to static directory
@@ -0,0 +1,188 @@
+"""Journal of posts in progress, so a failed post resumes where it stopped.
+
+Every post being generated has a JSON file under JOURNAL_DIR that records
+each artifact as soon as it is finished: the validated LLM response, the
+main image and the scene image. When a post fails part-way, its entry stays
+behind and the next run for that content type picks it up, skipping the
+LLM call and any image that was already rendered.
+
+A post that is still incomplete after JOURNAL_MAX_ATTEMPTS runs is written
+with whatever it has, or, if it never got as far as a response, abandoned:
+its entry moves to JOURNAL_DIR/failed and its images are deleted.
+
+Entries are claimed with a lock file, so parallel generators never work on
+the same post. A lock whose process is gone, or that is older than
+JOURNAL_LOCK_SECONDS, is taken over.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from .images import IMAGES_DIR
+from ..config.settings import BASE_DIR, JOURNAL_DIR, JOURNAL_MAX_ATTEMPTS, JOURNAL_LOCK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+IMAGE_ROLES = ("main_image", "scene_image")
+
+class RecordedLLM:
+    """The provider that wrote a journaled response, for tags and generation details."""
+
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+
+class Job:
+    """One post in progress and the artifacts it has so far."""
+
+    def __init__(self, journal: "Journal", data: dict):
+        self.journal = journal
+        self.data = data
+
+    @property
+    def id(self) -> str:
+        return self.data["id"]
+
+    @property
+    def attempts(self) -> int:
+        return self.data["attempts"]
+
+    @property
+    def last_attempt(self) -> bool:
+        return self.attempts >= self.journal.max_attempts
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def record(self, **artifacts) -> None:
+        """Persist finished artifacts before moving on to the next one."""
+        self.data.update(artifacts)
+        self.journal.save(self)
+
+    def image(self, role: str) -> Optional[dict]:
+        """A finished image of this post, if it is still on disk."""
+        image = self.data.get(role)
+        if image and os.path.exists(os.path.join(IMAGES_DIR, image["filename"])):
+            return image
+        return None
+
+class Journal:
+    """The directory of in-progress posts."""
+
+    def __init__(self, directory: Optional[str] = None):
+        # Relative to the site, so a run from another directory resumes the same posts
+        self.directory = os.path.join(BASE_DIR, directory or JOURNAL_DIR)
+        self.max_attempts = JOURNAL_MAX_ATTEMPTS
+        self.lock_seconds = JOURNAL_LOCK_SECONDS
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self.directory, job_id + suffix)
+
+    def entries(self) -> List[dict]:
+        """Every in-progress post, oldest first."""
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable journal entry {name}: {e}")
+        return sorted(entries, key=lambda entry: entry.get("created", ""))
+
+    def referenced_images(self) -> List[str]:
+        """Image filenames that in-progress posts still need."""
+        return [entry[role]["filename"] for entry in self.entries() for role in IMAGE_ROLES if entry.get(role)]
+
+    def pending_content_type(self) -> Optional[str]:
+        """The content type of the oldest post that could be resumed now, if any."""
+        for entry in self.entries():
+            if not self._locked(entry["id"]):
+                return entry["content_type"]
+        return None
+
+    def save(self, job: Job) -> None:
+        # Write and rename, so a crash never leaves a half-written entry behind
+        path = self._path(job.id)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job.data, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _locked(self, job_id: str) -> bool:
+        """Whether another live generator holds the entry, clearing its lock if not."""
+        path = self._path(job_id, ".lock")
+        try:
+            with open(path, encoding="utf-8") as f:
+                host, _, pid = f.read().partition(":")
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return False
+        alive = age < self.lock_seconds
+        if alive and host == socket.gethostname():
+            try:
+                os.kill(int(pid), 0)
+            except (OSError, ValueError):
+                alive = False
+        if not alive:
+            logger.warning(f"Taking over stale journal lock for {job_id}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return alive
+
+    def _lock(self, job_id: str) -> bool:
+        try:
+            fd = os.open(self._path(job_id, ".lock"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{socket.gethostname()}:{os.getpid()}")
+        return True
+
+    def claim(self, content_type: str) -> Job:
+        """The oldest unfinished post of a content type, or a new one."""
+        for entry in self.entries():
+            if entry["content_type"] != content_type or self._locked(entry["id"]) or not self._lock(entry["id"]):
+                continue
+            if not os.path.exists(self._path(entry["id"])):
+                # Finished by another generator since we listed it
+                os.remove(self._path(entry["id"], ".lock"))
+                continue
+            job = Job(self, entry)
+            job.record(attempts=job.attempts + 1)
+            logger.info(f"Resuming post {job.id} (attempt {job.attempts} of {self.max_attempts})")
+            return job
+
+        job_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{content_type}-{uuid.uuid4().hex[:6]}"
+        self._lock(job_id)
+        job = Job(self, {"id": job_id, "content_type": content_type, "created": datetime.now().isoformat(), "attempts": 1})
+        self.save(job)
+        return job
+
+    def finish(self, job: Job, filename: Optional[str]) -> None:
+        """Close out an attempt: drop a written post, keep a failed one for the next run."""
+        if filename:
+            os.remove(self._path(job.id))
+        elif job.last_attempt:
+            self.abandon(job)
+        os.remove(self._path(job.id, ".lock"))
+
+    def abandon(self, job: Job) -> None:
+        """Give up on a post, deleting the images nobody will publish."""
+        logger.error(f"Abandoning post {job.id} after {job.attempts} attempts")
+        for role in IMAGE_ROLES:
+            image = job.image(role)
+            if image:
+                os.remove(os.path.join(IMAGES_DIR, image["filename"]))
+        failed = os.path.join(self.directory, "failed")
+        os.makedirs(failed, exist_ok=True)
+        os.replace(self._path(job.id), os.path.join(failed, job.id + ".json"))
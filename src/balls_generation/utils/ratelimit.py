@@ -0,0 +1,207 @@
+"""Client-side rate limiting and adaptive concurrency for OpenAI calls.
+
+Every OpenAI model gets one shared limiter per process that paces requests
+against its requests-per-minute and tokens-per-minute limits, and caps how
+many calls are in flight. The cap grows by one for every window of calls
+that succeed and halves when OpenAI answers 429 (AIMD), so parallel
+generation settles at the highest rate the account can sustain. Throttled
+and transient failures are retried with jittered exponential backoff,
+honouring Retry-After, for as long as the caller's deadline allows.
+
+Limits come from OPENAI_RPM and OPENAI_TPM, with per-model overrides in
+OPENAI_RATE_LIMITS, e.g. "dall-e-3=5/0,gpt-4o-mini=500/200000" (0 means no
+token limit). The x-ratelimit-* response headers, when present, replace the
+configured figures with the account's real ones.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import openai
+
+from .deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Halving on every 429 from a burst of parallel calls would collapse the limit to 1
+DECREASE_INTERVAL = 2.0
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+_limiters = {}
+_lock = threading.Lock()
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse "model=rpm/tpm,..." into {model: (rpm, tpm)}."""
+    limits = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        model, values = part.split('=', 1)
+        rpm, _, tpm = values.partition('/')
+        try:
+            limits[model.strip()] = (float(rpm), float(tpm or 0))
+        except ValueError:
+            logger.warning(f"Ignoring invalid rate limit: {part}")
+    return limits
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from a failed response's headers."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+class TokenBucket:
+    """Capacity that refills continuously over one minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.capacity:
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it already is, or the bucket is unlimited)."""
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.available) * 60 / self.capacity)
+
+class RateLimiter:
+    """Request, token and concurrency limits for one model."""
+
+    def __init__(self, model: str, rpm: float, tpm: float, max_concurrency: int, initial_concurrency: int):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self, tokens: float, deadline: Deadline) -> bool:
+        """Wait for a slot and budget for one call. Returns False if the deadline expires first."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.blocked_until - now, self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.requests.available -= 1
+                    self.tokens.available -= tokens
+                    self.in_flight += 1
+                    return True
+                if deadline.remaining() <= wait:
+                    return False
+                # With no time-based wait, we're waiting on a release() to notify us
+                self.condition.wait(wait if wait > 0 else deadline.remaining())
+
+    def release(self, throttled: bool = False, pause: Optional[float] = None,
+                actual_tokens: Optional[float] = None, estimated_tokens: float = 0) -> None:
+        """Return a slot and adapt the concurrency limit to how the call went."""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if actual_tokens is not None:
+                self.tokens.available += estimated_tokens - actual_tokens
+            if throttled:
+                if now - self.last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+                    logger.warning(f"Rate limited on {self.model}, concurrency limit now {int(self.limit)}")
+                if pause:
+                    self.blocked_until = max(self.blocked_until, now + pause)
+            else:
+                # Additive increase: about one more slot per limit's worth of successful calls
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def update_from_headers(self, headers) -> None:
+        """Adopt the account's real limits from x-ratelimit-* response headers."""
+        try:
+            limit_requests = headers.get("x-ratelimit-limit-requests")
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            limit_tokens = headers.get("x-ratelimit-limit-tokens")
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            with self.condition:
+                if limit_requests:
+                    self.requests.capacity = float(limit_requests)
+                if remaining_requests:
+                    self.requests.available = min(self.requests.available, float(remaining_requests))
+                if limit_tokens:
+                    self.tokens.capacity = float(limit_tokens)
+                if remaining_tokens:
+                    self.tokens.available = min(self.tokens.available, float(remaining_tokens))
+        except (TypeError, ValueError):
+            pass
+
+    def call(self, fn: Callable, deadline: Deadline, tokens: float = 0,
+             usage: Optional[Callable] = None):
+        """Run fn under the limits, retrying throttled and transient failures until the deadline.
+
+        fn returns an SDK raw response (from with_raw_response), so the rate
+        limit headers can be read; the parsed result is returned. usage, if
+        given, extracts the tokens actually used from the parsed result.
+        """
+        attempt = 0
+        while True:
+            if not self.acquire(tokens, deadline):
+                raise TimeoutError(f"No {self.model} capacity before the deadline")
+            try:
+                raw = fn()
+            except openai.RateLimitError as e:
+                pause = retry_after(e)
+                self.release(throttled=True, pause=pause)
+                error = e
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                pause = retry_after(e)
+                self.release()
+                error = e
+            except Exception:
+                self.release()
+                raise
+            else:
+                self.update_from_headers(raw.headers)
+                result = raw.parse()
+                self.release(actual_tokens=usage(result) if usage else None, estimated_tokens=tokens)
+                return result
+
+            # Full jitter, but never sooner than the server asked for
+            backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            delay = max(backoff, pause or 0)
+            attempt += 1
+            if deadline.remaining() <= delay:
+                raise error
+            logger.warning(f"{self.model} call failed ({type(error).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def get_limiter(model: str) -> RateLimiter:
+    """The process-wide limiter for a model."""
+    with _lock:
+        if model not in _limiters:
+            rpm, tpm = parse_limits(os.getenv('OPENAI_RATE_LIMITS', '')).get(
+                model, (float(os.getenv('OPENAI_RPM', '500')), float(os.getenv('OPENAI_TPM', '200000'))))
+            _limiters[model] = RateLimiter(
+                model, rpm, tpm,
+                max_concurrency=int(os.getenv('OPENAI_MAX_CONCURRENCY', '16')),
+                initial_concurrency=int(os.getenv('OPENAI_INITIAL_CONCURRENCY', '4')),
+            )
+        return _limiters[model]
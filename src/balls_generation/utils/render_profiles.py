@@ -0,0 +1,154 @@
+"""Named render profiles for ComfyUI, selectable per image slot.
+
+A profile sets the resolution, steps, CFG and sampler of a render. Two are
+built in: "full", from IMAGE_RESOLUTION, IMAGE_STEPS, IMAGE_CFG and
+IMAGE_SAMPLER, "fast", a 512px, 15-step render for images that are shown
+small, and "variation", which redraws the post's main image at partial
+denoise for a scene image that matches it. IMAGE_PROFILES adds or replaces
+profiles, e.g. "fast=512x512/15/5/Euler a,hero=1024x1024/40/7/DPM++ 2M Karras".
+
+A profile with a denoise below 1 is an img2img profile: given a source
+image, it starts from that image instead of an empty latent, which needs
+far fewer steps. Without a source image it renders from scratch.
+
+Each image a generator asks for has a slot, "<content type>.<role>" such as
+"news.scene_image". IMAGE_PROFILE_MAP picks the profile for a slot, trying
+the full slot, then the role, then the content type, e.g.
+"scene_image=fast,news.main_image=hero". Anything unmatched renders "full".
+"""
+
+import os
+import logging
+from typing import Dict, Optional, Tuple
+
+from ..config.settings import IMAGE_PROFILES, IMAGE_PROFILE_MAP
+
+logger = logging.getLogger(__name__)
+
+# Sampler names as the UIs show them, mapped to ComfyUI's sampler and scheduler
+SAMPLERS = {
+    "Euler": ("euler", "normal"),
+    "Euler a": ("euler_ancestral", "normal"),
+    "Heun": ("heun", "normal"),
+    "LMS": ("lms", "normal"),
+    "DPM2": ("dpm_2", "normal"),
+    "DPM++ 2M": ("dpmpp_2m", "normal"),
+    "DPM++ 2M Karras": ("dpmpp_2m", "karras"),
+    "DPM++ SDE": ("dpmpp_sde", "normal"),
+    "DPM++ SDE Karras": ("dpmpp_sde", "karras"),
+    "DPM++ 2M SDE": ("dpmpp_2m_sde", "normal"),
+    "DPM++ 2M SDE Karras": ("dpmpp_2m_sde", "karras"),
+    "DDIM": ("ddim", "ddim_uniform"),
+    "UniPC": ("uni_pc", "normal"),
+}
+
+DEFAULT_PROFILE = "full"
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    """Parse "WIDTHxHEIGHT" into (width, height)."""
+    width, _, height = resolution.lower().partition('x')
+    return int(width), int(height or width)
+
+class RenderProfile:
+    """Resolution, steps, CFG and sampler for one kind of render."""
+
+    def __init__(self, name: str, width: int, height: int, steps: int, cfg: float, sampler: str,
+                 denoise: float = 1.0):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.steps = steps
+        self.cfg = cfg
+        self.sampler = sampler
+        self.denoise = denoise
+
+    @property
+    def resolution(self) -> str:
+        return f"{self.width}x{self.height}"
+
+    def comfyui_sampler(self) -> Tuple[str, str]:
+        """ComfyUI's sampler_name and scheduler for this profile's sampler."""
+        if self.sampler in SAMPLERS:
+            return SAMPLERS[self.sampler]
+        # Anything else is taken to be a ComfyUI sampler name already
+        return self.sampler, "normal"
+
+    @property
+    def img2img(self) -> bool:
+        return self.denoise < 1
+
+    def scaled(self, scale: float) -> "RenderProfile":
+        """The same profile at a fraction of the resolution, kept to multiples of 8 for the latent."""
+        width = max(64, int(self.width * scale) // 8 * 8)
+        height = max(64, int(self.height * scale) // 8 * 8)
+        return RenderProfile(f"{self.name}-draft", width, height, self.steps, self.cfg, self.sampler, self.denoise)
+
+    def settings(self) -> dict:
+        """The settings shown with an image rendered with this profile."""
+        settings = {"Resolution": self.resolution, "Steps": self.steps, "CFG": f"{self.cfg:g}", "Sampler": self.sampler}
+        if self.img2img:
+            settings["Denoise"] = f"{self.denoise:g}"
+        return settings
+
+def parse_profiles(spec: str, defaults: RenderProfile) -> Dict[str, RenderProfile]:
+    """Parse "name=WxH/steps/cfg/sampler/denoise,..." into profiles.
+
+    Fields left out are taken from defaults, so "thumb=256x256" is a valid
+    profile.
+    """
+    profiles = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        name, values = part.split('=', 1)
+        fields = [field.strip() for field in values.split('/')]
+        try:
+            width, height = parse_resolution(fields[0]) if fields[0] else (defaults.width, defaults.height)
+            steps = int(fields[1]) if len(fields) > 1 and fields[1] else defaults.steps
+            cfg = float(fields[2]) if len(fields) > 2 and fields[2] else defaults.cfg
+            sampler = fields[3] if len(fields) > 3 and fields[3] else defaults.sampler
+            denoise = float(fields[4]) if len(fields) > 4 and fields[4] else 1.0
+        except ValueError:
+            logger.warning(f"Ignoring invalid render profile: {part}")
+            continue
+        profiles[name.strip()] = RenderProfile(name.strip(), width, height, steps, cfg, sampler, min(max(denoise, 0.0), 1.0))
+    return profiles
+
+def load_profiles() -> Dict[str, RenderProfile]:
+    """The built-in profiles plus any from IMAGE_PROFILES."""
+    width, height = parse_resolution(os.getenv('IMAGE_RESOLUTION', '768x768'))
+    full = RenderProfile("full", width, height, int(os.getenv('IMAGE_STEPS', '30')),
+                         float(os.getenv('IMAGE_CFG', '7')), os.getenv('IMAGE_SAMPLER', 'DPM++ 2M'))
+    profiles = {
+        "full": full,
+        "fast": RenderProfile("fast", 512, 512, 15, full.cfg, full.sampler),
+        # Partial denoise only runs the tail of the schedule, so half the steps cover it
+        "variation": RenderProfile("variation", width, height, max(1, full.steps // 2), full.cfg, full.sampler, 0.55),
+    }
+    profiles.update(parse_profiles(IMAGE_PROFILES, full))
+    return profiles
+
+class ProfileMap:
+    """Which profile renders which slot."""
+
+    def __init__(self, profiles: Optional[Dict[str, RenderProfile]] = None, spec: Optional[str] = None):
+        self.profiles = profiles or load_profiles()
+        spec = spec if spec is not None else IMAGE_PROFILE_MAP
+        self.slots = {}
+        for part in spec.split(','):
+            if '=' not in part:
+                continue
+            slot, name = (value.strip() for value in part.split('=', 1))
+            if name not in self.profiles:
+                logger.warning(f"Unknown render profile {name} for {slot}, using {DEFAULT_PROFILE}")
+                continue
+            self.slots[slot] = name
+
+    def profile_for(self, slot: Optional[str] = None) -> RenderProfile:
+        """The profile for a "<content type>.<role>" slot."""
+        if slot:
+            content_type, _, role = slot.rpartition('.')
+            for key in (slot, role, content_type):
+                if key and key in self.slots:
+                    return self.profiles[self.slots[key]]
+        return self.profiles[DEFAULT_PROFILE]
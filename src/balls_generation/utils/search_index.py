@@ -0,0 +1,221 @@
+"""A sharded search index maintained as posts are written.
+
+Hugo's home JSON output puts every post into one index.json that the build
+regenerates and every visitor downloads whole, so it grows with each post.
+This index lives in SEARCH_INDEX_DIR (static/search, published as /search/)
+as one shard per month of posts plus a small manifest.json:
+
+    {"version": 1, "fields": ["url", "title", "date", "tags", "summary"],
+     "base": "/en/posts/",
+     "shards": [{"name": "2025-03", "file": "2025-03.json", "count": 12,
+                 "hash": "3f9a0c1b2d", "tags": ["golf", "humor"]}, ...]}
+
+A shard holds its posts newest first as arrays in the order of "fields", with
+URLs relative to "base" and tags joined by spaces. Shards are listed newest
+first with a hash of their content, so the browser can cache a shard until it
+changes and fetch only the months, or the shards with a tag, it searches.
+
+Writing a post updates just its month's shard and the manifest; drafts are
+indexed when they are published. rebuild() writes the whole index from the
+posts under content/, after posts are moved or retagged.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import yaml
+
+from ..config.settings import BASE_DIR, SEARCH_INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FIELDS = ["url", "title", "date", "tags", "summary"]
+BASE = "/en/posts/"
+SUMMARY_CHARS = 160
+
+FRONT_MATTER = re.compile(r"\A---\n(.*?)\n---\n", re.DOTALL)
+# Image links, [![image](/images/x.png)](post), carry nothing worth searching
+IMAGE_LINK = re.compile(r"\[!\[[^\]]*\]\([^)]*\)\]\([^)]*\)|!\[[^\]]*\]\([^)]*\)")
+MARKUP = re.compile(r"[*_#>`]+")
+
+def _date(value: Any) -> str:
+    """YYYY-MM-DD from a front matter date, which YAML may already have parsed."""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return str(value or "")[:10]
+
+def entry(path: str, text: Optional[str] = None) -> Optional[List[str]]:
+    """The index entry for a post, or None for drafts and files that aren't posts."""
+    from .content import page_url
+
+    if text is None:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    match = FRONT_MATTER.match(text)
+    if not match:
+        return None
+    try:
+        front_matter = yaml.safe_load(match.group(1)) or {}
+    except yaml.YAMLError:
+        return None
+    if not isinstance(front_matter, dict) or front_matter.get("draft") is True or not front_matter.get("title"):
+        return None
+    date = _date(front_matter.get("date") or front_matter.get("datetime"))
+    if not re.match(r"\d{4}-\d{2}-\d{2}$", date):
+        date = datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d")
+
+    # The teaser before <!--more--> is what the post's summary shows too
+    teaser = text[match.end():].split("<!--more-->", 1)[0]
+    summary = " ".join(MARKUP.sub("", IMAGE_LINK.sub("", teaser)).split())
+    if len(summary) > SUMMARY_CHARS:
+        summary = summary[:SUMMARY_CHARS].rsplit(" ", 1)[0] + "…"
+
+    url = page_url(path)
+    tags = front_matter.get("tags") or []
+    return [url[len(BASE):] if url.startswith(BASE) else url, str(front_matter["title"]), date,
+            " ".join(str(tag) for tag in tags if tag), summary]
+
+def _dump(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class SearchIndex:
+    """The manifest and month shards in one directory."""
+
+    def __init__(self, directory: Optional[str] = None):
+        directory = directory if directory is not None else SEARCH_INDEX_DIR
+        # Relative to the site, not to wherever cron started us
+        self.directory = os.path.join(BASE_DIR, directory) if directory else ""
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write(self, name: str, data: bytes) -> None:
+        with open(self._path(name) + ".part", "wb") as f:
+            f.write(data)
+        os.replace(self._path(name) + ".part", self._path(name))
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Serialize updates, e.g. from the daemon and a publish run at the same time."""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl is None:
+            with self._lock_file():
+                yield
+            return
+        # Lock the directory itself, as a lock file would be published with the index
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _lock_file(self) -> Iterator[None]:
+        """A lock file outside static/, for platforms without flock."""
+        path = os.path.join(BASE_DIR, ".search-index.lock")
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    # An update takes milliseconds, so an old lock was left by a crash
+                    if time.time() - os.path.getmtime(path) > 60:
+                        os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.remove(path)
+
+    def manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._path(MANIFEST), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"version": 1, "fields": FIELDS, "base": BASE, "shards": []}
+
+    def shard(self, name: str) -> List[List[str]]:
+        try:
+            with open(self._path(f"{name}.json"), encoding="utf-8") as f:
+                return json.load(f)["posts"]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _write_shard(self, manifest: Dict[str, Any], name: str, posts: List[List[str]]) -> None:
+        """Write one shard and update its entry in the manifest, which the caller writes."""
+        shards = [shard for shard in manifest["shards"] if shard["name"] != name]
+        if posts:
+            posts.sort(key=lambda post: (post[2], post[0]), reverse=True)
+            data = _dump({"posts": posts})
+            self._write(f"{name}.json", data)
+            shards.append({"name": name, "file": f"{name}.json", "count": len(posts),
+                           "hash": hashlib.sha1(data).hexdigest()[:10],
+                           "tags": sorted({tag for post in posts for tag in post[3].split()})})
+        elif os.path.exists(self._path(f"{name}.json")):
+            os.remove(self._path(f"{name}.json"))
+        manifest["shards"] = sorted(shards, key=lambda shard: shard["name"], reverse=True)
+
+    def add(self, path: str) -> bool:
+        """Add or update one post in its month's shard; returns False if it isn't indexed."""
+        post = entry(path)
+        if post is None:
+            return False
+        name = post[2][:7]
+        with self._locked():
+            manifest = self.manifest()
+            posts = [existing for existing in self.shard(name) if existing[0] != post[0]]
+            self._write_shard(manifest, name, posts + [post])
+            self._write(MANIFEST, _dump(manifest))
+        return True
+
+    def rebuild(self, content_root: str = os.path.join(BASE_DIR, "content")) -> int:
+        """Write the index from scratch from every published post; returns how many were indexed."""
+        if not self.directory:
+            logger.info("SEARCH_INDEX_DIR is empty, not indexing")
+            return 0
+        months: Dict[str, List[List[str]]] = {}
+        for directory, _, names in os.walk(content_root):
+            for name in names:
+                if not name.endswith(".md") or name == "_index.md":
+                    continue
+                post = entry(os.path.join(directory, name))
+                if post is not None:
+                    months.setdefault(post[2][:7], []).append(post)
+        with self._locked():
+            manifest = {"version": 1, "fields": FIELDS, "base": BASE, "shards": []}
+            stale = {shard["name"] for shard in self.manifest()["shards"]} - months.keys()
+            for name in stale:
+                self._write_shard(manifest, name, [])
+            for name, posts in months.items():
+                self._write_shard(manifest, name, posts)
+            self._write(MANIFEST, _dump(manifest))
+        indexed = sum(len(posts) for posts in months.values())
+        logger.info(f"Indexed {indexed} posts in {len(months)} shards under {self.directory}")
+        return indexed
+
+def index_post(path: str) -> None:
+    """Add a freshly written or published post to the search index; never fails the caller."""
+    index = SearchIndex()
+    if not index.directory:
+        return
+    try:
+        index.add(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not add {path} to the search index: {e}")
@@ -0,0 +1,251 @@
+"""Tag normalization against a controlled vocabulary.
+
+The LLM invents free-form tags and the generators used to append model
+names, so nearly every post minted tag terms no other post shares, and Hugo
+renders HTML, RSS and JSON pages for each of them. Tags now go through
+normalize_tags(): case, spacing and plurals are folded, synonyms are mapped
+to one canonical tag, tags outside the vocabulary are dropped (and logged,
+or kept with TAG_KEEP_UNKNOWN) and at most TAG_MAX are kept. Which models produced a post is provenance, not a topic,
+so it goes into the post's front-matter params instead (see provenance()).
+
+The built-in vocabulary is below. TAG_VOCABULARY can point at a YAML file
+mapping canonical tags to lists of synonyms, which is merged over it.
+
+backfill() applies the same rules to posts that are already written.
+"""
+
+import os
+import re
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+
+from ..config.settings import BASE_DIR, TAG_MAX, TAG_KEEP_UNKNOWN, TAG_VOCABULARY
+
+logger = logging.getLogger(__name__)
+
+# Canonical tag -> synonyms
+VOCABULARY = {
+    "story": ["stories", "tale", "short-story"],
+    "news": ["article", "breaking-news", "headlines"],
+    "humor": ["humour", "funny", "comedy", "humorous", "hilarious", "jokes", "lol"],
+    "satire": ["parody", "fake-news", "satirical", "spoof"],
+    "fiction": ["fictional", "fantasy", "make-believe"],
+    "adventure": ["adventures", "journey", "quest", "escapade"],
+    "sports": ["sport", "athletics", "game", "games", "match", "competition"],
+    "ball": ["balls", "bouncing", "bounce"],
+    "football": ["american-football", "nfl"],
+    "soccer": ["soccer-ball"],
+    "basketball": ["nba", "hoops"],
+    "baseball": ["mlb"],
+    "tennis": ["tennis-ball"],
+    "golf": ["golf-ball"],
+    "volleyball": [],
+    "bowling": ["bowling-ball"],
+    "billiards": ["billiard-ball", "pool", "snooker"],
+    "ping-pong": ["ping-pong-ball", "table-tennis"],
+    "rugby": ["rugby-ball"],
+    "cricket": ["cricket-ball"],
+    "hockey": ["hockey-puck", "puck"],
+    "beach-ball": [],
+    "medicine-ball": [],
+    "stress-ball": [],
+    "bouncy-ball": [],
+    "animals": ["animal", "pets", "dog", "cat"],
+    "friendship": ["friends", "teamwork"],
+    "kids": ["children", "family", "family-friendly"],
+}
+
+# Tags the generators used to add for the models that made a post
+PROVENANCE_TAGS = {"ollama", "openai", "comfyui", "dalle", "generated", "ai", "ai-generated"}
+MODEL_TAG = re.compile(r"(:|\.safetensors$|\.ckpt$|^gpt-|^dall-e|^llama|^sd3|^sdxl|^mistral|^gemma|^qwen)")
+
+def _key(tag: str) -> str:
+    return re.sub(r"[\s_]+", "-", str(tag).strip().lstrip("#").lower()).strip("-")
+
+class TagVocabulary:
+    """Maps any spelling of a known tag to its canonical form."""
+
+    def __init__(self, vocabulary: Optional[Dict[str, List[str]]] = None, path: Optional[str] = None,
+                 keep_unknown: Optional[bool] = None):
+        vocabulary = dict(vocabulary or VOCABULARY)
+        path = path if path is not None else TAG_VOCABULARY
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    vocabulary.update(yaml.safe_load(f) or {})
+            except (OSError, yaml.YAMLError) as e:
+                logger.warning(f"Could not load tag vocabulary {path}: {e}")
+        self.canonical = {}
+        for tag, synonyms in vocabulary.items():
+            for spelling in [tag] + list(synonyms or []):
+                self.canonical[_key(spelling)] = _key(tag)
+        self.max_tags = TAG_MAX
+        if keep_unknown is None:
+            keep_unknown = TAG_KEEP_UNKNOWN
+        self.keep_unknown = keep_unknown
+
+    def lookup(self, tag: str) -> Optional[str]:
+        key = _key(tag)
+        if key in self.canonical:
+            return self.canonical[key]
+        # Plurals the vocabulary doesn't list
+        for singular in (key[:-1] if key.endswith("s") else None, key[:-2] if key.endswith("es") else None):
+            if singular and singular in self.canonical:
+                return self.canonical[singular]
+        return None
+
+    def normalize(self, tags: Iterable[Any], content_type: Optional[str] = None) -> List[str]:
+        """Canonical, deduplicated vocabulary tags, capped at TAG_MAX, most specific first."""
+        normalized, unknown = [], []
+        for tag in tags or []:
+            canonical = self.lookup(tag)
+            if canonical is None and _key(tag):
+                unknown.append(_key(tag))
+                if not self.keep_unknown:
+                    continue
+                canonical = _key(tag)
+            if canonical and canonical not in normalized:
+                normalized.append(canonical)
+        if unknown:
+            logger.info(f"{'Keeping' if self.keep_unknown else 'Dropping'} tags outside the vocabulary: {', '.join(unknown)}")
+        if not normalized and content_type:
+            # Never leave a post without tags
+            normalized = [self.lookup(content_type) or _key(content_type), "humor"]
+        # The content type is already the post's category, so it gives way first when over the cap
+        generic = [tag for tag in normalized if tag in ("story", "news", "ball", "humor")]
+        specific = [tag for tag in normalized if tag not in generic]
+        return (specific + generic)[:self.max_tags]
+
+_vocabulary = None
+
+def normalize_tags(tags: Iterable[Any], content_type: Optional[str] = None) -> List[str]:
+    """Normalize tags with the configured vocabulary."""
+    global _vocabulary
+    if _vocabulary is None:
+        _vocabulary = TagVocabulary()
+    return _vocabulary.normalize(tags, content_type)
+
+def provenance(llm_name: str, llm_model: str, images: Iterable[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Front-matter params recording the models that produced a post."""
+    params = {"llm": llm_name, "llm_model": llm_model}
+    backends, models = [], []
+    for image in images:
+        if not image:
+            continue
+        if image.get('backend'):
+            backend, model = image['backend'], [image['model']] if image.get('model') else []
+        elif image.get('tags'):
+            # Images journaled before provenance() recorded them as [backend, model] tags
+            backend, *model = image['tags']
+        else:
+            continue
+        if backend not in backends:
+            backends.append(backend)
+        models.extend(name for name in model if name not in models)
+    if backends:
+        params["image_backends"] = backends
+        params["image_models"] = models
+    return params
+
+def format_params(params: Dict[str, Any]) -> str:
+    """A YAML params block for the front matter; JSON values are valid YAML."""
+    if not params:
+        return ""
+    return "params:\n" + "".join(f"  {key}: {json.dumps(value)}\n" for key, value in params.items())
+
+def split_provenance(tags: Iterable[Any]) -> Tuple[List[str], Dict[str, Any]]:
+    """Separate the model tags older posts carry from their topic tags."""
+    topics, backends, models = [], [], []
+    for tag in tags or []:
+        key = _key(tag)
+        if key in ("ollama", "openai"):
+            backends.insert(0, key)
+        elif key in ("comfyui", "dalle"):
+            backends.append(key)
+        elif MODEL_TAG.search(str(tag).lower()):
+            models.append(str(tag))
+        elif key not in PROVENANCE_TAGS:
+            topics.append(tag)
+    params = {}
+    llm = next((backend for backend in backends if backend in ("ollama", "openai")), None)
+    image_backends = [backend for backend in backends if backend in ("comfyui", "dalle")]
+    llm_models = [model for model in models if not re.search(r"(\.safetensors|\.ckpt)$|^dall-e|^sd", model.lower())]
+    if llm:
+        params["llm"] = llm
+        if llm_models:
+            params["llm_model"] = llm_models[0]
+    if image_backends:
+        params["image_backends"] = image_backends
+        params["image_models"] = [model for model in models if model not in llm_models]
+    return topics, params
+
+FRONT_MATTER = re.compile(r"\A---\n(.*?)\n---\n", re.DOTALL)
+# The whole tags node: an inline list, or a block list on the lines below it
+TAGS_NODE = re.compile(r"^tags:.*(?:\n(?:[ \t]+\S.*|-(?:[ \t].*)?))*", re.MULTILINE)
+# A block params mapping, and the indent of its first key if it has one
+PARAMS_NODE = re.compile(r"^params:[ \t]*$(?=\n([ \t]+)\S|)", re.MULTILINE)
+
+def _merge_params(block: str, existing: Any, params: Dict[str, Any], title: str) -> Optional[str]:
+    """Add the provenance params a post's own params block lacks; its values win."""
+    match = PARAMS_NODE.search(block)
+    if not match or not isinstance(existing or {}, dict):
+        # Its model tags are the only record of the provenance, so leave them be
+        logger.warning(f"Not retagging \"{title}\": its params aren't a block mapping")
+        return None
+    missing = {key: value for key, value in params.items() if key not in (existing or {})}
+    indent = match.group(1) or "  "
+    lines = "".join(f"\n{indent}{key}: {json.dumps(value)}" for key, value in missing.items())
+    return block[:match.end()] + lines + block[match.end():]
+
+def retag_post(text: str, vocabulary: Optional[TagVocabulary] = None) -> Optional[str]:
+    """A post's text with normalized tags and provenance params, or None if nothing changes."""
+    match = FRONT_MATTER.match(text)
+    if not match:
+        return None
+    try:
+        front_matter = yaml.safe_load(match.group(1)) or {}
+    except yaml.YAMLError:
+        return None
+    tags = front_matter.get("tags")
+    if not isinstance(tags, list) or not TAGS_NODE.search(match.group(1)):
+        return None
+    categories = front_matter.get("categories") or []
+    topics, params = split_provenance(tags)
+    normalized = (vocabulary or TagVocabulary()).normalize(topics, categories[0] if categories else None)
+
+    block = TAGS_NODE.sub(lambda _: f"tags: {json.dumps(normalized)}", match.group(1), count=1)
+    if params and "params" not in front_matter:
+        block += "\n" + format_params(params).rstrip("\n")
+    elif params:
+        block = _merge_params(block, front_matter["params"], params, front_matter.get("title", ""))
+        if block is None:
+            return None
+    if block == match.group(1):
+        return None
+    return f"---\n{block}\n---\n" + text[match.end():]
+
+def backfill(content_root: str = os.path.join(BASE_DIR, "content"), dry_run: bool = True, keep_unknown: Optional[bool] = None) -> List[str]:
+    """Normalize the tags of every post under content_root; returns the posts that change."""
+    vocabulary = TagVocabulary(keep_unknown=keep_unknown)
+    changed = []
+    for directory, _, names in os.walk(content_root):
+        for name in names:
+            if not name.endswith(".md"):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            retagged = retag_post(text, vocabulary)
+            if retagged is None:
+                continue
+            changed.append(path)
+            if dry_run:
+                continue
+            with open(path + ".part", "w", encoding="utf-8") as f:
+                f.write(retagged)
+            os.replace(path + ".part", path)
+    logger.info(f"{'Would retag' if dry_run else 'Retagged'} {len(changed)} posts")
+    return changed
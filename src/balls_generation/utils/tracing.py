@@ -0,0 +1,111 @@
+"""Lightweight span tracing written as JSONL records.
+
+Tracing is enabled by setting TRACE_FILE. When it is unset, span() hands back
+a shared no-op span, so instrumented code pays for little more than a call.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from ..config.settings import TRACE_FILE
+
+logger = logging.getLogger(__name__)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_lock = threading.Lock()
+_trace_file = TRACE_FILE
+
+class Span:
+    """A timed unit of work that is written out as one JSONL record when it ends."""
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.outcome = None
+        self.started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+    def set(self, **attrs) -> None:
+        """Attach attributes, e.g. sizes or outcome, to the span."""
+        if 'outcome' in attrs:
+            self.outcome = attrs.pop('outcome')
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None:
+            self.outcome = "error"
+            self.attrs.setdefault("error", exc_type.__name__)
+        self.end()
+        return False
+
+    def end(self) -> None:
+        """Write the span record."""
+        record = {
+            "ts": self.started.isoformat(),
+            "trace": _trace_id.get(),
+            "span": self.name,
+            "duration_ms": round((time.perf_counter() - self._start) * 1000, 3),
+            "outcome": self.outcome or "ok",
+        }
+        record.update(self.attrs)
+        _write(record)
+
+class _NoopSpan:
+    """Stand-in used when tracing is disabled."""
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+_NOOP = _NoopSpan()
+
+def configure(trace_file: Optional[str]) -> None:
+    """Switch tracing to another file, or off with None."""
+    global _trace_file
+    _trace_file = trace_file
+
+def enabled() -> bool:
+    """Whether spans are being recorded."""
+    return bool(_trace_file)
+
+def span(name: str, **attrs):
+    """Start a span, for use as a context manager."""
+    if not _trace_file:
+        return _NOOP
+    return Span(name, **attrs)
+
+def trace(name: str, **attrs):
+    """Start a new trace (one per post) and its root span."""
+    if not _trace_file:
+        return _NOOP
+    _trace_id.set(uuid.uuid4().hex[:16])
+    return Span(name, **attrs)
+
+def _write(record: dict) -> None:
+    """Append a record to the trace file."""
+    line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+    try:
+        with _lock:
+            # A single O_APPEND write keeps lines intact across processes
+            fd = os.open(_trace_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+    except OSError as e:
+        logger.warning(f"Could not write trace record: {e}")
@@ -0,0 +1,369 @@
+"""A work queue of post jobs shared by generation workers on several machines.
+
+Jobs are enqueued on the machine that owns the content repository, any
+number of workers, each next to its own GPU, lease them, and the finished
+posts and images travel back through the queue to be collected into the
+repository. Throughput then scales by adding workers.
+
+A lease lasts WORK_LEASE_SECONDS and the worker renews it with heartbeats
+while it generates. If a worker dies, its lease runs out and the job goes
+back to the queue, until it has been tried WORK_MAX_ATTEMPTS times. Every
+lease carries a fencing token that increases each time the job is leased,
+and results are only accepted with the current token, so a worker that lost
+its lease (a long GC pause, a network partition) cannot overwrite the result
+of the worker that took over.
+
+WorkQueue is the interface; SQLiteWorkQueue keeps the queue in one SQLite
+file (WORK_QUEUE, default work.db), which suits workers on one machine or on
+a shared filesystem with working locks. Other backends implement the same
+methods and plug in through get_work_queue().
+"""
+
+import os
+import re
+import time
+import random
+import socket
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from .config.settings import BASE_DIR, WORK_QUEUE, WORK_LEASE_SECONDS, WORK_HEARTBEAT_SECONDS, WORK_MAX_ATTEMPTS
+from .utils.images import IMAGES_DIR
+from .utils.content import page_url
+from .utils.search_index import index_post
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = ("story", "news")
+
+# Images a post links to, as create_blog_post writes them
+IMAGE_LINK = re.compile(r"\]\(/images/([^)\s]+)\)")
+
+class Lease:
+    """A job leased to one worker, with the fencing token its results must carry."""
+
+    def __init__(self, job_id: int, token: int, content_type: str, publish_at: Optional[datetime], attempts: int):
+        self.job_id = job_id
+        self.token = token
+        self.content_type = content_type
+        self.publish_at = publish_at
+        self.attempts = attempts
+
+class FinishedJob:
+    """A job's output waiting to be collected: repository-relative path -> file contents."""
+
+    def __init__(self, job_id: int, artifacts: Dict[str, bytes]):
+        self.job_id = job_id
+        self.artifacts = artifacts
+
+class WorkQueue(ABC):
+    """Leased post jobs shared by generation workers."""
+
+    @abstractmethod
+    def enqueue(self, content_type: str, publish_at: Optional[datetime] = None) -> int:
+        """Add a job and return its ID."""
+        pass
+
+    @abstractmethod
+    def lease(self, owner: str) -> Optional[Lease]:
+        """Lease the oldest available job, or None if there is none."""
+        pass
+
+    @abstractmethod
+    def heartbeat(self, lease: Lease) -> bool:
+        """Extend a lease; False if it has been lost to another worker."""
+        pass
+
+    @abstractmethod
+    def complete(self, lease: Lease, artifacts: Dict[str, bytes]) -> bool:
+        """Store a job's output; False (and nothing stored) if the lease was lost."""
+        pass
+
+    @abstractmethod
+    def fail(self, lease: Lease, error: str) -> None:
+        """Give a job back, or mark it failed after its last attempt."""
+        pass
+
+    @abstractmethod
+    def finished(self) -> List[FinishedJob]:
+        """Completed jobs whose output hasn't been collected yet."""
+        pass
+
+    @abstractmethod
+    def mark_collected(self, job_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Jobs per state: queued, leased, done, collected, failed."""
+        pass
+
+class SQLiteWorkQueue(WorkQueue):
+    """The work queue in a single SQLite file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or WORK_QUEUE
+        self.lease_seconds = WORK_LEASE_SECONDS
+        self.max_attempts = WORK_MAX_ATTEMPTS
+        # The default rollback journal, unlike WAL, also works on network filesystems
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    content_type TEXT NOT NULL,
+                    publish_at TEXT,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    token INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_expires REAL,
+                    created REAL NOT NULL,
+                    finished REAL,
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    job_id INTEGER NOT NULL REFERENCES jobs (id),
+                    path TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (job_id, path)
+                );
+            """)
+
+    @contextmanager
+    def _connect(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        """A connection, in a transaction that holds the write lock from the start if write is set.
+        
+        A connection per call keeps the queue safe to use from the heartbeat thread.
+        """
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            if write:
+                db.execute("BEGIN IMMEDIATE")
+            yield db
+            if write:
+                db.execute("COMMIT")
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def enqueue(self, content_type: str, publish_at: Optional[datetime] = None) -> int:
+        with self._connect() as db:
+            cursor = db.execute("INSERT INTO jobs (content_type, publish_at, created) VALUES (?, ?, ?)",
+                                (content_type, publish_at.isoformat() if publish_at else None, time.time()))
+            return cursor.lastrowid
+
+    def _expire(self, db: sqlite3.Connection, now: float) -> None:
+        """Return jobs whose lease ran out to the queue, or fail them after their last attempt."""
+        for job_id, attempts, owner in db.execute(
+                "SELECT id, attempts, owner FROM jobs WHERE state = 'leased' AND lease_expires < ?", (now,)).fetchall():
+            state = "failed" if attempts >= self.max_attempts else "queued"
+            logger.warning(f"Lease on job {job_id} held by {owner} expired, job is {state}")
+            db.execute("UPDATE jobs SET state = ?, owner = NULL, error = ? WHERE id = ?",
+                       (state, f"lease expired on {owner}", job_id))
+
+    def lease(self, owner: str) -> Optional[Lease]:
+        now = time.time()
+        with self._connect(write=True) as db:
+            self._expire(db, now)
+            row = db.execute("SELECT id, content_type, publish_at, attempts, token FROM jobs "
+                             "WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            job_id, content_type, publish_at, attempts, token = row
+            db.execute("UPDATE jobs SET state = 'leased', owner = ?, token = ?, attempts = ?, lease_expires = ? WHERE id = ?",
+                       (owner, token + 1, attempts + 1, now + self.lease_seconds, job_id))
+        return Lease(job_id, token + 1, content_type,
+                     datetime.fromisoformat(publish_at) if publish_at else None, attempts + 1)
+
+    def heartbeat(self, lease: Lease) -> bool:
+        with self._connect() as db:
+            cursor = db.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                                (time.time() + self.lease_seconds, lease.job_id, lease.token))
+            return cursor.rowcount == 1
+
+    def complete(self, lease: Lease, artifacts: Dict[str, bytes]) -> bool:
+        with self._connect(write=True) as db:
+            cursor = db.execute("UPDATE jobs SET state = 'done', finished = ?, error = NULL "
+                                "WHERE id = ? AND token = ? AND state = 'leased'",
+                                (time.time(), lease.job_id, lease.token))
+            if cursor.rowcount != 1:
+                return False
+            db.executemany("INSERT OR REPLACE INTO artifacts (job_id, path, data) VALUES (?, ?, ?)",
+                           [(lease.job_id, path, data) for path, data in artifacts.items()])
+            return True
+
+    def fail(self, lease: Lease, error: str) -> None:
+        state = "failed" if lease.attempts >= self.max_attempts else "queued"
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET state = ?, owner = NULL, error = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                       (state, error, lease.job_id, lease.token))
+
+    def finished(self) -> List[FinishedJob]:
+        with self._connect() as db:
+            jobs = [row[0] for row in db.execute("SELECT id FROM jobs WHERE state = 'done' ORDER BY id")]
+            return [FinishedJob(job_id, dict(db.execute("SELECT path, data FROM artifacts WHERE job_id = ?", (job_id,))))
+                    for job_id in jobs]
+
+    def mark_collected(self, job_id: int) -> None:
+        with self._connect(write=True) as db:
+            db.execute("UPDATE jobs SET state = 'collected' WHERE id = ?", (job_id,))
+            db.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect(write=True) as db:
+            self._expire(db, time.time())
+            return dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+def get_work_queue() -> WorkQueue:
+    """Factory function to get the configured work queue."""
+    return SQLiteWorkQueue()
+
+def post_artifacts(filename: str) -> Dict[str, bytes]:
+    """A written post and its images, keyed by their path in the repository."""
+    if os.path.basename(filename) == "index.md":
+        # A leaf bundle carries its images with it
+        bundle = os.path.dirname(filename)
+        paths = [os.path.join(bundle, name) for name in os.listdir(bundle)]
+    else:
+        paths = [filename]
+        with open(filename, encoding="utf-8") as f:
+            paths += [os.path.join(IMAGES_DIR, image) for image in IMAGE_LINK.findall(f.read())]
+    artifacts = {}
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                artifacts[os.path.relpath(path, BASE_DIR).replace(os.sep, "/")] = f.read()
+    return artifacts
+
+class Worker:
+    """Leases jobs, generates their posts and hands the output back to the queue."""
+
+    def __init__(self, queue: Optional[WorkQueue] = None, name: Optional[str] = None):
+        from .generators.story import StoryGenerator
+        from .generators.news import NewsGenerator
+
+        self.queue = queue or get_work_queue()
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_seconds = WORK_HEARTBEAT_SECONDS
+        self.story_generator = StoryGenerator()
+        self.news_generator = NewsGenerator()
+
+    def _heartbeat(self, lease: Lease, done: threading.Event) -> None:
+        while not done.wait(self.heartbeat_seconds):
+            if not self.queue.heartbeat(lease):
+                logger.warning(f"Lost the lease on job {lease.job_id}, its result will be discarded")
+                return
+
+    def run_job(self, lease: Lease) -> bool:
+        """Generate one leased job's post; True if the queue accepted the result."""
+        logger.info(f"Worker {self.name} generating {lease.content_type} job {lease.job_id} (attempt {lease.attempts})")
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(lease, done), daemon=True).start()
+        filename = None
+        try:
+            if lease.content_type == "story":
+                filename = self.story_generator.generate_story(lease.publish_at)
+            else:
+                filename = self.news_generator.generate_article(lease.publish_at)
+        except Exception as e:
+            logger.error(f"Job {lease.job_id} failed: {e}")
+        finally:
+            done.set()
+
+        if not filename:
+            self.queue.fail(lease, "generation failed")
+            return False
+        artifacts = post_artifacts(filename)
+        accepted = self.queue.complete(lease, artifacts)
+        if not accepted:
+            logger.warning(f"Job {lease.job_id} was taken over by another worker, discarding {filename}")
+        # The collector owns the content repository, so the worker's copy goes either way
+        for path in artifacts:
+            try:
+                os.remove(os.path.join(BASE_DIR, path))
+            except OSError:
+                pass
+        if os.path.basename(filename) == "index.md":
+            try:
+                os.rmdir(os.path.dirname(filename))
+            except OSError:
+                pass
+        return accepted
+
+    def run(self, once: bool = False, poll_seconds: float = 5) -> int:
+        """Work until the queue is empty (once) or forever; returns the jobs completed."""
+        completed = 0
+        while True:
+            lease = self.queue.lease(self.name)
+            if lease is None:
+                if once:
+                    return completed
+                time.sleep(poll_seconds)
+                continue
+            if self.run_job(lease):
+                completed += 1
+
+def enqueue_posts(count: int, content_type: Optional[str] = None, queue: Optional[WorkQueue] = None) -> List[int]:
+    """Add jobs for count posts, of one content type or a random mix."""
+    queue = queue or get_work_queue()
+    return [queue.enqueue(content_type or random.choice(CONTENT_TYPES)) for _ in range(count)]
+
+def _renamed_bundles(job: FinishedJob) -> Dict[str, str]:
+    """Leaf bundles of a job that collide with a different post already here, and the directories they move to."""
+    renames = {}
+    for path, data in job.artifacts.items():
+        if not path.endswith("/index.md") or not os.path.exists(os.path.join(BASE_DIR, path)):
+            continue
+        with open(os.path.join(BASE_DIR, path), "rb") as f:
+            if f.read() != data:
+                # Bundle names only go down to the second too, and would share a directory
+                renames[os.path.dirname(path)] = f"{os.path.dirname(path)}-{job.job_id}"
+    return renames
+
+def collect(queue: Optional[WorkQueue] = None) -> List[str]:
+    """Write finished jobs' posts and images into this repository; returns the posts written."""
+    queue = queue or get_work_queue()
+    posts = []
+    images = os.path.relpath(IMAGES_DIR, BASE_DIR).replace(os.sep, "/")
+    for job in queue.finished():
+        renames = _renamed_bundles(job)
+        for path, data in job.artifacts.items():
+            # Workers are trusted to generate posts, not to write anywhere in the repository
+            if ".." in path.split("/") or not path.startswith(("content/", images + "/")):
+                logger.error(f"Job {job.job_id}: refusing to write {path}")
+                continue
+            if path.endswith(".md") and not path.endswith("/index.md") and os.path.exists(os.path.join(BASE_DIR, path)):
+                with open(os.path.join(BASE_DIR, path), "rb") as f:
+                    if f.read() != data:
+                        # Post names only go down to the second, so two workers can pick the same one
+                        stem = os.path.basename(path)[:-3]
+                        path = f"{path[:-3]}-{job.job_id}.md"
+                        # The image links point at the post itself by its old relative name
+                        data = data.replace(f"]({stem})".encode(), f"]({stem}-{job.job_id})".encode())
+            bundle = os.path.dirname(path)
+            if bundle in renames:
+                path = os.path.join(renames[bundle], os.path.basename(path))
+                if path.endswith("/index.md"):
+                    # The post links to its images and itself by the bundle's URL
+                    data = data.replace(page_url(os.path.join(BASE_DIR, bundle)).encode(),
+                                        page_url(os.path.join(BASE_DIR, renames[bundle])).encode())
+            path = os.path.join(BASE_DIR, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".part", "wb") as f:
+                f.write(data)
+            os.replace(path + ".part", path)
+            if path.endswith(".md"):
+                posts.append(path)
+                index_post(path)
+        queue.mark_collected(job.job_id)
+        logger.info(f"Collected job {job.job_id}: {', '.join(sorted(job.artifacts))}")
+    return posts
@@ -0,0 +1,127 @@
+// Search over the sharded index the generator writes to /search/.
+//
+// The manifest is small and always revalidated; shards are fetched newest
+// first, by hash so the browser keeps them until they change, and only until
+// enough results are found. A tag search only fetches shards with the tag.
+//
+//   ballsSearch.search("golf ball", {limit: 20, tag: "golf", from: "2025-01", to: "2025-06"})
+//
+// An <input data-balls-search="results-id"> is wired up automatically and
+// lists its results in the element with that id.
+(function () {
+    "use strict";
+
+    var root = "/search/";
+    var manifest = null;
+    var shards = {};
+
+    function loadManifest() {
+        if (!manifest) {
+            manifest = fetch(root + "manifest.json", {cache: "no-cache"}).then(function (response) {
+                if (!response.ok) {
+                    throw new Error("search manifest: " + response.status);
+                }
+                return response.json();
+            });
+        }
+        return manifest;
+    }
+
+    function loadShard(shard) {
+        if (!shards[shard.file]) {
+            shards[shard.file] = fetch(root + shard.file + "?v=" + shard.hash).then(function (response) {
+                return response.json();
+            });
+        }
+        return shards[shard.file];
+    }
+
+    function decode(index, post) {
+        var result = {};
+        index.fields.forEach(function (field, i) {
+            result[field] = post[i];
+        });
+        if (result.url.charAt(0) !== "/") {
+            result.url = index.base + result.url;
+        }
+        result.tags = result.tags ? result.tags.split(" ") : [];
+        return result;
+    }
+
+    function search(query, options) {
+        options = options || {};
+        var limit = options.limit || 20;
+        var terms = (query || "").toLowerCase().split(/\s+/).filter(Boolean);
+        return loadManifest().then(function (index) {
+            var wanted = index.shards.filter(function (shard) {
+                return (!options.from || shard.name >= options.from) &&
+                    (!options.to || shard.name <= options.to) &&
+                    (!options.tag || shard.tags.indexOf(options.tag) !== -1);
+            });
+            var results = [];
+
+            function next(i) {
+                if (i >= wanted.length || results.length >= limit) {
+                    return results.slice(0, limit);
+                }
+                return loadShard(wanted[i]).then(function (shard) {
+                    shard.posts.forEach(function (post) {
+                        var result = decode(index, post);
+                        var text = (result.title + " " + result.tags.join(" ") + " " + result.summary).toLowerCase();
+                        var matches = terms.every(function (term) {
+                            return text.indexOf(term) !== -1;
+                        });
+                        if (matches && (!options.tag || result.tags.indexOf(options.tag) !== -1)) {
+                            results.push(result);
+                        }
+                    });
+                    return next(i + 1);
+                });
+            }
+
+            return next(0);
+        });
+    }
+
+    function render(list, results) {
+        list.innerHTML = "";
+        results.forEach(function (result) {
+            var item = document.createElement("li");
+            var link = document.createElement("a");
+            link.href = result.url;
+            link.textContent = result.title;
+            item.appendChild(link);
+            item.appendChild(document.createTextNode(" " + result.date + " " + result.summary));
+            list.appendChild(item);
+        });
+    }
+
+    function wire() {
+        document.querySelectorAll("input[data-balls-search]").forEach(function (input) {
+            var list = document.getElementById(input.getAttribute("data-balls-search"));
+            var timer = null;
+            if (!list) {
+                return;
+            }
+            input.addEventListener("input", function () {
+                clearTimeout(timer);
+                timer = setTimeout(function () {
+                    if (!input.value.trim()) {
+                        list.innerHTML = "";
+                        return;
+                    }
+                    search(input.value).then(function (results) {
+                        render(list, results);
+                    });
+                }, 200);
+            });
+        });
+    }
+
+    window.ballsSearch = {search: search};
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", wire);
+    } else {
+        wire();
+    }
+})();
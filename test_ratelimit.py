@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Check that a 429 with Retry-After pauses the OpenAI rate limiter, without calling OpenAI."""
+import time
+
+import httpx
+import openai
+
+from balls_generation.utils.deadline import Deadline
+from balls_generation.utils.ratelimit import RateLimiter
+
+RETRY_AFTER = 1.0
+
+def rate_limited() -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": str(RETRY_AFTER)}, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+class RawResponse:
+    """What with_raw_response returns, as far as the limiter reads it."""
+
+    headers = {}
+
+    def parse(self):
+        return "ok"
+
+def main():
+    limiter = RateLimiter("test-model", rpm=0, tpm=0, max_concurrency=8, initial_concurrency=8)
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise rate_limited()
+        return RawResponse()
+
+    assert limiter.call(call, Deadline(10, "test")) == "ok"
+    waited = calls[1] - calls[0]
+    assert waited >= RETRY_AFTER, f"retried after {waited:.2f}s, before Retry-After"
+    assert limiter.limit < 8, "429 did not lower the concurrency limit"
+    print(f"retried after {waited:.2f}s (Retry-After {RETRY_AFTER}s), concurrency limit now {int(limiter.limit)}")
+
+    # The pause holds every caller of the model back, not just the one that got the 429
+    assert limiter.acquire(0, Deadline(5, "test"))
+    limiter.release(throttled=True, pause=RETRY_AFTER)
+    paused = time.monotonic()
+    assert not limiter.acquire(0, Deadline(RETRY_AFTER / 2, "test")), "acquired a slot during the pause"
+    assert limiter.acquire(0, Deadline(5, "test"))
+    waited = time.monotonic() - paused
+    limiter.release()
+    assert waited >= RETRY_AFTER - 0.05, f"the pause ended after {waited:.2f}s"
+    print(f"other callers waited {waited:.2f}s for the pause to end")
+
+    print("\nRate limiter checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Check lease expiry and fencing tokens on the SQLite work queue, without any providers."""
+import os
+import time
+import tempfile
+
+from balls_generation.workqueue import SQLiteWorkQueue
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = SQLiteWorkQueue(os.path.join(directory, "work.db"))
+        queue.lease_seconds = 0.5
+        job_id = queue.enqueue("story")
+
+        first = queue.lease("worker-1")
+        assert first is not None and first.job_id == job_id
+        assert queue.lease("worker-2") is None, "a leased job was leased twice"
+        assert queue.heartbeat(first), "heartbeat on a live lease failed"
+        print(f"worker-1 leased job {job_id} with token {first.token}")
+
+        # worker-1 stalls past its lease, so the job goes back to the queue
+        time.sleep(queue.lease_seconds + 0.2)
+        second = queue.lease("worker-2")
+        assert second is not None and second.job_id == job_id, "expired lease was not re-leased"
+        assert second.token > first.token, "re-lease did not bump the fencing token"
+        print(f"lease expired, worker-2 re-leased job {job_id} with token {second.token}")
+
+        # worker-1 wakes up and reports with its stale token
+        assert not queue.heartbeat(first), "stale heartbeat was accepted"
+        assert not queue.complete(first, {"content/en/posts/stale.md": b"stale"}), "stale token was accepted"
+        assert queue.finished() == [], "stale result was stored"
+        print("stale heartbeat and result from worker-1 rejected")
+
+        assert queue.complete(second, {"content/en/posts/fresh.md": b"fresh"})
+        finished = queue.finished()
+        assert [job.artifacts for job in finished] == [{"content/en/posts/fresh.md": b"fresh"}]
+        print("worker-2's result stored")
+
+    print("\nWork queue checks passed")
+
+if __name__ == "__main__":
+    main()